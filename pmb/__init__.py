@@ -25,16 +25,37 @@ import traceback
 
 from . import config
 from . import parse
+from .helpers import cache
+from .helpers import daemon
 from .helpers import frontend
 from .helpers import logging as pmb_logging
 from .helpers import other
+from .helpers import profile
+from .session import Session
 
 
 def main():
-    # Parse arguments, set up logging
+    # Parse arguments
     args = parse.arguments()
+
+    # Let a running "pmbootstrap daemon" execute the command
+    if daemon.forwardable(args):
+        ret = daemon.forward(args)
+        if ret is not None:
+            return ret
+
+    # Set up logging
     pmb_logging.init(args)
+    return run(args)
+
 
+def run(args):
+    """
+    Run the action from the parsed arguments (pmbootstrap daemon calls this
+    for each forwarded command).
+
+    :returns: exit code
+    """
     # Wrap everything to display nice error messages
     try:
         # Sanity check
@@ -51,6 +72,10 @@ def main():
         # Run the function with the action's name (in pmb/helpers/frontend.py)
         if args.action:
             getattr(frontend, args.action)(args)
+
+            # Keep the caches within their configured size limits
+            if args.action not in ["cache", "config"]:
+                cache.prune(args)
         else:
             logging.info("Run pmbootstrap -h for usage information.")
 
@@ -62,8 +87,13 @@ def main():
         logging.info("Run 'pmbootstrap log' for details.")
         logging.info("See also: <https://postmarketos.org/troubleshooting>")
         logging.debug(traceback.format_exc())
+        args.logfd.flush()
         return 1
 
+    finally:
+        args.cache.log_stats()
+        profile.write(args)
+
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -29,7 +29,8 @@ def generate(args, pkgname):
     # Install busybox-static in chroot (so we have the APKINDEX and verified
     # apks)
     arch = pkgname.split("-")[2]
-    apkindex = pmb.chroot.apk_static.download(args, "APKINDEX.tar.gz")
+    apkindex = pmb.chroot.apk_static.download(args, "APKINDEX.tar.gz",
+                                              int(args.apkindex_ttl))
     pmb.chroot.apk.install(args, ["busybox-static"], "buildroot_" + arch)
 
     # Parse version from APKINDEX
@@ -28,7 +28,8 @@ import pmb.chroot.apk_static
 def generate(args, pkgname):
     # Install musl in chroot (so we have the APKINDEX and verified musl apks)
     arch = pkgname.split("-")[1]
-    apkindex = pmb.chroot.apk_static.download(args, "APKINDEX.tar.gz")
+    apkindex = pmb.chroot.apk_static.download(args, "APKINDEX.tar.gz",
+                                              int(args.apkindex_ttl))
     pmb.chroot.apk.install(args, ["musl-dev"], "buildroot_" + arch)
 
     # Parse musl version from APKINDEX
@@ -21,5 +21,5 @@ from pmb.build.init import init
 from pmb.build.checksum import checksum
 from pmb.build.other import copy_to_buildpath, is_necessary, \
     symlink_noarch_package, find_aport, ccache_stats, index_repo
-from pmb.build.package import package
+from pmb.build.package import package, package_strict
 from pmb.build.menuconfig import menuconfig
@@ -26,6 +26,7 @@ import pmb.chroot
 import pmb.chroot.apk
 import pmb.helpers.run
 import pmb.parse
+import pmb.parse.kconfig
 
 
 def menuconfig(args, pkgname, arch):
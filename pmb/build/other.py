@@ -39,8 +39,8 @@ def find_aport(args, package, must_exist=True):
     # Try to get a cached result first (we assume, that the aports don't change
     # in one pmbootstrap call)
     ret = None
-    if package in args.cache["find_aport"]:
-        ret = args.cache["find_aport"][package]
+    if package in args.cache.find_aport:
+        ret = args.cache.find_aport[package]
     else:
         # Search in packages
         paths = glob.glob(args.aports + "/*/" + package)
@@ -64,7 +64,7 @@ def find_aport(args, package, must_exist=True):
                            package)
 
     # Save result in cache
-    args.cache["find_aport"][package] = ret
+    args.cache.find_aport[package] = ret
     return ret
 
 
@@ -112,8 +112,8 @@ def aports_files_out_of_sync_with_git(args, package=None):
         return ret
 
     # Use cached result if possible
-    if args.cache["aports_files_out_of_sync_with_git"] is not None:
-        return args.cache["aports_files_out_of_sync_with_git"]
+    if args.cache.aports_files_out_of_sync_with_git is not None:
+        return args.cache.aports_files_out_of_sync_with_git
 
     # Get the aport's git repository folder
     git_root = None
@@ -152,7 +152,7 @@ def aports_files_out_of_sync_with_git(args, package=None):
                      " 'pmbootstrap init'")
 
     # Save cache
-    args.cache["aports_files_out_of_sync_with_git"] = ret
+    args.cache.aports_files_out_of_sync_with_git = ret
     return ret
 
 
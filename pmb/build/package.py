@@ -25,6 +25,8 @@ import pmb.build.buildinfo
 import pmb.chroot
 import pmb.chroot.apk
 import pmb.chroot.distccd
+import pmb.chroot.overlay
+import pmb.helpers.profile
 import pmb.parse
 import pmb.parse.arch
 
@@ -57,6 +59,9 @@ def package(args, pkgname, carch, force=False, buildinfo=False, strict=False):
         return
 
     # Initialize build environment, install/build makedepends
+    profile_group = "build " + pkgname
+    pmb.helpers.profile.step(args, profile_group, "build " + pkgname +
+                             ": init", suffix=suffix, arch=carch_buildenv)
     pmb.build.init(args, suffix)
     if len(apkbuild["makedepends"]):
         if strict:
@@ -75,6 +80,7 @@ def package(args, pkgname, carch, force=False, buildinfo=False, strict=False):
 
     # Avoid re-building for circular dependencies
     if not force and not pmb.build.is_necessary(args, carch, apkbuild):
+        pmb.helpers.profile.step(args, profile_group)
         return
 
     # Configure abuild.conf
@@ -92,6 +98,8 @@ def package(args, pkgname, carch, force=False, buildinfo=False, strict=False):
                      " fail!")
 
     # Run abuild
+    pmb.helpers.profile.step(args, profile_group, "build " + pkgname +
+                             ": abuild", suffix=suffix, cross=str(cross))
     pmb.build.copy_to_buildpath(args, pkgname, suffix)
     cmd = []
     env = {"CARCH": carch_buildenv}
@@ -114,6 +122,8 @@ def package(args, pkgname, carch, force=False, buildinfo=False, strict=False):
     pmb.chroot.user(args, cmd, suffix, "/home/user/build")
 
     # Verify output file
+    pmb.helpers.profile.step(args, profile_group, "build " + pkgname +
+                             ": finish", suffix=suffix)
     path = args.work + "/packages/" + output
     if not os.path.exists(path):
         raise RuntimeError("Package not found after build: " + path)
@@ -135,4 +145,71 @@ def package(args, pkgname, carch, force=False, buildinfo=False, strict=False):
         logging.info("(" + suffix + ") uninstall makedepends")
         pmb.chroot.user(args, ["abuild", "undeps"], suffix, "/home/user/build")
 
+    pmb.helpers.profile.step(args, profile_group)
     return output
+
+
+def strict_suffixes(args, pkgname, carch, force=False, visited=None):
+    """
+    Find all chroots, that a strict build of a package uses: the one of the
+    package itself, and the ones of its makedepends, that get built first
+    (e.g. a cross makedepend in buildroot_<arch>), see package().
+
+    :param visited: (pkgname, carch) combinations, that have been checked
+                    already (for circular makedepends)
+    :returns: list of suffixes, starting with "native" (it is always
+              involved, for cross-compilers, distccd and qemu)
+    """
+    ret = ["native"]
+    visited = set() if visited is None else visited
+    if (pkgname, carch) in visited:
+        return ret
+    visited.add((pkgname, carch))
+
+    # Upstream only packages and packages, that get skipped by package()
+    aport = pmb.build.find_aport(args, pkgname, False)
+    if not aport:
+        return ret
+    apkbuild = pmb.parse.apkbuild(args, aport + "/APKBUILD")
+    if not force and not pmb.build.is_necessary(args, carch, apkbuild):
+        return ret
+
+    carch_buildenv = pmb.build.autodetect.carch(args, apkbuild, carch, True)
+    suffix = pmb.build.autodetect.suffix(args, apkbuild, carch_buildenv)
+    if suffix not in ret:
+        ret.append(suffix)
+    for makedepend in apkbuild["makedepends"]:
+        for suffix in strict_suffixes(args, makedepend, carch_buildenv,
+                                      visited=visited):
+            if suffix not in ret:
+                ret.append(suffix)
+    return ret
+
+
+def package_strict(args, pkgname, carch, force=False, buildinfo=False):
+    """
+    Build a package in strict mode, in throwaway overlayfs layers on top of
+    clean base chroots. Everything that gets installed during the build is
+    discarded afterwards, so the base chroots do not need to be zapped and
+    set up again for the next strict build.
+
+    :returns: output path relative to the packages folder
+    """
+    # Upstream only packages: nothing to build
+    aport = pmb.build.find_aport(args, pkgname, False)
+    if not aport:
+        return package(args, pkgname, carch, force, buildinfo, True)
+
+    # Find all chroots used by the build and the makedepends, that get
+    # built in strict mode as well
+    suffixes = strict_suffixes(args, pkgname, carch, force)
+
+    # Build with a fresh writable layer
+    pmb.chroot.overlay.prepare_base(args, suffixes)
+    try:
+        for suffix in suffixes:
+            pmb.chroot.overlay.mount(args, suffix)
+        return package(args, pkgname, carch, force, buildinfo, True)
+    finally:
+        for suffix in reversed(suffixes):
+            pmb.chroot.overlay.umount(args, suffix)
@@ -17,8 +17,8 @@ You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
 from pmb.chroot.init import init
-from pmb.chroot.mount import mount
-from pmb.chroot.root import root
+from pmb.chroot.mount import mount, mount_device_nodes
+from pmb.chroot.root import root, root_async
 from pmb.chroot.user import user
 from pmb.chroot.shutdown import shutdown
 from pmb.chroot.zap import zap
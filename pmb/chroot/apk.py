@@ -19,9 +19,12 @@ along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import logging
 import shlex
+import time
 
 import pmb.chroot
+import pmb.chroot.apk_prefetch
 import pmb.config
+import pmb.helpers.repo
 import pmb.parse.apkindex
 import pmb.parse.arch
 import pmb.parse.depends
@@ -39,7 +42,7 @@ def update_repository_list(args, suffix="native", check=False):
                   True.
     """
     # Skip if we already did this
-    if suffix in args.cache["apk_repository_list_updated"]:
+    if args.cache.chroot_checked(args.work, suffix, "apk_repository_list"):
         return
 
     # Read old entries or create folder structure
@@ -58,7 +61,7 @@ def update_repository_list(args, suffix="native", check=False):
     # Up to date: Save cache, return
     lines_new = pmb.helpers.repo.urls(args)
     if lines_old == lines_new:
-        args.cache["apk_repository_list_updated"].append(suffix)
+        args.cache.chroot_check_done(args.work, suffix, "apk_repository_list")
         return
 
     # Check phase: raise error when still outdated
@@ -75,14 +78,74 @@ def update_repository_list(args, suffix="native", check=False):
     update_repository_list(args, suffix, True)
 
 
+def index_marker_path(args, arch):
+    """
+    Path to the file, that records when the APKINDEX files of an arch have
+    been refreshed the last time (mtime) and from which repositories
+    (content).
+    """
+    return args.work + "/apkindex_updated_" + arch
+
+
+def index_is_outdated(args, arch):
+    """
+    Check if the APKINDEX files in cache_apk_$ARCH need to be refreshed.
+    This is the case, when they are older than args.apkindex_ttl seconds,
+    when the repository list has changed since then, or when one of the
+    files is missing.
+    """
+    path = index_marker_path(args, arch)
+    if not os.path.exists(path):
+        return True
+
+    # Repository list changed
+    with open(path) as handle:
+        if handle.read().splitlines() != pmb.helpers.repo.urls(args):
+            return True
+
+    # Index missing (e.g. cache folder deleted)
+    for index in pmb.helpers.repo.apkindex_files(args, arch):
+        if "/cache_apk_" in index and not os.path.exists(index):
+            return True
+
+    # Expired
+    return time.time() - os.path.getmtime(path) >= int(args.apkindex_ttl)
+
+
+def index_mark_updated(args, arch):
+    with open(index_marker_path(args, arch), "w") as handle:
+        handle.write("\n".join(pmb.helpers.repo.urls(args)) + "\n")
+
+
+def update_index(args, suffix="native"):
+    """
+    Refresh the APKINDEX files for the architecture of a chroot. All chroots
+    with the same architecture share these files (through cache_apk_$ARCH),
+    so this happens at most once per args.apkindex_ttl seconds, no matter
+    from which chroot it gets called. Does nothing with --offline.
+    """
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    if args.offline:
+        logging.debug("NOTE: Skipped APKINDEX refresh for " + arch +
+                      " (--offline)")
+        return
+    if not index_is_outdated(args, arch):
+        logging.debug("NOTE: Skipped APKINDEX refresh for " + arch +
+                      ", it has been done less than " + args.apkindex_ttl +
+                      " seconds ago")
+        return
+    pmb.chroot.root(args, ["apk", "update"], suffix)
+    index_mark_updated(args, arch)
+
+
 def check_min_version(args, suffix="native"):
     """
     Check the minimum apk version, before running it the first time in the
-    current session (lifetime of one pmbootstrap call).
+    current session (see pmb/session.py).
     """
 
     # Skip if we already did this
-    if suffix in args.cache["apk_min_version_checked"]:
+    if args.cache.chroot_checked(args.work, suffix, "apk_min_version"):
         return
 
     # Skip if apk is not installed yet
@@ -103,7 +166,7 @@ def check_min_version(args, suffix="native"):
                            " 'pmbootstrap zap -hc'")
 
     # Mark this suffix as checked
-    args.cache["apk_min_version_checked"].append(suffix)
+    args.cache.chroot_check_done(args.work, suffix, "apk_min_version")
 
 
 def install_is_necessary(args, build, arch, package, packages_installed):
@@ -220,25 +283,30 @@ def install(args, packages, suffix="native", build=True):
     logging.info(message)
 
     # Install/update everything
+    pmb.chroot.apk_prefetch.prefetch(args, packages_todo, suffix)
     packages_todo = replace_aports_packages_with_path(args, packages_todo,
                                                       suffix, arch)
-    pmb.chroot.root(args, ["apk", "--no-progress", "add", "-u"] + packages_todo,
-                    suffix)
+    command = ["apk", "--no-progress", "add", "-u"]
+    if args.offline:
+        command += ["--no-network"]
+    pmb.chroot.root(args, command + packages_todo, suffix)
 
 
-def upgrade(args, suffix="native", update_index=True):
+def upgrade(args, suffix="native", update_index=True, build=True):
     """
     Upgrade all packages installed in a chroot
+
+    :param build: build outdated packages (see install())
     """
     # Prepare apk and update index
     check_min_version(args, suffix)
     pmb.chroot.init(args, suffix)
     if update_index:
-        pmb.chroot.root(args, ["apk", "update"], suffix)
+        pmb.chroot.apk.update_index(args, suffix)
 
     # Rebuild and upgrade out-of-date packages
     packages = installed(args, suffix).keys()
-    install(args, packages, suffix)
+    install(args, packages, suffix, build)
 
 
 def installed(args, suffix="native"):
@@ -0,0 +1,169 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import base64
+import binascii
+import glob
+import hashlib
+import logging
+import os
+import zlib
+
+import pmb.helpers.run
+
+
+def checksum(path):
+    """
+    Calculate the checksum of an apk file, as it is stored in the APKINDEX
+    ("C:" field): the sha1 of the control segment, which is the second gzip
+    stream in the file (after the signature). The control segment contains
+    the hash of the data segment, so this identifies the whole package.
+
+    :returns: checksum like "Q1..." or None, when the file is not a valid
+              apk (or not signed)
+    """
+    sha1 = hashlib.sha1()
+    stream = 0
+    decompressor = zlib.decompressobj(31)
+    with open(path, "rb") as handle:
+        while stream < 2:
+            chunk = handle.read(65536)
+            if not chunk:
+                return None
+            while chunk and stream < 2:
+                try:
+                    decompressor.decompress(chunk)
+                except zlib.error:
+                    return None
+                if not decompressor.eof:
+                    if stream == 1:
+                        sha1.update(chunk)
+                    break
+                rest = decompressor.unused_data
+                if stream == 1:
+                    sha1.update(chunk[:len(chunk) - len(rest)])
+                stream += 1
+                decompressor = zlib.decompressobj(31)
+                chunk = rest
+    return "Q1" + base64.b64encode(sha1.digest()).decode()
+
+
+def blob_path(args, checksum):
+    """
+    :param checksum: from the APKINDEX or checksum()
+    :returns: path to the package in the blob store, or None when the
+              checksum has an unknown format
+    """
+    if not checksum or not checksum.startswith("Q1"):
+        return None
+    binary = base64.b64decode(checksum[2:])
+    return (args.work + "/cache_blobs/" +
+            binascii.hexlify(binary).decode() + ".apk")
+
+
+def link(args, source, target):
+    """
+    Hardlink a file (the apk caches and the blob store belong to root).
+    """
+    folder = os.path.dirname(target)
+    if not os.path.exists(folder):
+        pmb.helpers.run.root(args, ["mkdir", "-p", folder])
+    pmb.helpers.run.root(args, ["ln", "-f", source, target])
+
+
+def link_from_store(args, todo, cache):
+    """
+    Put packages, that are in the blob store already, into an apk cache.
+
+    :param todo: return value of pmb.chroot.apk_prefetch.download_list()
+    :param cache: the apk cache folder, e.g. $WORK/cache_apk_armhf
+    :returns: the entries of todo, that still need to be downloaded
+    """
+    ret = []
+    for entry in todo:
+        blob = blob_path(args, entry["checksum"])
+        if not blob or not os.path.exists(blob):
+            ret.append(entry)
+            continue
+        logging.verbose("Use " + entry["filename"] + " from the blob store")
+        link(args, blob, cache + "/" + entry["filename"])
+    return ret
+
+
+def store(args, todo, cache):
+    """
+    Add downloaded noarch packages to the blob store, so the apk caches of
+    other architectures can use them without downloading them again.
+
+    :param todo: entries from pmb.chroot.apk_prefetch.download_list()
+    :param cache: the apk cache folder, where they have been saved
+    """
+    for entry in todo:
+        path = cache + "/" + entry["filename"]
+        blob = blob_path(args, entry["checksum"])
+        if entry["noarch"] and blob and os.path.exists(path):
+            link(args, path, blob)
+
+
+def gc(args):
+    """
+    Remove packages from the blob store, that are not in any apk cache
+    anymore (e.g. after pmb.helpers.cache.prune() removed them).
+    """
+    unused = [path for path in glob.glob(args.work + "/cache_blobs/*.apk")
+              if os.stat(path).st_nlink == 1]
+    if len(unused):
+        logging.debug("Remove " + str(len(unused)) + " unused package(s)"
+                      " from the blob store")
+        pmb.helpers.run.root(args, ["rm", "-f"] + unused)
+
+
+def dedupe(args):
+    """
+    Convert the apk caches of an existing work folder to the blob store
+    layout: identical packages in multiple caches get replaced with
+    hardlinks to one copy in the blob store.
+    """
+    # Group the packages by checksum
+    groups = {}
+    for path in sorted(glob.glob(args.work + "/cache_apk_*/*.apk")):
+        checksum_path = checksum(path)
+        if checksum_path:
+            groups.setdefault(checksum_path, []).append(path)
+
+    # Link everything to the blob store
+    saved = 0
+    count = 0
+    for checksum_group, paths in sorted(groups.items()):
+        blob = blob_path(args, checksum_group)
+        if len(paths) == 1 and not os.path.exists(blob):
+            continue
+        if not os.path.exists(blob):
+            link(args, paths[0], blob)
+        inode = os.stat(blob).st_ino
+        for path in paths:
+            stat = os.stat(path)
+            if stat.st_ino == inode:
+                continue
+            logging.verbose("Deduplicate: " + path)
+            link(args, blob, path)
+            saved += stat.st_size
+            count += 1
+    gc(args)
+    logging.info("Deduplicated " + str(count) + " package(s), saved " +
+                 str(round(saved / 1024 / 1024, 1)) + " MiB")
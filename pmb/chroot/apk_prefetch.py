@@ -0,0 +1,151 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import base64
+import binascii
+import logging
+import os
+
+import pmb.chroot.apk_blobs
+import pmb.config
+import pmb.helpers.http
+import pmb.helpers.repo
+import pmb.helpers.run
+import pmb.parse.apkindex
+import pmb.parse.arch
+import pmb.parse.version
+
+
+def cache_filename(index_data):
+    """
+    Generate the filename, that apk uses for a package in its cache folder.
+    Example: "hello-world-1-r2.0123abcd.apk", where "0123abcd" is the hex
+    representation of the first bytes of the package's checksum.
+
+    See also: official implementation in apk-tools:
+    <https://git.alpinelinux.org/cgit/apk-tools/>
+    package.c: apk_pkg_format_cache_pkg()
+
+    :param index_data: return value from pmb.parse.apkindex.read()
+    :returns: the filename, or None when the checksum is missing or has an
+              unknown format
+    """
+    checksum = index_data.get("checksum", "")
+    if not checksum.startswith("Q1"):
+        return None
+    binary = base64.b64decode(checksum[2:])
+    return (index_data["pkgname"] + "-" + index_data["version"] + "." +
+            binascii.hexlify(binary[:4]).decode() + ".apk")
+
+
+def download_list(args, packages, arch):
+    """
+    Find the packages, that apk would need to download, because they are not
+    in the apk cache yet.
+
+    :param packages: package names, including all dependencies
+    :returns: [{"url": ..., "filename": ..., "size": ..., "checksum": ...,
+               "noarch": True/False}, ...]
+    """
+    cache = args.work + "/cache_apk_" + arch
+    local = pmb.helpers.repo.apkindex_files(args, arch)
+    remote = dict(pmb.helpers.repo.apkindex_files_remote(args, arch))
+    ret = []
+    for package in packages:
+        # Find the highest version (like apk does), prefer local repos
+        best = None
+        best_url = None
+        for index in local:
+            index_data = pmb.parse.apkindex.read(args, package, index, False)
+            if not index_data:
+                continue
+            if best and pmb.parse.version.compare(best["version"],
+                                                  index_data["version"]) != -1:
+                continue
+            best = index_data
+            best_url = remote.get(index)
+
+        # Skip local packages and packages already in the cache
+        if not best or not best_url:
+            continue
+        filename = cache_filename(best)
+        if not filename or os.path.exists(cache + "/" + filename):
+            continue
+        ret.append({"url": best_url + "/" + arch + "/" + best["pkgname"] +
+                    "-" + best["version"] + ".apk",
+                    "filename": filename,
+                    "size": int(best["size"]) if "size" in best else None,
+                    "checksum": best["checksum"],
+                    "noarch": best.get("arch") == "noarch"})
+    return ret
+
+
+def download(args, todo, folder):
+    """
+    Download the packages from download_list() concurrently. Failed downloads
+    only get logged, apk will try to download them again when installing.
+
+    :returns: list of paths to the downloaded files
+    """
+    ret = []
+    jobs = [{"url": entry["url"], "path": folder + "/" + entry["filename"],
+             "size": entry["size"]} for entry in todo]
+    errors = pmb.helpers.http.fetch_many(jobs,
+                                         pmb.config.apk_prefetch_threads)
+    for job, error in zip(jobs, errors):
+        if error:
+            logging.warning("WARNING: Failed to prefetch " + job["url"] +
+                            ": " + str(error))
+            continue
+        logging.verbose("Prefetched: " + job["url"])
+        ret.append(job["path"])
+    return ret
+
+
+def prefetch(args, packages, suffix="native"):
+    """
+    Download missing packages in parallel into the apk cache of the chroot's
+    arch, so the following "apk add" can install them from the cache instead
+    of downloading them one after another.
+
+    :param packages: package names, including all dependencies
+    """
+    if args.offline:
+        return
+    arch = pmb.parse.arch.from_chroot_suffix(args, suffix)
+    cache = args.work + "/cache_apk_" + arch
+    if not os.path.exists(cache):
+        return
+    todo = download_list(args, packages, arch)
+    todo = pmb.chroot.apk_blobs.link_from_store(args, todo, cache)
+    if not len(todo):
+        return
+
+    # Download to a folder owned by the user, then move everything into the
+    # apk cache (owned by root) at once
+    logging.info("(" + suffix + ") prefetch " + str(len(todo)) +
+                 " package(s)")
+    folder = args.work + "/cache_apk_prefetch_" + arch
+    if os.path.exists(folder):
+        pmb.helpers.run.root(args, ["rm", "-rf", folder])
+    pmb.helpers.run.user(args, ["mkdir", "-p", folder])
+    paths = download(args, todo, folder)
+    if len(paths):
+        pmb.helpers.run.root(args, ["mv"] + paths + [cache + "/"])
+    pmb.helpers.run.root(args, ["rm", "-rf", folder])
+    pmb.chroot.apk_blobs.store(args, todo, cache)
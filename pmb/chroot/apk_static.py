@@ -146,19 +146,24 @@ def extract(args, version, apk_path):
     shutil.move(temp_path, target_path)
 
 
-def download(args, file):
+def download(args, file, max_age=None):
     """
     Download a single file from an Alpine mirror.
+
+    :param max_age: see pmb.helpers.http.download()
     """
     base_url = args.mirror_alpine + "edge/main/" + args.arch_native
-    return pmb.helpers.http.download(args, base_url + "/" + file, file)
+    return pmb.helpers.http.download(args, base_url + "/" + file, file,
+                                     max_age=max_age)
 
 
 def init(args):
     """
     Download, verify, extract $WORK/apk.static.
     """
-    apkindex = download(args, "APKINDEX.tar.gz")
+    # The index changes with every apk-tools-static upgrade, revalidate it
+    # like the APKINDEX files of the chroots
+    apkindex = download(args, "APKINDEX.tar.gz", int(args.apkindex_ttl))
     index_data = pmb.parse.apkindex.read(args, "apk-tools-static", apkindex)
     version = index_data["version"]
     version_min = pmb.config.apk_tools_static_min_version
@@ -20,6 +20,7 @@ import os
 import logging
 
 import pmb.helpers.run
+import pmb.helpers.userns
 import pmb.parse
 import pmb.parse.arch
 
@@ -35,6 +36,8 @@ def register(args, arch):
     arch_debian = pmb.parse.arch.alpine_to_debian(arch)
     if is_registered(arch_debian):
         return
+    pmb.helpers.userns.check_supported(args, "Registering qemu-" +
+                                       arch_debian + " in binfmt_misc")
     pmb.chroot.apk.install(args, ["qemu-user-static-repack",
                                   "qemu-user-static-repack-binfmt"])
     info = pmb.parse.binfmt_info(args, arch_debian)
@@ -64,5 +67,9 @@ def unregister(args, arch):
     binfmt_file = "/proc/sys/fs/binfmt_misc/qemu-" + arch_debian
     if not os.path.exists(binfmt_file):
         return
+    if args.backend == "userns":
+        logging.debug("NOTE: Not unregistering qemu binfmt (" + arch_debian +
+                      "), because it needs root privileges on the host")
+        return
     logging.info("Unregister qemu binfmt (" + arch_debian + ")")
     pmb.helpers.run.root(args, ["sh", "-c", "echo -1 > " + binfmt_file])
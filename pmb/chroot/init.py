@@ -84,14 +84,18 @@ def init(args, suffix="native"):
     pmb.chroot.apk.update_repository_list(args, suffix)
 
     # Install alpine-base (no clean exit for non-native chroot!)
-    pmb.chroot.apk_static.run(args, ["-U", "--root", chroot,
-                                     "--cache-dir", apk_cache, "--initdb", "--arch", arch,
-                                     "add", "alpine-base"], check=(not emulate))
-
-    # Create device nodes
+    update = ["--no-network"] if args.offline else ["-U"]
+    pmb.chroot.apk_static.run(args, update + ["--root", chroot,
+                                              "--cache-dir", apk_cache, "--initdb", "--arch", arch,
+                                              "add", "alpine-base"], check=(not emulate))
+    if not args.offline:
+        pmb.chroot.apk.index_mark_updated(args, arch)
+
+    # Create device nodes (userns: /dev exists now, bind the host's nodes)
+    pmb.chroot.mount_device_nodes(args, suffix)
     for dev in pmb.config.chroot_device_nodes:
         path = chroot + "/dev/" + str(dev[4])
-        if not os.path.exists(path):
+        if not os.path.exists(path) and args.backend != "userns":
             pmb.helpers.run.root(args, ["mknod",
                                         "-m", str(dev[0]),  # permissions
                                         path,  # name
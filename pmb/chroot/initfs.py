@@ -22,6 +22,7 @@ import pmb.chroot.initfs_hooks
 import pmb.chroot.other
 import pmb.chroot.apk
 import pmb.helpers.cli
+import pmb.parse.cpio
 
 
 def build(args, flavor, suffix):
@@ -61,35 +62,27 @@ def extract(args, flavor, suffix, extra=False):
             raise RuntimeError("Aborted!")
         pmb.chroot.root(args, ["rm", "-r", inside], suffix)
 
-    # Extraction script (because passing a file to stdin is not allowed
-    # in pmbootstrap's chroot/shell functions for security reasons)
-    with open(args.work + "/chroot_" + suffix + "/tmp/_extract.sh", "w") as handle:
-        handle.write(
-            "#!/bin/sh\n"
-            "cd " + inside + " && cpio -i < _initfs\n")
-
-    # Extract
-    commands = [["mkdir", "-p", inside],
-                ["cp", "/boot/initramfs-" + flavor, inside + "/_initfs.gz"],
-                ["gzip", "-d", inside + "/_initfs.gz"],
-                ["cat", "/tmp/_extract.sh"],  # for the log
-                ["sh", "/tmp/_extract.sh"],
-                ["rm", "/tmp/_extract.sh", inside + "/_initfs"]
-                ]
-    for command in commands:
-        pmb.chroot.root(args, command, suffix)
+    # Extract in one pass, directly from the gzip compressed archive
+    initfs = args.work + "/chroot_" + suffix + "/boot/initramfs-" + flavor
+    logging.debug("Extract " + initfs + " to " + outside)
+    skipped = pmb.parse.cpio.extract(initfs, outside)
+    for name in skipped:
+        logging.verbose("Skipped (device node or unsafe path): " + name)
 
     # Return outside path for logging
     return outside
 
 
 def ls(args, flavor, suffix, extra=False):
-    tmp = "/tmp/initfs-extracted"
+    """
+    List the content of the initramfs (or initramfs-extra) without
+    extracting it.
+    """
     if extra:
-        tmp = "/tmp/initfs-extra-extracted"
-    extract(args, flavor, suffix, extra)
-    pmb.chroot.user(args, ["ls", "-lahR", "."], suffix, tmp, log=False)
-    pmb.chroot.root(args, ["rm", "-r", tmp], suffix)
+        flavor += "-extra"
+    initfs = args.work + "/chroot_" + suffix + "/boot/initramfs-" + flavor
+    for line in pmb.parse.cpio.ls(initfs):
+        logging.info(line)
 
 
 def frontend(args):
@@ -41,3 +41,20 @@ def mount(args, suffix="native"):
     for source, target in mountpoints.items():
         target_full = args.work + "/chroot_" + suffix + target
         pmb.helpers.mount.bind(args, source, target_full)
+
+    mount_device_nodes(args, suffix)
+
+
+def mount_device_nodes(args, suffix="native"):
+    """
+    Bind mount the device nodes from the host, when using the userns backend
+    (mknod is not allowed in a user namespace). The bind mounts are private
+    to the namespace of the current session, so this needs to be done every
+    time, not only when the chroot gets created.
+    """
+    dev = args.work + "/chroot_" + suffix + "/dev"
+    if args.backend != "userns" or not os.path.isdir(dev):
+        return
+    for node in pmb.config.chroot_device_nodes:
+        pmb.helpers.mount.bind_blockdevice(args, "/dev/" + node[4],
+                                           dev + "/" + node[4])
@@ -0,0 +1,144 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+
+import pmb.build
+import pmb.chroot
+import pmb.chroot.distccd
+import pmb.helpers.mount
+import pmb.helpers.run
+
+
+def world(args, suffix):
+    """
+    Read the explicitly installed packages of a chroot.
+
+    :returns: sorted list of the lines in /etc/apk/world, or None when the
+              chroot has not been initialized yet
+    """
+    path = args.work + "/chroot_" + suffix + "/etc/apk/world"
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return sorted(handle.read().split())
+
+
+def world_recorded(args, suffix):
+    """
+    :returns: the world list, that was saved after preparing the base chroot,
+              or None when it has not been prepared yet
+    """
+    path = args.work + "/overlay_" + suffix + "/world"
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return sorted(handle.read().split())
+
+
+def is_clean(args, suffix):
+    """
+    Check if the chroot still has exactly the packages installed, that it had
+    after preparing it as base for strict builds.
+    """
+    current = world(args, suffix)
+    return current is not None and current == world_recorded(args, suffix)
+
+
+def remove_chroot(args, suffix):
+    """
+    Delete a chroot together with its overlay folder. Everything must be
+    umounted already.
+    """
+    for folder in ["chroot_", "overlay_"]:
+        path = args.work + "/" + folder + suffix
+        if os.path.exists(path):
+            pmb.helpers.run.root(args, ["rm", "-rf", path])
+    args.cache.invalidate_chroot(suffix)
+
+
+def prepare_base(args, suffixes):
+    """
+    Make sure, that the chroots only contain the build environment, so they
+    can be used as lower layer for strict builds. Chroots that have been
+    modified since they were prepared (e.g. by a non-strict build) get
+    zapped and set up again.
+
+    :param suffixes: all chroots, that the strict build will use
+    """
+    dirty = [suffix for suffix in suffixes if not is_clean(args, suffix)]
+    if not len(dirty):
+        return
+
+    logging.info("Prepare clean base chroots for strict mode: " +
+                 ", ".join(dirty))
+    pmb.chroot.shutdown(args)
+    for suffix in dirty:
+        remove_chroot(args, suffix)
+
+    # Initialize all at once, because setting up a foreign arch chroot
+    # installs packages in the native chroot
+    for suffix in suffixes:
+        pmb.build.init(args, suffix)
+    for suffix in suffixes:
+        path = args.work + "/overlay_" + suffix + "/world"
+        pmb.helpers.run.user(args, ["mkdir", "-p", os.path.dirname(path)])
+        with open(path, "w") as handle:
+            handle.write("\n".join(world(args, suffix)) + "\n")
+
+
+def mount(args, suffix):
+    """
+    Put an empty, writable overlayfs layer on top of the chroot. All changes
+    made inside the chroot after this call get discarded by umount().
+    """
+    chroot = args.work + "/chroot_" + suffix
+    overlay = args.work + "/overlay_" + suffix
+    upper = overlay + "/upper"
+    work = overlay + "/work"
+
+    # The lower layer must not contain the bind mounts of the chroot
+    # (overlayfs does not follow them). They get mounted again on top.
+    pmb.helpers.mount.umount_all(args, chroot)
+    if os.path.exists(upper) or os.path.exists(work):
+        pmb.helpers.run.root(args, ["rm", "-rf", upper, work])
+    pmb.helpers.run.root(args, ["mkdir", "-p", upper, work])
+
+    logging.debug("(" + suffix + ") mount overlay " + upper)
+    pmb.helpers.run.root(args, ["mount", "-t", "overlay", "-o",
+                                "lowerdir=" + chroot + ",upperdir=" + upper +
+                                ",workdir=" + work, "overlay", chroot])
+    if not pmb.helpers.mount.ismount(chroot):
+        raise RuntimeError("Failed to mount overlay on: " + chroot +
+                           " (is your kernel built with CONFIG_OVERLAY_FS?)")
+    pmb.chroot.mount(args, suffix)
+
+
+def umount(args, suffix):
+    """
+    Throw away the writable layer, that was created with mount().
+    """
+    chroot = args.work + "/chroot_" + suffix
+    overlay = args.work + "/overlay_" + suffix
+    if suffix == "native":
+        pmb.chroot.distccd.stop(args)
+    pmb.helpers.mount.umount_all(args, chroot)
+    pmb.helpers.run.root(args, ["rm", "-rf", overlay + "/upper",
+                                overlay + "/work"])
+    args.cache.invalidate_chroot(suffix)
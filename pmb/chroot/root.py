@@ -40,47 +40,78 @@ def executables_absolute_path():
     return ret
 
 
-def root(args, cmd, suffix="native", working_dir="/", log=True,
-         auto_init=True, return_stdout=False, check=True):
+def command(args, cmd, suffix, working_dir):
     """
-    Run a command inside a chroot as root.
+    Build the full command, that runs cmd inside a chroot as root.
 
-    :param log: When set to true, redirect all output to the logfile
-    :param auto_init: Automatically initialize the chroot
+    :returns: (full command, log message)
     """
-    # Get and verify chroot folder
-    chroot = args.work + "/chroot_" + suffix
-    if not auto_init and not os.path.islink(chroot + "/bin/sh"):
-        raise RuntimeError("Chroot does not exist: " + chroot)
-
-    if auto_init:
-        pmb.chroot.init(args, suffix)
-
     # Run the args with sudo chroot, and with cleaned environment
     # variables
     executables = executables_absolute_path()
-    for i in range(len(cmd)):
-        cmd[i] = shlex.quote(cmd[i])
+    chroot = args.work + "/chroot_" + suffix
+    cmd = [shlex.quote(word) for word in cmd]
     cmd_inner_shell = ("cd " + shlex.quote(working_dir) + ";" +
                        " ".join(cmd))
 
-    cmd_full = ["sudo", executables["sh"], "-c",
-                "env -i" +  # unset all
-                " CHARSET=UTF-8" +
-                " PATH=" + pmb.config.chroot_path +
-                " SHELL=/bin/ash" +
-                " HISTFILE=~/.ash_history" +
-                " " + executables["chroot"] +
-                " " + chroot +
-                " sh -c " + shlex.quote(cmd_inner_shell)
-                ]
+    cmd_full = pmb.helpers.run.sudo(args, [
+        executables["sh"], "-c",
+        "env -i" +  # unset all
+        " CHARSET=UTF-8" +
+        " PATH=" + pmb.config.chroot_path +
+        " SHELL=/bin/ash" +
+        " HISTFILE=~/.ash_history" +
+        " " + executables["chroot"] +
+        " " + chroot +
+        " sh -c " + shlex.quote(cmd_inner_shell)
+    ])
 
     # Generate log message
     log_message = "(" + suffix + ") % "
     if working_dir != "/":
         log_message += "cd " + working_dir + " && "
     log_message += " ".join(cmd)
+    return (cmd_full, log_message)
 
-    # Run the command
+
+def prepare(args, suffix, auto_init):
+    """
+    Verify, that the chroot exists, or initialize it.
+    """
+    chroot = args.work + "/chroot_" + suffix
+    if not auto_init and not os.path.islink(chroot + "/bin/sh"):
+        raise RuntimeError("Chroot does not exist: " + chroot)
+
+    if auto_init:
+        pmb.chroot.init(args, suffix)
+
+
+def root(args, cmd, suffix="native", working_dir="/", log=True,
+         auto_init=True, return_stdout=False, check=True):
+    """
+    Run a command inside a chroot as root.
+
+    :param log: When set to true, redirect all output to the logfile
+    :param auto_init: Automatically initialize the chroot
+    """
+    prepare(args, suffix, auto_init)
+    cmd_full, log_message = command(args, cmd, suffix, working_dir)
     return pmb.helpers.run.core(args, cmd_full, log_message, log,
-                                return_stdout, check)
+                                return_stdout, check, suffix=suffix)
+
+
+def root_async(args, cmd, suffix="native", working_dir="/", auto_init=True,
+               return_stdout=False, check=True, loop=None):
+    """
+    Start a command inside a chroot as root, without waiting for it. The
+    chroot gets initialized before returning (if necessary).
+
+    :returns: asyncio future, see pmb.helpers.run_async.run_async()
+    """
+    import pmb.helpers.run_async
+    prepare(args, suffix, auto_init)
+    cmd_full, log_message = command(args, cmd, suffix, working_dir)
+    return pmb.helpers.run_async.run_async(args, cmd_full, log_message,
+                                           return_stdout=return_stdout,
+                                           check=check, loop=loop,
+                                           suffix=suffix)
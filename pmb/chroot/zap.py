@@ -45,6 +45,7 @@ def zap(args, confirm=True, packages=False, http=False, mismatch_bins=False, dis
         "chroot_native",
         "chroot_buildroot_*",
         "chroot_rootfs_*",
+        "overlay_*",
     ]
     if packages:
         patterns += ["packages"]
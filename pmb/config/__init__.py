@@ -44,11 +44,35 @@ apk_tools_static_min_version = "2.7.2-r0"
 # overriden on the commandline)
 defaults = {
     "alpine_version": "edge",  # alternatively: latest-stable
+    # Refresh the APKINDEX files of each arch at most once in this many seconds
+    "apkindex_ttl": "3600",
     "aports": os.path.normpath(pmb_src + "/aports"),
+    "backend": "sudo",  # see "backends" below
+    # Size limits in MiB for the caches in the work folder, "0" means no
+    # limit. See "cache_folders" below and pmb/helpers/cache.py.
+    "cache_budget": "0",  # all caches together
+    "cache_budget_apk": "0",
+    "cache_budget_ccache": "0",
+    "cache_budget_distfiles": "0",
+    "cache_budget_git": "0",
+    "cache_budget_http": "0",
+    "cache_budget_images": "0",
     "config": os.path.expanduser("~") + "/.config/pmbootstrap.cfg",
     "device": "samsung-i9100",
     "extra_packages": "none",
+    # Free space (and inodes) to add to the filesystems of the system image,
+    # in percent of what the files need
+    "image_size_margin": "10",
+    # Count of system images (or recovery zips), that "pmbootstrap install"
+    # keeps to serve the same installation again (see
+    # pmb/install/cache.py), 0 to disable. Cached installations keep their
+    # passwords, so this is opt-in.
+    "image_cache_count": "0",
     "jobs": str(multiprocessing.cpu_count() + 1),
+    # Compression of the rootfs archive in the recovery zip (see
+    # pmb/helpers/compress.py): "gzip" or "none", and the level (1 - 9)
+    "recovery_compression": "gzip",
+    "recovery_compression_level": "6",
     "timestamp_based_rebuild": True,
     "log": "$WORK/log.txt",
     "mirror_alpine": "https://nl.alpinelinux.org/alpine/",
@@ -67,6 +91,33 @@ defaults = {
     "iter_time": "200"
 }
 
+# How pmbootstrap gets root privileges for mounting, chrooting etc.:
+# "sudo": run every privileged command through sudo
+# "userns": enter an unprivileged user and mount namespace once per session
+#           (requires subordinate uids/gids in /etc/subuid and /etc/subgid)
+backends = ["sudo", "userns"]
+
+# Log file: maximum time in seconds and buffer size, after which the log gets
+# written to disk. Size in bytes, after which the log gets compressed to
+# log.txt.1.gz (older ones get moved to log.txt.2.gz etc.), and the maximum
+# count of compressed logs.
+log_flush_interval = 1
+log_buffer_size = 64 * 1024
+log_rotate_size = 16 * 1024 * 1024
+log_rotate_count = 5
+
+# pmbootstrap daemon (pmb/helpers/daemon.py): actions, that always run in the
+# pmbootstrap process itself (interactive or fast enough anyway), and the
+# socket in $WORK, that the daemon listens on
+daemon_local_actions = ["config", "daemon", "init", "log", "log_distccd"]
+daemon_socket = "daemon.sock"
+
+# In-memory caches of parsed files (pmb/session.py): maximum count of entries
+# and total size in bytes of the parsed files (uncompressed), after which the
+# least recently used ones get dropped
+session_cache_limits = {"apkindex": (32, 64 * 1024 * 1024),
+                        "apkbuild": (4096, 16 * 1024 * 1024)}
+
 #
 # CHROOT
 #
@@ -105,6 +156,33 @@ chroot_mount_bind = {
     "$WORK/packages": "/home/user/packages/user",
 }
 
+# Maximum count of packages, that get downloaded at the same time before
+# installing them in a chroot
+apk_prefetch_threads = 8
+
+# Caches with a size limit ("cache_budget_*" in defaults above), where the
+# least recently used entries get removed: {name: (folder pattern inside
+# $WORK, True if each top-level folder is one entry, False for each file)}
+cache_folders = {
+    "apk": ("cache_apk_*", False),
+    "ccache": ("cache_ccache_*", False),
+    "distfiles": ("cache_distfiles", False),
+    "git": ("cache_git", True),
+    "http": ("cache_http", False),
+    "images": ("cache_images", True),
+}
+
+# Files, that never get removed from the caches (ccache configuration)
+cache_protected_names = ["ccache.conf", "CACHEDIR.TAG"]
+
+# Downloads (pmb.helpers.http): default count of parallel downloads in
+# fetch_many(), socket timeout in seconds, attempts per file (interrupted
+# downloads get resumed) and maximum count of redirects
+http_threads = 4
+http_timeout = 60
+http_retries = 3
+http_redirects_max = 5
+
 # The package alpine-base only creates some device nodes. Specify here, which
 # additional nodes will get created during initialization of the chroot.
 # Syntax for each entry: [permissions, type, major, minor, name]
@@ -221,6 +299,10 @@ default_ip = "172.16.42.1"
 # INSTALL
 #
 
+# Free space in the boot partition of the system image in bytes (room for
+# kernel upgrades), on top of the image_size_margin
+install_boot_free = 15 * 1024 * 1024
+
 # Packages, that will be installed inside the native chroot to perform
 # the installation to the device.
 # util-linux: losetup, fallocate
@@ -248,6 +330,10 @@ flash_mount_bind = [
     "/dev/bus/usb/"
 ]
 
+# Chunk size of the manifests of flashed system images (see
+# pmb/flasher/delta.py)
+flash_delta_chunk_size = 1024 * 1024
+
 """
 Flasher abstraction. Allowed variables:
 
@@ -24,7 +24,6 @@ import pmb.config
 import pmb.helpers.cli
 import pmb.helpers.devices
 import pmb.helpers.ui
-import pmb.chroot.zap
 import pmb.parse.deviceinfo
 
 
@@ -80,6 +79,7 @@ def ask_for_keymaps(args, device):
 
 
 def init(args):
+    import pmb.chroot
     cfg = pmb.config.load(args)
 
     # Device
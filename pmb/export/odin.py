@@ -16,13 +16,121 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import gzip
+import hashlib
 import logging
+import os
+import shutil
+import tarfile
+import time
 
 import pmb.build
+import pmb.chroot
 import pmb.chroot.apk
 import pmb.config
 import pmb.flasher
 import pmb.helpers.file
+import pmb.helpers.run
+
+
+def md5_line(digest, name):
+    """
+    :returns: the line, that "md5sum -t" prints, as bytes (Odin expects it
+              at the end of each file)
+    """
+    return (digest + "  " + name + "\n").encode()
+
+
+class Md5Reader(object):
+    """
+    Read a file and calculate its md5 on the way, then return the md5 line
+    as if it was appended to the file.
+    """
+
+    def __init__(self, handle, name):
+        self.handle = handle
+        self.name = name
+        self.md5 = hashlib.md5()
+        self.trailer = None
+
+    def read(self, size=-1):
+        ret = b""
+        if self.trailer is None:
+            ret = self.handle.read(size)
+            self.md5.update(ret)
+            if size >= 0 and len(ret) == size:
+                return ret
+            # Less than requested: end of the file
+            self.trailer = md5_line(self.md5.hexdigest(), self.name)
+        rest = self.trailer if size < 0 else self.trailer[:size - len(ret)]
+        self.trailer = self.trailer[len(rest):]
+        return ret + rest
+
+
+class Md5Writer(object):
+    """
+    Write to a file and calculate the md5 of everything written.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.md5.update(data)
+        return self.handle.write(data)
+
+
+def add_member(tar, path, name):
+    """
+    Add a file with its md5 line appended to the tar (like a ".bin.md5"
+    file), reading it only once.
+    """
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.size = os.path.getsize(path) + len(md5_line("0" * 32, name))
+    tarinfo.mode = 0o644
+    tarinfo.mtime = int(time.time())
+    with open(path, "rb") as handle:
+        tar.addfile(tarinfo, Md5Reader(handle, name))
+
+
+def write_tar(members, path):
+    """
+    Create the Odin flashable tar in one pass: the members get streamed into
+    the tar, and the md5 line of the tar itself gets appended at the end.
+
+    :param members: [(path to the file, name in the tar), ...]
+    :param path: of the ".tar.md5" file
+    """
+    name = os.path.basename(path)[:-len(".md5")]
+    with open(path, "wb") as handle:
+        writer = Md5Writer(handle)
+        with tarfile.open(fileobj=writer, mode="w|",
+                          format=tarfile.USTAR_FORMAT) as tar:
+            for member_path, member_name in members:
+                add_member(tar, member_path, member_name)
+        handle.write(md5_line(writer.md5.hexdigest(), name))
+
+
+def initfs_lzop(args, flavor):
+    """
+    Recompress the initramfs with lzop (in the native chroot, so it does not
+    run emulated).
+
+    :returns: path to the lzop compressed initramfs inside the native chroot
+    """
+    pmb.chroot.apk.install(args, ["lzop"])
+    initfs = (args.work + "/chroot_rootfs_" + args.device +
+              "/boot/initramfs-" + flavor)
+    native = args.work + "/chroot_native"
+    temp = "/tmp/odin-initfs-" + flavor
+    with gzip.open(initfs, "rb") as handle_in:
+        with open(native + temp, "wb") as handle_out:
+            shutil.copyfileobj(handle_in, handle_out, 1024 * 1024)
+    pmb.chroot.root(args, ["lzop", "-f", "--no-name", "-o", temp + ".lzo",
+                           temp])
+    pmb.chroot.root(args, ["rm", temp])
+    return temp + ".lzo"
 
 
 def odin(args, flavor, folder):
@@ -31,7 +139,6 @@ def odin(args, flavor, folder):
     the flasher method 'heimdall-isorec' and with boot.img for devices with 'heimdall-bootimg'
     """
     pmb.flasher.init(args)
-    suffix = "rootfs_" + args.device
 
     # Validate method
     method = args.deviceinfo["flash_methods"]
@@ -44,55 +151,30 @@ def odin(args, flavor, folder):
     partition_kernel = args.deviceinfo["flash_heimdall_partition_kernel"]
     partition_initfs = args.deviceinfo["flash_heimdall_partition_initfs"]
 
-    # Temporary folder
-    temp_folder = "/tmp/odin-flashable-tar"
-
-    # Odin flashable tar generation script (because redirecting stdin/stdout is not allowed
-    # in pmbootstrap's chroot/shell functions for security reasons)
-    with open(args.work + "/chroot_rootfs_" + args.device + "/tmp/_odin.sh", "w") as handle:
-        odin_kernel_md5 = partition_kernel + ".bin.md5"
-        odin_initfs_md5 = partition_initfs + ".bin.md5"
-        odin_device_tar = args.device + ".tar"
-        odin_device_tar_md5 = args.device + ".tar.md5"
-
-        handle.write(
-            "#!/bin/sh\n"
-            "cd " + temp_folder + "\n")
-        if method == "heimdall-isorec":
-            handle.write(
-                # Kernel: copy and append md5
-                "cp /boot/vmlinuz-" + flavor + " " + odin_kernel_md5 + "\n"
-                "md5sum -t " + odin_kernel_md5 + " >> " + odin_kernel_md5 + "\n"
-                # Initramfs: recompress with lzop, append md5
-                "gunzip -c /boot/initramfs-" + flavor + " | lzop > " + odin_initfs_md5 + "\n"
-                "md5sum -t " + odin_initfs_md5 + " >> " + odin_initfs_md5 + "\n")
-        elif method == "heimdall-bootimg":
-            handle.write(
-                # boot.img: copy and append md5
-                "cp /boot/boot.img-" + flavor + " " + odin_kernel_md5 + "\n"
-                "md5sum -t " + odin_kernel_md5 + " >> " + odin_kernel_md5 + "\n")
-        handle.write(
-            # Create tar, remove included files and append md5
-            "tar -c -f " + odin_device_tar + " *.bin.md5\n"
-            "rm *.bin.md5\n"
-            "md5sum -t " + odin_device_tar + " >> " + odin_device_tar + "\n"
-            "mv " + odin_device_tar + " " + odin_device_tar_md5 + "\n")
-
-    commands = [["mkdir", "-p", temp_folder],
-                ["cat", "/tmp/_odin.sh"],  # for the log
-                ["sh", "/tmp/_odin.sh"],
-                ["rm", "/tmp/_odin.sh"]
-                ]
-    for command in commands:
-        pmb.chroot.root(args, command, suffix)
-
-    # Move Odin flashable tar to native chroot and cleanup temp folder
+    # Files to include
+    odin_kernel_md5 = partition_kernel + ".bin.md5"
+    odin_initfs_md5 = partition_initfs + ".bin.md5"
+    odin_device_tar_md5 = args.device + ".tar.md5"
+    boot = args.work + "/chroot_rootfs_" + args.device + "/boot"
+    temp = []
+    if method == "heimdall-isorec":
+        temp.append(initfs_lzop(args, flavor))
+        members = [(boot + "/vmlinuz-" + flavor, odin_kernel_md5),
+                   (args.work + "/chroot_native" + temp[0], odin_initfs_md5)]
+    elif method == "heimdall-bootimg":
+        members = [(boot + "/boot.img-" + flavor, odin_kernel_md5)]
+
+    # Create the tar in $WORK and move it to the native chroot
+    logging.info("(native) create " + odin_device_tar_md5)
+    path_temp = args.work + "/" + odin_device_tar_md5
+    write_tar(members, path_temp)
+    if temp:
+        pmb.chroot.root(args, ["rm"] + temp)
     pmb.chroot.user(args, ["mkdir", "-p", "/home/user/rootfs"])
-    pmb.chroot.root(args, ["mv", "/mnt/rootfs_" + args.device + temp_folder +
-                           "/" + odin_device_tar_md5, "/home/user/rootfs/"]),
+    pmb.helpers.run.root(args, ["mv", "-f", path_temp, args.work +
+                                "/chroot_native/home/user/rootfs/"])
     pmb.chroot.root(args, ["chown", "user:user",
                            "/home/user/rootfs/" + odin_device_tar_md5])
-    pmb.chroot.root(args, ["rmdir", temp_folder], suffix)
 
     # Create the symlink
     file = args.work + "/chroot_native/home/user/rootfs/" + odin_device_tar_md5
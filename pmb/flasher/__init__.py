@@ -17,5 +17,5 @@ You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
 from pmb.flasher.init import init
-from pmb.flasher.run import run
+from pmb.flasher.run import run, partition_system
 from pmb.flasher.frontend import frontend
@@ -0,0 +1,323 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import json
+import logging
+import os
+
+import pmb.chroot
+import pmb.config
+import pmb.flasher
+import pmb.helpers.cli
+import pmb.helpers.run
+import pmb.helpers.sparse
+
+# "pmbootstrap flasher flash_system --delta": remember which content has
+# been flashed to the system partition of each device (checksums of 1 MiB
+# chunks, the "manifest"), and only flash the chunks, that changed since
+# then. The delta is a sparse image, where everything else is "don't care".
+#
+# This is only valid, when the device has not booted from the system
+# partition since the last flash: it gets mounted writable on boot, and the
+# blocks written by the device would be mixed with the ones of the new
+# image, resulting in a broken filesystem. The user needs to confirm this.
+
+
+def segments(path, size_max):
+    """
+    Read the content of a raw or sparse image.
+
+    :param size_max: maximum length of one segment
+    :returns: generator of (data, length), data is None for "don't care"
+              parts of a sparse image
+    """
+    if not pmb.helpers.sparse.is_sparse(path):
+        with open(path, "rb") as handle:
+            while True:
+                data = handle.read(size_max)
+                if not data:
+                    return
+                yield (data, len(data))
+
+    with open(path, "rb") as handle:
+        block_size = pmb.helpers.sparse.read_header(handle)[0]
+    for kind, blocks, payload in pmb.helpers.sparse.chunks(path):
+        length = blocks * block_size
+        for offset in range(0, length, size_max):
+            size = min(size_max, length - offset)
+            if kind == pmb.helpers.sparse.chunk_raw:
+                yield (payload[offset:offset + size], size)
+            elif kind == pmb.helpers.sparse.chunk_fill:
+                yield (payload * (size // 4), size)
+            elif kind == pmb.helpers.sparse.chunk_dont_care:
+                yield (None, size)
+
+
+def chunks(path, chunk_size):
+    """
+    Split the content of an image into chunks.
+
+    :returns: generator of (data, don't care bytes), with zeros in data for
+              the "don't care" parts
+    """
+    buffer = bytearray()
+    dont_care = 0
+    for data, length in segments(path, chunk_size):
+        pos = 0
+        while pos < length:
+            size = min(length - pos, chunk_size - len(buffer))
+            if data is None:
+                buffer += bytes(size)
+                dont_care += size
+            else:
+                buffer += data[pos:pos + size]
+            pos += size
+            if len(buffer) == chunk_size:
+                yield (bytes(buffer), dont_care)
+                buffer = bytearray()
+                dont_care = 0
+    if buffer:
+        yield (bytes(buffer), dont_care)
+
+
+def scan(path, chunk_size):
+    """
+    :returns: [(sha256 of the chunk, state), ...] with the state "data",
+              "partial" (has "don't care" parts) or "empty" (only "don't
+              care", flashing it does not change the device)
+    """
+    ret = []
+    for data, dont_care in chunks(path, chunk_size):
+        state = "data"
+        if dont_care == len(data):
+            state = "empty"
+        elif dont_care:
+            state = "partial"
+        ret.append((hashlib.sha256(data).hexdigest(), state))
+    return ret
+
+
+def changed(old, scanned):
+    """
+    :param old: chunk checksums from the manifest of the last flash
+    :param scanned: from scan() for the new image
+    :returns: indexes of the chunks, that need to be flashed
+    """
+    ret = []
+    for i, (digest, state) in enumerate(scanned):
+        if state == "empty":
+            continue
+        if i >= len(old) or old[i] != digest:
+            ret.append(i)
+    return ret
+
+
+def flashed(scanned, old=None, written=None):
+    """
+    Calculate what is on the device after flashing.
+
+    :param old: chunk checksums from the manifest of the last flash, None
+                when the whole image was flashed
+    :param written: indexes of the flashed chunks (with old)
+    :returns: chunk checksums for the new manifest, None where the content
+              on the device is unknown ("don't care" parts)
+    """
+    ret = []
+    for i, (digest, state) in enumerate(scanned):
+        if old is None:
+            ret.append(digest if state == "data" else None)
+        elif i in written or (i < len(old) and old[i] == digest):
+            ret.append(digest)
+        else:
+            ret.append(old[i] if i < len(old) else None)
+    return ret
+
+
+def ranges(indexes, chunk_size):
+    """
+    :returns: [(start, end), ...] in bytes, consecutive chunks merged
+    """
+    ret = []
+    for i in sorted(indexes):
+        start = i * chunk_size
+        if ret and ret[-1][1] == start:
+            ret[-1] = (ret[-1][0], start + chunk_size)
+        else:
+            ret.append((start, start + chunk_size))
+    return ret
+
+
+def write(path, path_delta, chunk_size, indexes, block_size=4096):
+    """
+    Write a sparse image with the chunks from indexes as data, and the rest
+    of the image as "don't care".
+
+    :returns: {"blocks": total, "raw": blocks, "fill": blocks,
+               "dont_care": blocks}
+    """
+    indexes = set(indexes)
+    with open(path_delta, "wb") as handle:
+        writer = pmb.helpers.sparse.Writer(handle, block_size)
+        for i, (data, dont_care) in enumerate(chunks(path, chunk_size)):
+            length = -(-len(data) // block_size) * block_size
+            if i in indexes:
+                pmb.helpers.sparse.add_data(writer, data +
+                                            bytes(length - len(data)))
+            else:
+                writer.add(pmb.helpers.sparse.chunk_dont_care,
+                           length // block_size)
+        writer.close()
+    stats = writer.stats
+    return {"blocks": writer.blocks,
+            "raw": stats[pmb.helpers.sparse.chunk_raw],
+            "fill": stats[pmb.helpers.sparse.chunk_fill],
+            "dont_care": stats[pmb.helpers.sparse.chunk_dont_care]}
+
+
+def manifest_path(args, serial, partition):
+    return (args.work + "/flash_manifests/" + args.device + "/" + serial +
+            "_" + partition + ".json")
+
+
+def manifest_load(path):
+    """
+    :returns: {"chunk_size": ..., "chunks": [...]} or None
+    """
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def manifest_save(path, chunk_size, chunks):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".new", "w") as handle:
+        json.dump({"chunk_size": chunk_size, "chunks": chunks}, handle)
+    os.replace(path + ".new", path)
+
+
+def serial(args, method):
+    """
+    :returns: serial number of the connected device (--serial, or from
+              "fastboot devices"), "default" when it can not be detected
+    """
+    if args.serial:
+        return args.serial
+    if method != "fastboot":
+        return "default"
+    output = pmb.chroot.root(args, ["fastboot", "devices"], log=False,
+                             return_stdout=True)
+    serials = [line.split()[0] for line in output.splitlines()
+               if line.strip()]
+    if len(serials) > 1:
+        raise RuntimeError("Multiple devices are connected, select one with"
+                           " 'pmbootstrap flasher flash_system --serial'")
+    return serials[0] if serials else "default"
+
+
+def prepare(args, method, image, scanned, path):
+    """
+    Create the delta image against the manifest of the last flash.
+
+    :param image: path to the system image on the host
+    :param path: of the manifest
+    :returns: (delta image path inside the native chroot, indexes of the
+              chunks in it, chunk checksums from the manifest), or None when
+              the whole image needs to be flashed
+    """
+    chunk_size = pmb.config.flash_delta_chunk_size
+    manifest = manifest_load(path)
+    reason = None
+    if method != "fastboot":
+        reason = "only fastboot can flash sparse images"
+    elif not manifest:
+        reason = "no image has been flashed to this device before"
+    elif manifest["chunk_size"] != chunk_size:
+        reason = "the manifest has a different chunk size"
+    if reason:
+        logging.info("NOTE: Flashing the whole image: " + reason)
+        return None
+    logging.info("WARNING: Only flash a delta, when the device has not"
+                 " booted postmarketOS since the last flash! The system"
+                 " partition gets modified on boot, and the delta would"
+                 " result in a broken filesystem.")
+    if not pmb.helpers.cli.confirm(args, "Flash only the changed parts (the"
+                                   " device has not booted since the last"
+                                   " flash)?"):
+        logging.info("NOTE: Flashing the whole image")
+        return None
+
+    indexes = changed(manifest["chunks"], scanned)
+    found = ranges(indexes, chunk_size)
+    logging.info("Changed since the last flash: " + str(len(indexes)) +
+                 " of " + str(len(scanned)) + " chunks (" +
+                 str(len(indexes) * chunk_size // 1024 // 1024) + " MiB) in " +
+                 str(len(found)) + " ranges")
+    for start, end in found:
+        logging.verbose("Changed range: " + str(start) + " - " + str(end))
+
+    # Write to /tmp in the native chroot, so the flasher can access it
+    delta = "/tmp/" + args.device + "-delta.img"
+    stats = write(image, args.work + "/chroot_native" + delta, chunk_size,
+                  indexes)
+    logging.debug("Delta image blocks: " + str(stats))
+    return (delta, indexes, manifest["chunks"])
+
+
+def flash_system(args, img_path, partition, delta=False):
+    """
+    Flash the system image (or only the changed parts with delta=True), and
+    save the manifest of what is on the device afterwards.
+
+    :param img_path: path to the system image inside the native chroot
+    :param partition: name of the system partition on the device
+    """
+    pmb.flasher.init(args)
+    method = args.flash_method or args.deviceinfo["flash_methods"]
+    image = args.work + "/chroot_native" + img_path
+    chunk_size = pmb.config.flash_delta_chunk_size
+    scanned = scan(image, chunk_size)
+
+    path = None
+    prepared = None
+    if delta:
+        path = manifest_path(args, serial(args, method), partition)
+        prepared = prepare(args, method, image, scanned, path)
+    if prepared and not prepared[1]:
+        logging.info("Nothing to flash, the system partition is up to date")
+        return
+
+    logging.info("(native) flash system image" + (" (delta)" if prepared
+                                                  else ""))
+    try:
+        pmb.flasher.run(args, "flash_system",
+                        image=prepared[0] if prepared else None)
+    finally:
+        if prepared:
+            pmb.chroot.root(args, ["rm", "-f", prepared[0]])
+
+    # Remember what has been flashed (the device is connected now)
+    if prepared:
+        chunks_new = flashed(scanned, prepared[2], set(prepared[1]))
+    else:
+        chunks_new = flashed(scanned)
+    if not path:
+        path = manifest_path(args, serial(args, method), partition)
+    manifest_save(path, chunk_size, chunks_new)
@@ -21,6 +21,7 @@ import os
 
 import pmb.config
 import pmb.flasher
+import pmb.flasher.delta
 import pmb.install
 import pmb.chroot.apk
 import pmb.chroot.initfs
@@ -69,9 +70,10 @@ def system(args):
         raise RuntimeError("The system image has not been generated yet,"
                            " please run 'pmbootstrap install' first.")
 
-    # Run the flasher
-    logging.info("(native) flash system image")
-    pmb.flasher.run(args, "flash_system")
+    # Run the flasher (see pmb/flasher/delta.py)
+    method = args.flash_method or args.deviceinfo["flash_methods"]
+    partition = pmb.flasher.partition_system(args, method)
+    pmb.flasher.delta.flash_system(args, img_path, partition, args.delta)
 
 
 def list_devices(args):
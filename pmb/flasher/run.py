@@ -20,7 +20,22 @@ import pmb.flasher
 import pmb.chroot.initfs
 
 
-def run(args, action, flavor=None):
+def partition_system(args, method):
+    """
+    :returns: name of the system partition for the flash method
+    """
+    if "partition" in args and args.partition:
+        return args.partition
+    if method == "fastboot":
+        return "system"
+    return args.deviceinfo["flash_heimdall_partition_system"] or "SYSTEM"
+
+
+def run(args, action, flavor=None, image=None):
+    """
+    :param image: path to the system image inside the native chroot
+                  (default: the one created by "pmbootstrap install")
+    """
     pmb.flasher.init(args)
 
     # Verify action
@@ -34,18 +49,13 @@ def run(args, action, flavor=None):
     if "cmdline" in args and args.cmdline:
         _cmdline = args.cmdline
 
-    if method == "fastboot":
-        _partition_system = "system"
-    else:
-        _partition_system = args.deviceinfo["flash_heimdall_partition_system"] or "SYSTEM"
-    if "partition" in args and args.partition:
-        _partition_system = args.partition
+    _partition_system = partition_system(args, method)
 
     # Variable setup
     vars = {
         "$BOOT": "/mnt/rootfs_" + args.device + "/boot",
         "$FLAVOR": flavor if flavor is not None else "",
-        "$IMAGE": "/home/user/rootfs/" + args.device + ".img",
+        "$IMAGE": image or "/home/user/rootfs/" + args.device + ".img",
         "$KERNEL_CMDLINE": _cmdline,
         "$PARTITION_KERNEL": args.deviceinfo["flash_heimdall_partition_kernel"] or "KERNEL",
         "$PARTITION_INITFS": args.deviceinfo["flash_heimdall_partition_initfs"] or "RECOVERY",
@@ -0,0 +1,265 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import glob
+import logging
+import os
+import time
+
+import pmb.config
+import pmb.helpers.run
+
+
+def keep(args, path):
+    """
+    Mark a file or folder in a cache as needed by the current session, so
+    prune() does not remove it.
+    """
+    args.cache.cache_in_use.add(os.path.realpath(path))
+
+
+def last_access(stat):
+    """
+    The access time alone is not reliable (filesystems mounted with
+    "relatime" only update it once per day, "noatime" never), so take the
+    modification time into account as well.
+    """
+    return max(stat.st_atime, stat.st_mtime)
+
+
+def size_freed(stat):
+    """
+    Estimate how much space gets freed by removing a file. Packages, that
+    are hardlinked to the blob store (pmb.chroot.apk_blobs) and to other apk
+    caches, only get freed when the last cache does not use them anymore.
+    """
+    return stat.st_blocks * 512 // max(1, stat.st_nlink - 1)
+
+
+def entries_files(folder):
+    """
+    Every file is an entry. Metadata files ("<file>.meta", see
+    pmb.helpers.http) belong to the entry of the file they describe.
+
+    :returns: see entries()
+    """
+    ret = {}
+    for root, dirs, files in os.walk(folder):
+        for file in files:
+            if file in pmb.config.cache_protected_names:
+                continue
+            path = root + "/" + file
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                continue
+            key = path
+            if file.endswith(".meta") and os.path.exists(path[:-5]):
+                key = path[:-5]
+            entry = ret.setdefault(key, {"paths": [], "size": 0,
+                                         "access": 0})
+            entry["paths"].append(path)
+            entry["size"] += size_freed(stat)
+            entry["access"] = max(entry["access"], last_access(stat))
+    return list(ret.values())
+
+
+def entries_folders(folder):
+    """
+    Every top-level folder is one entry (e.g. a git repository), that gets
+    removed as whole. Its access time is the newest one of all files inside.
+
+    :returns: see entries()
+    """
+    ret = []
+    for name in os.listdir(folder):
+        path = folder + "/" + name
+        entry = {"paths": [path], "size": 0, "access": 0}
+        for root, dirs, files in os.walk(path):
+            for file in [root] + [root + "/" + file for file in files]:
+                try:
+                    stat = os.lstat(file)
+                except OSError:
+                    continue
+                entry["size"] += stat.st_blocks * 512
+                entry["access"] = max(entry["access"], last_access(stat))
+        ret.append(entry)
+    return ret
+
+
+def entries(args, name):
+    """
+    Find everything that could be evicted from one kind of cache.
+
+    :param name: cache name from pmb.config.cache_folders, e.g. "apk"
+    :returns: list of dicts like {"folder": "cache_apk_x86_64", "paths":
+              [...], "size": (bytes), "access": (timestamp)}
+    """
+    ret = []
+    pattern, whole_folders = pmb.config.cache_folders[name]
+    for folder in sorted(glob.glob(args.work + "/" + pattern)):
+        if not os.path.isdir(folder):
+            continue
+        if whole_folders:
+            found = entries_folders(folder)
+        else:
+            found = entries_files(folder)
+        for entry in found:
+            entry["folder"] = os.path.basename(folder)
+            ret.append(entry)
+    return ret
+
+
+def budget(args, name=None):
+    """
+    :param name: cache name from pmb.config.cache_folders, or None for the
+                 global budget of all caches together
+    :returns: size limit in bytes, or 0 when there is no limit
+    """
+    key = "cache_budget" + ("_" + name if name else "")
+    return int(getattr(args, key)) * 1024 * 1024
+
+
+def in_use(args, entry):
+    """
+    Entries, that were accessed or created since pmbootstrap was started,
+    or that have been marked with keep(), are needed by the current session.
+    """
+    if entry["access"] >= args.cache.session_start:
+        return True
+    for path in entry["paths"]:
+        if os.path.realpath(path) in args.cache.cache_in_use:
+            return True
+    return False
+
+
+def evict(args, candidates, size, limit):
+    """
+    Choose the least recently used entries, that need to be removed, so the
+    size of all candidates fits into the limit.
+
+    :returns: (list of entries to remove, new size)
+    """
+    ret = []
+    for entry in sorted(candidates, key=lambda entry: entry["access"]):
+        if size <= limit:
+            break
+        if in_use(args, entry):
+            continue
+        ret.append(entry)
+        size -= entry["size"]
+    return (ret, size)
+
+
+def format_size(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return str(round(size, 1)) + " " + unit
+        size /= 1024
+    return str(round(size, 1)) + " GiB"
+
+
+def status(args):
+    """
+    Print size, entry count and newest access time of each cache folder,
+    together with the configured budgets.
+    """
+    logging.info("Cache folder                 Size  Entries  Last access"
+                 "       Budget")
+    total = 0
+    for name in sorted(pmb.config.cache_folders):
+        found = entries(args, name)
+        folders = sorted(set(entry["folder"] for entry in found))
+        for folder in folders:
+            in_folder = [entry for entry in found if entry["folder"] == folder]
+            size = sum(entry["size"] for entry in in_folder)
+            access = max(entry["access"] for entry in in_folder)
+            logging.info(folder.ljust(22) +
+                         format_size(size).rjust(11) +
+                         str(len(in_folder)).rjust(9) + "  " +
+                         time.strftime("%Y-%m-%d %H:%M",
+                                       time.localtime(access)) + "  " +
+                         (format_size(budget(args, name)) + " (" + name + ")"
+                          if budget(args, name) else "-"))
+            total += size
+    logging.info("Total: " + format_size(total) + ", budget: " +
+                 (format_size(budget(args)) if budget(args) else "unlimited"))
+
+
+def prune(args, dry_run=False):
+    """
+    Enforce the cache budgets (see "cache_budget*" in pmb.config.defaults),
+    by removing the least recently used entries of each cache, and then of
+    all caches together. Does nothing, when no budget is configured.
+
+    :param dry_run: only print what would be removed
+    :returns: list of removed entries
+    """
+    import pmb.chroot.apk_blobs
+    names = [name for name in sorted(pmb.config.cache_folders)
+             if budget(args, name)]
+    if not len(names) and not budget(args):
+        return []
+
+    # Per cache budgets
+    removed = []
+    remaining = []
+    for name in sorted(pmb.config.cache_folders):
+        found = entries(args, name)
+        if name in names:
+            size = sum(entry["size"] for entry in found)
+            evicted, size = evict(args, found, size, budget(args, name))
+            evicted_ids = set(id(entry) for entry in evicted)
+            found = [entry for entry in found if id(entry) not in evicted_ids]
+            removed += evicted
+        remaining += found
+
+    # Global budget
+    if budget(args):
+        size = sum(entry["size"] for entry in remaining)
+        removed += evict(args, remaining, size, budget(args))[0]
+    if not len(removed):
+        return []
+
+    # Remove the entries (cache folders are partially owned by root)
+    logging.info(("Would remove " if dry_run else "Remove ") +
+                 str(len(removed)) + " least recently used cache entries (" +
+                 format_size(sum(entry["size"] for entry in removed)) + ")")
+    paths = []
+    for entry in removed:
+        logging.verbose(entry["folder"] + ": " + ", ".join(entry["paths"]))
+        paths += entry["paths"]
+    if not dry_run:
+        for i in range(0, len(paths), 500):
+            pmb.helpers.run.root(args, ["rm", "-rf"] + paths[i:i + 500])
+        pmb.chroot.apk_blobs.gc(args)
+    return removed
+
+
+def frontend(args):
+    import pmb.chroot.apk_blobs
+    if args.action_cache == "status":
+        status(args)
+    elif args.action_cache == "dedupe":
+        pmb.chroot.apk_blobs.dedupe(args)
+    elif args.action_cache == "prune":
+        if not prune(args, args.dry_run):
+            logging.info("Nothing to remove (configure size limits with"
+                         " 'pmbootstrap config cache_budget <MiB>')")
+    else:
+        logging.info("Run 'pmbootstrap cache -h' for usage information.")
@@ -20,6 +20,8 @@ import datetime
 import logging
 import re
 
+import pmb.helpers.logging
+
 
 def ask(args, question="Continue?", choices=["y", "n"], default="n",
         lowercase_answer=True, validation_regex=None):
@@ -42,8 +44,7 @@ def ask(args, question="Continue?", choices=["y", "n"], default="n",
         if ret == "":
             ret = str(default)
 
-        args.logfd.write(question_full + " " + ret + "\n")
-        args.logfd.flush()
+        pmb.helpers.logging.write(args, question_full + " " + ret + "\n")
 
         # Validate with regex
         if not validation_regex:
@@ -0,0 +1,160 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import collections
+import concurrent.futures
+import os
+import struct
+import time
+import zlib
+
+# Multithreaded gzip compression, like pigz does it: the input gets split
+# into blocks, that get compressed at the same time (zlib does not hold the
+# GIL while compressing). Each block uses the end of the previous block as
+# dictionary and ends with a sync flush, so the compressed blocks can be
+# joined to one regular gzip stream, that every gunzip can extract.
+
+# Size of the blocks, that get compressed in parallel
+block_size = 1024 * 1024
+
+# Size of the dictionary (deflate window)
+dictionary_size = 32 * 1024
+
+
+def deflate_block(data, dictionary, level, last):
+    """
+    :param dictionary: end of the previous block (or b"" for the first one)
+    :param last: end the deflate stream after this block
+    :returns: raw deflate data of the block
+    """
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zlib.DEF_MEM_LEVEL,
+                                      zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class GzipWriter(object):
+    """
+    File-like object, that writes gzip compressed data to a file handle.
+    """
+
+    def __init__(self, handle, level=6, threads=None):
+        self.handle = handle
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.dictionary = b""
+        self.crc = 0
+        self.size = 0
+        self.written = 0
+        self.write_raw(b"\x1f\x8b\x08\x00" + struct.pack("<I", 0) +
+                       b"\x00\x03")
+
+    def write_raw(self, data):
+        self.handle.write(data)
+        self.written += len(data)
+
+    def submit(self, data, last=False):
+        """
+        Compress a block in the background. Only a few blocks per thread are
+        kept in memory, the oldest ones get written when there are more.
+        """
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.pending.append(self.executor.submit(
+            deflate_block, data, self.dictionary, self.level, last))
+        self.dictionary = data[-dictionary_size:]
+        while len(self.pending) > self.threads * 2:
+            self.write_raw(self.pending.popleft().result())
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= block_size:
+            self.submit(bytes(self.buffer[:block_size]))
+            del self.buffer[:block_size]
+        return len(data)
+
+    def close(self):
+        """
+        Compress the rest, and write the gzip trailer (crc32 and size).
+        """
+        self.submit(bytes(self.buffer), True)
+        self.buffer = bytearray()
+        while self.pending:
+            self.write_raw(self.pending.popleft().result())
+        self.executor.shutdown()
+        self.write_raw(struct.pack("<II", self.crc & 0xffffffff,
+                                   self.size & 0xffffffff))
+
+
+class PlainWriter(object):
+    """
+    Same interface as GzipWriter, without compression.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.size = 0
+        self.written = 0
+
+    def write(self, data):
+        self.handle.write(data)
+        self.size += len(data)
+        self.written += len(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+# Codecs for the config options: {name: function(handle, level, threads)}
+codecs = collections.OrderedDict([
+    ("gzip", lambda handle, level, threads: GzipWriter(handle, level,
+                                                       threads)),
+    ("none", lambda handle, level, threads: PlainWriter(handle)),
+])
+
+
+def writer(handle, codec="gzip", level=6, threads=None):
+    """
+    :param codec: name from codecs
+    :returns: GzipWriter or PlainWriter
+    """
+    if codec not in codecs:
+        raise RuntimeError("Unknown compression: " + codec + " (supported: " +
+                           ", ".join(codecs) + ")")
+    return codecs[codec](handle, level, threads)
+
+
+def stats(writer, start):
+    """
+    :param start: time.time() before the first write
+    :returns: {"bytes": uncompressed, "compressed": bytes, "seconds": ...,
+               "mib_per_second": uncompressed throughput}
+    """
+    seconds = max(time.time() - start, 0.001)
+    return {"bytes": writer.size,
+            "compressed": writer.written,
+            "seconds": round(seconds, 3),
+            "mib_per_second": round(writer.size / 1024 / 1024 / seconds, 1)}
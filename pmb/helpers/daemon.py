@@ -0,0 +1,333 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import array
+import glob
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import threading
+
+import pmb.config
+import pmb.session
+
+
+def socket_path(args):
+    return args.work + "/" + pmb.config.daemon_socket
+
+
+def forwardable(args):
+    """
+    :returns: True, when the command should get executed by a running
+              pmbootstrap daemon
+    """
+    if (not args.action or not args.daemon or
+            args.action in pmb.config.daemon_local_actions):
+        return False
+
+    # Interactive shell: must run in the foreground of the terminal
+    if args.action == "chroot" and sys.stdin.isatty():
+        return False
+    return os.path.exists(socket_path(args))
+
+
+def send(sock, message, fds=[]):
+    """
+    Send a message as one line of JSON.
+
+    :param fds: file descriptors, that get passed to the other process
+    """
+    data = json.dumps(message).encode("utf-8") + b"\n"
+    sent = 0
+    if fds:
+        sent = sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                      array.array("i", fds))])
+    sock.sendall(data[sent:])
+
+
+def receive(sock):
+    """
+    Receive a message, that was sent with send().
+
+    :returns: (message, fds), message is None when the connection has been
+              closed before a complete message arrived
+    """
+    data = b""
+    fds = array.array("i")
+    while not data.endswith(b"\n"):
+        chunk, ancdata, flags, address = sock.recvmsg(
+            65536, socket.CMSG_LEN(3 * fds.itemsize))
+        for level, kind, cmsg_data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                size = len(cmsg_data) - len(cmsg_data) % fds.itemsize
+                fds.frombytes(cmsg_data[:size])
+        if not chunk:
+            return (None, list(fds))
+        data += chunk
+    return (json.loads(data.decode("utf-8")), list(fds))
+
+
+def connect(args):
+    """
+    :returns: socket connected to the daemon, or None when it is not running
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path(args))
+    except (ConnectionRefusedError, FileNotFoundError):
+        # Not running, or the socket is left over from a crashed daemon
+        sock.close()
+        return None
+    return sock
+
+
+def forward(args):
+    """
+    Let the running pmbootstrap daemon execute the command. It runs with the
+    stdin, stdout and stderr file descriptors, working directory and
+    environment of this process.
+
+    :returns: exit code of the command, or None when the daemon is not
+              running
+    """
+    sock = connect(args)
+    if not sock:
+        return None
+    sys.stdout.flush()
+    sys.stderr.flush()
+    request = {"argv": sys.argv[1:],
+               "cwd": os.getcwd(),
+               "env": dict(os.environ)}
+    try:
+        send(sock, request, [0, 1, 2])
+        reply = receive(sock)[0]
+    except KeyboardInterrupt:
+        # The daemon aborts the command, when the connection gets closed
+        return 130
+    finally:
+        sock.close()
+    if reply is None:
+        print("ERROR: pmbootstrap daemon closed the connection (see"
+              " 'pmbootstrap log')")
+        return 1
+    return reply["exit"]
+
+
+def stop(args):
+    sock = connect(args)
+    if not sock:
+        logging.info("pmbootstrap daemon is not running")
+        return
+    with sock:
+        send(sock, {"stop": True})
+        receive(sock)
+    logging.info("pmbootstrap daemon stopped")
+
+
+def peer_uid(conn):
+    """
+    :returns: the uid of the process on the other side of a unix socket
+    """
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def watch(conn, done):
+    """
+    Interrupt the running command (like Ctrl+C), when the pmbootstrap
+    process that forwarded it has been interrupted and closed the
+    connection.
+    """
+    while not done.is_set():
+        if not select.select([conn], [], [], 0.2)[0]:
+            continue
+        if not conn.recv(1, socket.MSG_PEEK):
+            logging.info("Connection closed, interrupting the command")
+            os.kill(os.getpid(), signal.SIGINT)
+        return
+
+
+def run(session, argv):
+    """
+    Run a forwarded command in the daemon's session (pmb.Session).
+
+    :returns: exit code
+    """
+    try:
+        return session.command(argv)
+    except SystemExit as e:
+        # Argument parsing errors, "pmbootstrap -h", sys.exit() in actions
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code)
+        return 1
+    except KeyboardInterrupt:
+        # The caches may be in an inconsistent state now
+        session.caches.invalidate()
+        return 130
+    except Exception as e:
+        print("ERROR: " + str(e))
+        return 1
+
+
+def execute(session, conn, request, fds):
+    """
+    Run a forwarded command in this process, with the file descriptors
+    (stdin, stdout, stderr), working directory, environment and arguments of
+    the pmbootstrap process, that sent it.
+
+    :returns: exit code
+    """
+    logging.debug("Forwarded command: pmbootstrap " +
+                  " ".join(request["argv"]))
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+    fds_saved = [os.dup(fd) for fd in range(3)]
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    done = threading.Event()
+    watcher = threading.Thread(target=watch, args=(conn, done))
+    try:
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        watcher.start()
+        return run(session, request["argv"])
+    finally:
+        done.set()
+        if watcher.is_alive():
+            watcher.join()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target, fd in enumerate(fds_saved):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def handle(session, conn):
+    """
+    Handle one connection to the daemon.
+
+    :returns: False, when the daemon should stop
+    """
+    request, fds = receive(conn)
+    try:
+        if request is None:
+            return True
+        if peer_uid(conn) != os.getuid():
+            logging.info("Ignoring connection from another user")
+            return True
+        if request.get("stop"):
+            send(conn, {"exit": 0})
+            return False
+        if len(fds) != 3:
+            logging.info("Ignoring invalid request")
+            return True
+        ret = execute(session, conn, request, fds)
+        try:
+            send(conn, {"exit": ret})
+        except OSError:
+            pass  # interrupted, nobody waits for the exit code anymore
+    finally:
+        for fd in fds:
+            os.close(fd)
+    return True
+
+
+def warm_up(args):
+    """
+    Fill the caches and mount the native chroot, so the first forwarded
+    commands are fast as well.
+    """
+    import pmb.chroot
+    import pmb.helpers.repo
+    import pmb.parse
+    import pmb.parse.apkindex
+
+    logging.info("Parse APKBUILDs and APKINDEX files")
+    for path in glob.glob(args.aports + "/*/*/APKBUILD"):
+        try:
+            pmb.parse.apkbuild(args, path)
+        except (RuntimeError, SyntaxError) as e:
+            logging.debug("Failed to parse " + path + ": " + str(e))
+    for arch in [args.arch_native] + pmb.config.build_device_architectures:
+        for path in pmb.helpers.repo.apkindex_files(args, arch):
+            if os.path.exists(path):
+                pmb.parse.apkindex.parse(args, path)
+
+    if os.path.exists(args.work + "/chroot_native"):
+        pmb.chroot.init(args)
+
+
+def serve(args):
+    """
+    Listen on the socket in $WORK and execute the forwarded commands one
+    after another, in one pmb.Session.
+    """
+    import pmb.helpers.userns
+
+    path = socket_path(args)
+    sock = connect(args)
+    if sock:
+        sock.close()
+        raise RuntimeError("pmbootstrap daemon is already running: " + path)
+    if os.path.exists(path):
+        os.unlink(path)
+
+    # Enter the user namespace before starting any threads (see
+    # pmb/helpers/userns.py), forwarded commands inherit it
+    if args.backend == "userns":
+        pmb.helpers.userns.enter(args)
+    session = pmb.session.Session(args)
+    warm_up(args)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    logging.info("pmbootstrap daemon listening on: " + path)
+    logging.info("Other pmbootstrap commands get executed here now (stop"
+                 " with Ctrl+C or 'pmbootstrap daemon --stop')")
+    try:
+        while True:
+            try:
+                conn = server.accept()[0]
+            except KeyboardInterrupt:
+                break
+            with conn:
+                if not handle(session, conn):
+                    break
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
@@ -25,26 +25,19 @@ import logging
 import os
 import sys
 
-import pmb.aportgen
-import pmb.build
 import pmb.config
-import pmb.challenge
-import pmb.chroot
-import pmb.chroot.initfs
-import pmb.chroot.other
-import pmb.flasher
 import pmb.helpers.logging
-import pmb.helpers.other
-import pmb.helpers.run
-import pmb.install
-import pmb.parse
-import pmb.qemu
+
+# Each action imports the modules it needs when it runs, so short commands
+# like "pmbootstrap config" or "pmbootstrap log" start fast.
 
 
 def _parse_flavor(args):
     """
     Verify the flavor argument if specified, or return a default value.
     """
+    import pmb.chroot.apk
+    import pmb.chroot.other
     # Make sure, that at least one kernel is installed
     suffix = "rootfs_" + args.device
     pmb.chroot.apk.install(args, ["device-" + args.device], suffix)
@@ -76,33 +69,47 @@ def _parse_suffix(args):
 
 
 def aportgen(args):
+    import pmb.aportgen
     for package in args.packages:
         pmb.aportgen.generate(args, package)
 
 
 def build(args):
-    if args.strict:
-        pmb.chroot.zap(args, False)
+    import pmb.build
     for package in args.packages:
-        pmb.build.package(args, package, args.arch, args.force,
-                          args.buildinfo, args.strict)
+        if args.strict:
+            pmb.build.package_strict(args, package, args.arch, args.force,
+                                     args.buildinfo)
+        else:
+            pmb.build.package(args, package, args.arch, args.force,
+                              args.buildinfo)
 
 
 def build_init(args):
+    import pmb.build
     suffix = _parse_suffix(args)
     pmb.build.init(args, suffix)
 
 
 def challenge(args):
+    import pmb.challenge
     pmb.challenge.frontend(args)
 
 
+def cache(args):
+    import pmb.helpers.cache
+    pmb.helpers.cache.frontend(args)
+
+
 def checksum(args):
+    import pmb.build
     for package in args.packages:
         pmb.build.checksum(args, package)
 
 
 def chroot(args):
+    import pmb.chroot
+    import pmb.chroot.apk
     suffix = _parse_suffix(args)
     pmb.chroot.apk.check_min_version(args, suffix)
     logging.info("(" + suffix + ") % " + " ".join(args.command))
@@ -128,31 +135,50 @@ def config(args):
         cfg.write(sys.stdout)
 
 
+def daemon(args):
+    import pmb.helpers.daemon
+    if args.stop:
+        pmb.helpers.daemon.stop(args)
+    else:
+        pmb.helpers.daemon.serve(args)
+
+
 def index(args):
+    import pmb.build
     pmb.build.index_repo(args)
 
 
 def initfs(args):
+    import pmb.chroot.initfs
     pmb.chroot.initfs.frontend(args)
 
 
 def install(args):
-    pmb.install.install(args)
+    import pmb.install
+    import pmb.install.batch
+    if args.devices or args.all_devices:
+        pmb.install.batch.install(args)
+    else:
+        pmb.install.install(args)
 
 
 def flasher(args):
+    import pmb.flasher
     pmb.flasher.frontend(args)
 
 
 def export(args):
+    import pmb.export
     pmb.export.frontend(args)
 
 
 def menuconfig(args):
+    import pmb.build
     pmb.build.menuconfig(args, args.package, args.deviceinfo["arch"])
 
 
 def kconfig_check(args):
+    import pmb.parse.kconfig
     # Default to all kernel packages
     packages = args.packages
     if not packages:
@@ -172,12 +198,15 @@ def kconfig_check(args):
 
 
 def parse_apkbuild(args):
+    import pmb.build
+    import pmb.parse
     aport = pmb.build.other.find_aport(args, args.package)
     path = aport + "/APKBUILD"
     print(json.dumps(pmb.parse.apkbuild(args, path), indent=4))
 
 
 def parse_apkindex(args):
+    import pmb.parse.apkindex
     result = pmb.parse.apkindex.parse(args, args.apkindex_path)
     if args.package:
         if args.package not in result:
@@ -188,18 +217,27 @@ def parse_apkindex(args):
 
 
 def qemu(args):
+    import pmb.qemu
     pmb.qemu.run(args)
 
 
 def shutdown(args):
+    import pmb.chroot
     pmb.chroot.shutdown(args)
 
 
 def stats(args):
+    import pmb.build
+    import pmb.session
+    if args.caches:
+        for name, stats in sorted(args.cache.stats().items()):
+            logging.info(name + ": " + pmb.session.format_stats(stats))
+        return
     pmb.build.ccache_stats(args, args.arch)
 
 
 def log(args):
+    import pmb.helpers.run
     if args.clear_log:
         pmb.helpers.run.user(args, ["truncate", "-s", "0", args.log],
                              log=False)
@@ -208,6 +246,7 @@ def log(args):
 
 
 def log_distccd(args):
+    import pmb.chroot
     logpath = "/home/user/distccd.log"
     if args.clear_log:
         pmb.chroot.user(args, ["truncate", "-s", "0", logpath], log=False)
@@ -215,5 +254,6 @@ def log_distccd(args):
 
 
 def zap(args):
+    import pmb.chroot
     pmb.chroot.zap(args, packages=args.packages, http=args.http,
                    mismatch_bins=args.mismatch_bins, distfiles=args.distfiles)
@@ -16,17 +16,343 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
-import os
+import concurrent.futures
 import hashlib
-import shutil
+import http.client
+import json
 import logging
+import os
+import ssl
+import threading
+import time
+import urllib.parse
 import urllib.request
+
+import pmb.config
+import pmb.helpers.cache
 import pmb.helpers.run
 
+# Idle keep-alive connections, grouped by (scheme, host). A connection is
+# only used by one thread at a time: it gets removed from the pool while a
+# request is running, and put back afterwards.
+pool = {}
+pool_lock = threading.Lock()
+
+
+def connection_new(scheme, netloc):
+    """
+    Open a new connection to a host, through the proxy from the environment
+    variables (http_proxy etc.) if there is one.
+
+    :returns: (connection, proxied), where proxied is True when the full URL
+              must be passed to the request instead of the path
+    """
+    timeout = pmb.config.http_timeout
+    host = netloc.rsplit("@", 1)[-1]
+    proxy = urllib.request.getproxies().get(scheme)
+    if proxy and urllib.request.proxy_bypass(host.split(":")[0]):
+        proxy = None
+    proxy_netloc = urllib.parse.urlsplit(proxy).netloc if proxy else None
+
+    if scheme == "https":
+        context = ssl.create_default_context()
+        if proxy_netloc:
+            conn = http.client.HTTPSConnection(proxy_netloc, timeout=timeout,
+                                               context=context)
+            conn.set_tunnel(host)
+            return (conn, False)
+        return (http.client.HTTPSConnection(host, timeout=timeout,
+                                            context=context), False)
+    if scheme == "http":
+        if proxy_netloc:
+            return (http.client.HTTPConnection(proxy_netloc,
+                                               timeout=timeout), True)
+        return (http.client.HTTPConnection(host, timeout=timeout), False)
+    raise RuntimeError("Unsupported URL scheme '" + scheme + "'")
+
+
+def connection_get(key):
+    """
+    :returns: (connection, proxied, reused)
+    """
+    with pool_lock:
+        if len(pool.get(key, [])):
+            conn, proxied = pool[key].pop()
+            return (conn, proxied, True)
+    conn, proxied = connection_new(key[0], key[1])
+    return (conn, proxied, False)
+
+
+def connection_release(key, conn, proxied, response):
+    """
+    Put a connection back into the pool, after the response has been read
+    completely. Connections that the server wants to close are discarded.
+    """
+    if response.will_close:
+        conn.close()
+        return
+    with pool_lock:
+        pool.setdefault(key, []).append((conn, proxied))
+
+
+def request(url, headers={}):
+    """
+    Send a GET request over a pooled connection. When a reused connection
+    has been closed by the server in the meantime, try again with a new one.
+
+    :returns: (response, release), where release() must be called after
+              reading the response
+    """
+    parsed = urllib.parse.urlsplit(url)
+    key = (parsed.scheme, parsed.netloc)
+    target = parsed.path or "/"
+    if parsed.query:
+        target += "?" + parsed.query
+
+    while True:
+        conn, proxied, reused = connection_get(key)
+        try:
+            conn.request("GET", url if proxied else target, headers=headers)
+            response = conn.getresponse()
+            break
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not reused:
+                raise
+
+    def release():
+        connection_release(key, conn, proxied, response)
+    return (response, release)
+
+
+def part_validator(temp):
+    """
+    :returns: value for the If-Range header to continue the download in the
+              temporary file (the strong ETag or Last-Modified of the
+              response, that it was started with, saved in temp.meta), or
+              None when it can not be continued safely
+    """
+    meta = meta_read(temp)
+    if not meta:
+        return None
+    if meta["etag"] and not meta["etag"].startswith("W/"):
+        return meta["etag"]
+    return meta["last_modified"]
+
+
+def part_remove(temp):
+    """
+    Remove the temporary file of a download and its validators.
+    """
+    for path in [temp, temp + ".meta"]:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def fetch_attempt(url, temp, headers_extra={}):
+    """
+    Download url to the temporary file once, or continue the download if the
+    temporary file exists already (HTTP Range request). Follows redirects.
+
+    Continuing is only done with the If-Range header, so the server sends
+    the whole file again when it has changed since the download started.
+    Without validators from the server, the download starts from scratch.
 
-def download(args, url, prefix, cache=True):
+    :param headers_extra: additional request headers
+    :returns: the response (already read), with status 200, 206 or 304
+    """
+    for i in range(pmb.config.http_redirects_max + 1):
+        headers = {"User-Agent": "pmbootstrap/" + pmb.config.version}
+        headers.update(headers_extra)
+        offset = 0
+        if os.path.exists(temp):
+            validator = part_validator(temp)
+            if validator:
+                offset = os.path.getsize(temp)
+                headers["If-Range"] = validator
+            else:
+                part_remove(temp)
+        if offset:
+            headers["Range"] = "bytes=" + str(offset) + "-"
+        response, release = request(url, headers)
+        status = response.status
+
+        # Not modified (conditional request)
+        if status == 304:
+            response.read()
+            release()
+            return response
+
+        # Redirect
+        if status in [301, 302, 303, 307, 308]:
+            location = response.getheader("Location")
+            response.read()
+            release()
+            url = urllib.parse.urljoin(url, location)
+            continue
+
+        # The range does not fit (file changed on the server), start again
+        range_start = ("bytes " + str(offset) + "-")
+        if (status == 416 or (status == 206 and not
+                              response.getheader("Content-Range",
+                                                 "").startswith(range_start))):
+            response.read()
+            release()
+            part_remove(temp)
+            continue
+
+        if status not in [200, 206]:
+            response.read()
+            release()
+            raise RuntimeError("Download failed with HTTP status " +
+                               str(status) + " (" + response.reason + "): " +
+                               url)
+
+        # Validators for continuing the download later (see part_validator())
+        if status == 200:
+            with open(temp + ".meta", "w") as handle:
+                json.dump({"url": url,
+                           "etag": response.getheader("ETag"),
+                           "last_modified":
+                               response.getheader("Last-Modified")}, handle)
+
+        # Write (or append) the content
+        with open(temp, "ab" if status == 206 else "wb") as handle:
+            while True:
+                chunk = response.read(65536)
+                if not chunk:
+                    break
+                handle.write(chunk)
+        release()
+        return response
+    raise RuntimeError("Too many redirects: " + url)
+
+
+def verify(path, sha256=None, size=None):
+    """
+    :returns: None, or a message explaining why verification failed
+    """
+    if size is not None and os.path.getsize(path) != size:
+        return ("size mismatch (" + str(os.path.getsize(path)) +
+                " instead of " + str(size) + " bytes)")
+    if sha256:
+        digest = hashlib.sha256()
+        with open(path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(65536), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != sha256:
+            return "sha256 mismatch (" + digest.hexdigest() + ")"
+    return None
+
+
+def fetch(url, path, sha256=None, size=None, headers={}):
+    """
+    Download a file to a specific path. The data gets written to path.part
+    first, and only renamed to the final path after the download is complete
+    and verified, so an interrupted download never looks like a valid file.
+    Interrupted downloads get continued where they stopped, both in the next
+    retry and in the next call with the same path, unless the file has
+    changed on the server (see fetch_attempt()).
+
+    :param sha256: expected sha256 hexdigest of the file (optional)
+    :param size: expected size of the file in bytes (optional)
+    :param headers: additional request headers, e.g. If-None-Match. When the
+                    server answers with "304 Not Modified", path does not get
+                    changed.
+    :returns: the last response (already read), to look at its status and
+              headers
+    """
+    temp = path + ".part"
+    retries = pmb.config.http_retries
+    for attempt in range(1, retries + 1):
+        try:
+            response = fetch_attempt(url, temp, headers)
+            break
+        except (http.client.HTTPException, OSError) as e:
+            if attempt == retries:
+                raise RuntimeError("Download failed: " + url + " (" +
+                                   str(e) + ")") from e
+            logging.debug("NOTE: Download of " + url + " failed (" +
+                          str(e) + "), retrying (" + str(attempt) + "/" +
+                          str(retries) + ")")
+    if response.status == 304:
+        return response
+
+    error = verify(temp, sha256, size)
+    if error:
+        part_remove(temp)
+        raise RuntimeError("Download failed: " + url + " (" + error + ")")
+    os.replace(temp, path)
+    part_remove(temp)
+    return response
+
+
+def fetch_many(jobs, threads=None):
+    """
+    Download many files at once, with a bounded count of threads. Connections
+    to the same host get reused.
+
+    :param jobs: [{"url": ..., "path": ..., "sha256": ..., "size": ...}, ...]
+                 (sha256 and size are optional, see fetch())
+    :param threads: defaults to pmb.config.http_threads
+    :returns: list with one entry per job: None on success, otherwise the
+              exception, that the download raised
+    """
+    ret = [None] * len(jobs)
+    threads = threads or pmb.config.http_threads
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        futures = {}
+        for i, job in enumerate(jobs):
+            future = executor.submit(fetch, job["url"], job["path"],
+                                     job.get("sha256"), job.get("size"))
+            futures[future] = i
+        for future in concurrent.futures.as_completed(futures):
+            ret[futures[future]] = future.exception()
+    return ret
+
+
+def meta_read(path):
+    """
+    Read the metadata of a file in the http cache.
+
+    :returns: {"url": ..., "etag": ..., "last_modified": ..., "checked": ...}
+              or None when there is no (valid) metadata file
+    """
+    try:
+        with open(path + ".meta") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def meta_write(path, url, response):
+    """
+    Save the validators (ETag, Last-Modified) of a downloaded file, and the
+    time when it was checked to be up-to-date, in path.meta.
+    """
+    meta = meta_read(path) if response.status == 304 else None
+    if not meta:
+        meta = {"url": url,
+                "etag": response.getheader("ETag"),
+                "last_modified": response.getheader("Last-Modified")}
+    meta["checked"] = time.time()
+    with open(path + ".meta.part", "w") as handle:
+        json.dump(meta, handle)
+    os.replace(path + ".meta.part", path + ".meta")
+
+
+def download(args, url, prefix, cache=True, sha256=None, max_age=None):
     """
     Download a file to disk.
+
+    :param cache: use the cached file, if it exists. Set to False to always
+                  download the file again.
+    :param sha256: expected sha256 hexdigest of the file (optional)
+    :param max_age: when set, a cached file that has been checked more than
+                    max_age seconds ago gets revalidated with a conditional
+                    request (If-None-Match, If-Modified-Since): the server
+                    sends it again only if it was modified. None means that
+                    cached files never expire.
     """
     # Create cache folder
     if not os.path.exists(args.work + "/cache_http"):
@@ -36,14 +362,36 @@ def download(args, url, prefix, cache=True):
     prefix = prefix.replace("/", "_")
     path = (args.work + "/cache_http/" + prefix + "_" +
             hashlib.sha256(url.encode("utf-8")).hexdigest())
+    headers = {}
+    pmb.helpers.cache.keep(args, path)
     if os.path.exists(path):
-        if cache:
+        if args.offline:
             return path
-        pmb.helpers.run.user(args, ["rm", path])
+        meta = meta_read(path)
+        if cache:
+            if max_age is None:
+                return path
+            if meta and time.time() - meta["checked"] < max_age:
+                return path
+            if meta and meta["etag"]:
+                headers["If-None-Match"] = meta["etag"]
+            if meta and meta["last_modified"]:
+                headers["If-Modified-Since"] = meta["last_modified"]
+    if args.offline:
+        raise RuntimeError("File not found in the http cache, and not"
+                           " downloading it because of --offline: " + url)
 
-    # Download the file
-    logging.info("Download " + url)
-    with urllib.request.urlopen(url) as response:
-        with open(path, "wb") as handle:
-            shutil.copyfileobj(response, handle)
+    # Download the file (or revalidate the cached file)
+    if headers:
+        logging.debug("Check if cached file is up-to-date: " + url)
+    else:
+        logging.info("Download " + url)
+    if headers:
+        part_remove(path + ".part")
+    response = fetch(url, path, sha256, headers=headers)
+    if response.status == 304:
+        logging.debug("=> not modified")
+    elif headers:
+        logging.info("Downloaded updated file: " + url)
+    meta_write(path, url, response)
     return path
@@ -16,9 +16,117 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import atexit
+import gzip
 import logging
 import os
+import shutil
 import sys
+import threading
+
+import pmb.config
+
+# Log messages and the output of commands may get written from multiple
+# threads (and asyncio callbacks) at the same time, see write()
+logfd_lock = threading.Lock()
+
+
+class buffered_log(object):
+    """
+    File-like object for args.logfd, that collects the text written to it in
+    memory. A background thread writes it to the log file at least every
+    pmb.config.log_flush_interval seconds, or earlier when the buffer is
+    full. This avoids a write and flush for each line (which adds up with
+    --verbose). The log file gets rotated and compressed, when it becomes
+    bigger than pmb.config.log_rotate_size.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = open(path, "a+")
+        self.buffer = []
+        self.buffer_size = 0
+        self.lock = threading.Lock()  # buffer
+        self.lock_io = threading.Lock()  # handle, keeps the order of writes
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.start()
+
+    def write(self, text):
+        with self.lock:
+            self.buffer.append(text)
+            self.buffer_size += len(text)
+            full = self.buffer_size >= pmb.config.log_buffer_size
+        if full:
+            self.wakeup.set()
+        return len(text)
+
+    def flush(self):
+        """
+        Write the buffer to the log file now.
+        """
+        with self.lock_io:
+            with self.lock:
+                text = "".join(self.buffer)
+                self.buffer = []
+                self.buffer_size = 0
+            if text and not self.handle.closed:
+                self.handle.write(text)
+                self.handle.flush()
+                self.rotate()
+
+    def rotate(self):
+        """
+        Compress the log file to <log>.1.gz (after moving the older ones to
+        <log>.2.gz etc.), and truncate it, when it is too big. Truncating
+        instead of renaming the file keeps "pmbootstrap log" (tail -f)
+        working.
+        """
+        if self.handle.tell() < pmb.config.log_rotate_size:
+            return
+        for i in range(pmb.config.log_rotate_count - 1, 0, -1):
+            old = self.path + "." + str(i) + ".gz"
+            if os.path.exists(old):
+                os.replace(old, self.path + "." + str(i + 1) + ".gz")
+        with open(self.path, "rb") as handle:
+            with gzip.open(self.path + ".1.gz", "wb") as handle_gz:
+                shutil.copyfileobj(handle, handle_gz)
+        self.handle.truncate(0)
+        self.handle.seek(0)
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait(pmb.config.log_flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def start(self):
+        if self.thread:
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Flush the buffer and stop the background thread. Until start() gets
+        called, the text only gets written by flush().
+        """
+        if self.thread:
+            self.stopping = True
+            self.wakeup.set()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def close(self):
+        self.stop()
+        self.handle.close()
+
+    @property
+    def closed(self):
+        return self.handle.closed
 
 
 class log_handler(logging.StreamHandler):
@@ -42,8 +150,7 @@ class log_handler(logging.StreamHandler):
 
             # Everything: Write to logfd
             msg = "(" + str(os.getpid()).zfill(6) + ") " + msg
-            self._args.logfd.write(msg + "\n")
-            self._args.logfd.flush()
+            write(self._args, msg + "\n")
 
         except (KeyboardInterrupt, SystemExit):
             raise
@@ -51,6 +158,31 @@ class log_handler(logging.StreamHandler):
             self.handleError(record)
 
 
+def write(args, text):
+    """
+    Write text to the log file, without mixing it up with text written by
+    other threads at the same time.
+    """
+    with logfd_lock:
+        args.logfd.write(text)
+        if not isinstance(args.logfd, buffered_log):
+            args.logfd.flush()
+
+
+def suspend(args):
+    """
+    Stop the background thread of the log writer, for code that requires a
+    single-threaded process (e.g. pmb.helpers.userns.enter()).
+    """
+    if isinstance(args.logfd, buffered_log):
+        args.logfd.stop()
+
+
+def resume(args):
+    if isinstance(args.logfd, buffered_log):
+        args.logfd.start()
+
+
 def add_verbose_log_level():
     """
     Add a new log level "verbose", which is below "debug". Also monkeypatch
@@ -82,11 +214,18 @@ def init(args):
     if args.details_to_stdout:
         setattr(args, "logfd", sys.stdout)
     else:
-        setattr(args, "logfd", open(args.log, "a+"))
+        setattr(args, "logfd", buffered_log(args.log))
+        atexit.register(args.logfd.close)
+    init_handler(args)
+
 
-    # Set log format
+def init_handler(args):
+    """
+    Set log format and level, and write the log messages to args.logfd.
+    """
     root_logger = logging.getLogger()
     root_logger.handlers = []
+    root_logger.disabled = False
     formatter = logging.Formatter("[%(asctime)s] %(message)s",
                                   datefmt="%H:%M:%S")
 
@@ -53,8 +53,10 @@ def bind(args, source, destination, create_folders=True):
             raise RuntimeError("Mount failed, folder does not exist: " +
                                path)
 
-    # Actually mount the folder
-    pmb.helpers.run.root(args, ["mount", "--bind", source, destination])
+    # Actually mount the folder. Inside a user namespace, folders with
+    # submounts from the host (e.g. /proc) can only be mounted recursively.
+    option = "--rbind" if args.backend == "userns" else "--bind"
+    pmb.helpers.run.root(args, ["mount", option, source, destination])
 
     # Verify, that it has worked
     if not ismount(destination):
@@ -0,0 +1,119 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import contextlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+# Tracks for commands started with pmb.helpers.run_async.run_async(), which
+# run at the same time in one thread. Each one gets its own track in the
+# viewer.
+async_tracks = itertools.count(1000000)
+
+
+def enabled(args):
+    return bool(getattr(args, "profile", None))
+
+
+def record(args, name, category, start, end, fields={}, track=None):
+    """
+    Save one event for the trace, that gets written with --profile.
+
+    :param category: "command", "step" or "span"
+    :param start: time.time() when the event started
+    :param end: time.time() when the event ended
+    :param fields: additional information shown in the viewer
+    :param track: thread id in the trace (default: the current thread)
+    """
+    if not enabled(args):
+        return
+    # Microseconds since the session started
+    ts = int((start - args.cache.session_start) * 1000000)
+    ts_end = int((end - args.cache.session_start) * 1000000)
+    with args.cache.lock:
+        args.cache.profile_events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": ts,
+            "dur": ts_end - ts,
+            "pid": os.getpid(),
+            "tid": track or threading.get_ident(),
+            "args": fields})
+
+
+@contextlib.contextmanager
+def span(args, name, **fields):
+    """
+    Record the time spent in a block of code:
+
+    with pmb.helpers.profile.span(args, "build hello-world"):
+        ...
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(args, name, "span", start, time.time(), fields)
+
+
+def step(args, group, name=None, **fields):
+    """
+    Record sequential steps (e.g. "(1/5) prepare native chroot", then "(2/5)
+    create device rootfs", ...): end the previous step of the group and start
+    the next one.
+
+    :param group: steps of the same group follow each other, e.g. "install"
+    :param name: of the next step, None to only end the previous step
+    """
+    if not enabled(args):
+        return
+    now = time.time()
+    with args.cache.lock:
+        steps = args.cache.profile_steps
+        if group in steps:
+            name_prev, start, fields_prev = steps.pop(group)
+            record(args, name_prev, "step", start, now, fields_prev)
+        if name:
+            steps[group] = (name, now, fields)
+
+
+def write(args):
+    """
+    Write all recorded events as Chrome trace-event JSON to the file from
+    --profile, which can be opened with <https://ui.perfetto.dev> or
+    chrome://tracing.
+    """
+    if not enabled(args):
+        return
+    for group in list(args.cache.profile_steps.keys()):
+        step(args, group)
+    record(args, "pmbootstrap " + str(args.action), "span",
+           args.cache.session_start, time.time())
+
+    events = [{"name": "process_name", "ph": "M", "pid": os.getpid(),
+               "args": {"name": "pmbootstrap"}}]
+    events += sorted(args.cache.profile_events,
+                     key=lambda event: event["ts"])
+    with open(args.profile, "w") as handle:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, handle)
+    logging.info("Profile written to: " + args.profile)
@@ -132,19 +132,37 @@ def apkindex_files(args, arch=None):
     ret = [args.work + "/packages/" + arch + "/APKINDEX.tar.gz"]
 
     # Upstream postmarketOS binary repository
-    urls_todo = []
     mirror = args.mirror_postmarketos
-    if mirror:
-        if os.path.exists(mirror):
-            ret.append(mirror + "/" + arch + "/APKINDEX.tar.gz")
-        else:
-            # Non-local path: treat it like other URLs
-            urls_todo.append(mirror)
+    if mirror and os.path.exists(mirror):
+        ret.append(mirror + "/" + arch + "/APKINDEX.tar.gz")
 
     # Resolve the APKINDEX.$HASH.tar.gz files
+    for path, url in apkindex_files_remote(args, arch):
+        ret.append(path)
+
+    return ret
+
+
+def apkindex_files_remote(args, arch=None):
+    """
+    Get the outside paths to the resolved APKINDEX.tar.gz files of all
+    remote repositories for a specific arch, together with their URLs.
+    :param arch: defaults to native
+    :returns: [(path, url), ...] in the same order as apkindex_files()
+    """
+    if not arch:
+        arch = args.arch_native
+
+    # Upstream postmarketOS binary repository (non-local path: treat it like
+    # other URLs)
+    urls_todo = []
+    mirror = args.mirror_postmarketos
+    if mirror and not os.path.exists(mirror):
+        urls_todo.append(mirror)
+
     urls_todo += urls(args, False, False)
+    ret = []
     for url in urls_todo:
-        ret.append(args.work + "/cache_apk_" + arch + "/APKINDEX." +
-                   hash(url) + ".tar.gz")
-
+        ret.append((args.work + "/cache_apk_" + arch + "/APKINDEX." +
+                    hash(url) + ".tar.gz", url))
     return ret
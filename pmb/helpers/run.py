@@ -16,51 +16,93 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
-import subprocess
 import logging
 import os
+import subprocess
+import time
+
+import pmb.helpers.logging
+import pmb.helpers.profile
+import pmb.helpers.userns
+
+
+def log_output(args, buffer, data, end=False):
+    """
+    Write the output of a command to the log. Only complete lines get
+    written, so the output of commands running at the same time does not get
+    mixed up within lines.
+
+    :param buffer: incomplete last line, that was returned by the last call
+    :param data: new output
+    :param end: write the incomplete last line as well (no more output)
+    :returns: the new incomplete last line
+    """
+    data = buffer + data
+    split = len(data) if end else data.rfind(b"\n") + 1
+    if split:
+        text = data[:split].decode("utf-8", "replace")
+        if not text.endswith("\n"):
+            text += "\n"
+        pmb.helpers.logging.write(args, text)
+    return data[split:]
+
+
+def record(args, cmd, log_message, start, returncode, suffix, track=None):
+    """
+    Save the command for the trace (--profile).
+    """
+    pmb.helpers.profile.record(args, log_message, "command", start,
+                               time.time(), {"command": " ".join(cmd),
+                                             "suffix": suffix or "host",
+                                             "exit": returncode}, track)
 
 
 def core(args, cmd, log_message, log, return_stdout, check=True,
-         working_dir=None):
-    logging.debug(log_message)
+         working_dir=None, suffix=None):
     """
     Run the command and write the output to the log.
 
     :param check: raise an exception, when the command fails
+    :param working_dir: run the command in this folder (the working directory
+                        of pmbootstrap itself does not change, so commands can
+                        run from multiple threads)
+    :param suffix: of the chroot, that the command runs in (for --profile)
     """
-
-    if working_dir:
-        working_dir_old = os.getcwd()
-        os.chdir(working_dir)
+    logging.debug(log_message)
+    start = time.time()
 
     ret = None
-    try:
+    if not log:
+        logging.debug("*** output passed to pmbootstrap stdout, not" +
+                      " to this log ***")
+        returncode = subprocess.call(cmd, cwd=working_dir)
+    elif return_stdout:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, cwd=working_dir)
+        stdout, stderr = process.communicate()
+        log_output(args, b"", stdout + stderr, True)
+        returncode = process.returncode
+        if not returncode:
+            ret = stdout.decode("utf-8")
+    else:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, cwd=working_dir)
+        buffer = b""
+        fd = process.stdout.fileno()
+        for data in iter(lambda: os.read(fd, 65536), b""):
+            buffer = log_output(args, buffer, data)
+        log_output(args, buffer, b"", True)
+        process.stdout.close()
+        returncode = process.wait()
+
+    record(args, cmd, log_message, start, returncode, suffix)
+    if returncode and check:
         if log:
-            if return_stdout:
-                ret = subprocess.check_output(cmd).decode("utf-8")
-                args.logfd.write(ret)
-            else:
-                subprocess.check_call(cmd, stdout=args.logfd,
-                                      stderr=args.logfd)
-            args.logfd.flush()
-        else:
-            logging.debug("*** output passed to pmbootstrap stdout, not" +
-                          " to this log ***")
-            subprocess.check_call(cmd)
-
-    except subprocess.CalledProcessError as exc:
-        if check:
-            if log:
-                logging.debug("^" * 70)
-                logging.info("NOTE: The failed command's output is above"
-                             " the ^^^ line in the logfile: " + args.log)
-            raise RuntimeError("Command failed: " + log_message) from exc
-        else:
-            pass
-
-    if working_dir:
-        os.chdir(working_dir_old)
+            logging.debug("^" * 70)
+            logging.info("NOTE: The failed command's output is above"
+                         " the ^^^ line in the logfile: " + args.log)
+        raise RuntimeError("Command failed: " + log_message) from \
+            subprocess.CalledProcessError(returncode, cmd)
     return ret
 
 
@@ -76,10 +118,22 @@ def user(args, cmd, log=True, working_dir=None, return_stdout=False,
     return core(args, cmd, msg, log, return_stdout, check, working_dir)
 
 
+def sudo(args, cmd):
+    """
+    Prepare a command to run with root privileges, depending on the configured
+    backend: prefix it with "sudo", or enter the user namespace of this
+    session (see pmb/helpers/userns.py) and run it as it is.
+    """
+    if args.backend == "userns":
+        pmb.helpers.userns.enter(args)
+        return cmd
+    return ["sudo"] + cmd
+
+
 def root(args, cmd, log=True, working_dir=None, return_stdout=False,
          check=True):
     """
     :param working_dir: defaults to args.work
     """
-    cmd = ["sudo"] + cmd
+    cmd = sudo(args, cmd)
     return user(args, cmd, log, working_dir, return_stdout, check)
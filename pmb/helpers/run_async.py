@@ -0,0 +1,121 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+import subprocess
+import time
+
+import pmb.helpers.profile
+import pmb.helpers.run
+
+# Separate from pmb/helpers/run.py, so commands that do not run anything
+# asynchronously do not need to import asyncio.
+
+
+class AsyncLogProtocol(asyncio.SubprocessProtocol):
+    """
+    Write the output of a command started with run_async() to the log, and
+    resolve its future once the command has exited and all output has been
+    read.
+    """
+
+    def __init__(self, args, future, cmd, log_message, suffix, return_stdout,
+                 check):
+        self.args = args
+        self.future = future
+        self.cmd = cmd
+        self.log_message = log_message
+        self.suffix = suffix
+        self.start = time.time()
+        self.return_stdout = return_stdout
+        self.check = check
+        self.buffers = {1: b"", 2: b""}
+        self.stdout = []
+        self.pipes_open = 2
+        self.exited = False
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def pipe_data_received(self, fd, data):
+        if fd == 1 and self.return_stdout:
+            self.stdout.append(data)
+        self.buffers[fd] = pmb.helpers.run.log_output(self.args,
+                                                      self.buffers[fd], data)
+
+    def pipe_connection_lost(self, fd, exc):
+        pmb.helpers.run.log_output(self.args, self.buffers[fd], b"", True)
+        self.pipes_open -= 1
+        self.finish()
+
+    def process_exited(self):
+        self.exited = True
+        self.finish()
+
+    def finish(self):
+        if not self.exited or self.pipes_open or self.future.done():
+            return
+        returncode = self.transport.get_returncode()
+        self.transport.close()
+        pmb.helpers.run.record(self.args, self.cmd, self.log_message,
+                               self.start, returncode, self.suffix,
+                               next(pmb.helpers.profile.async_tracks))
+        if returncode and self.check:
+            self.future.set_exception(RuntimeError("Command failed: " +
+                                                   self.log_message))
+        elif self.return_stdout:
+            self.future.set_result(None if returncode else
+                                   b"".join(self.stdout).decode("utf-8"))
+        else:
+            self.future.set_result(returncode)
+
+
+def run_async(args, cmd, log_message=None, working_dir=None,
+              return_stdout=False, check=True, loop=None, suffix=None):
+    """
+    Start a command and return without waiting for it, so a scheduler can run
+    many commands at once. Like pmb.helpers.run.core() with log=True, the
+    output gets written to the log.
+
+    :param cmd: the full command (see pmb.helpers.run.sudo() for running it
+                as root)
+    :param log_message: defaults to the command
+    :param loop: the asyncio event loop, that the command belongs to
+                 (default: the current event loop)
+    :param suffix: of the chroot, that the command runs in (for --profile)
+    :returns: asyncio future, resolving to the output of the command when
+              return_stdout is set, otherwise to its exit code. When check is
+              set and the command fails, the future raises RuntimeError.
+    """
+    loop = loop or asyncio.get_event_loop()
+    log_message = log_message or "% " + " ".join(cmd)
+    logging.debug(log_message + " (async)")
+
+    future = asyncio.Future(loop=loop)
+    start = loop.subprocess_exec(
+        lambda: AsyncLogProtocol(args, future, cmd, log_message, suffix,
+                                 return_stdout, check),
+        *cmd, cwd=working_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def started(task):
+        if task.exception() and not future.done():
+            future.set_exception(task.exception())
+    asyncio.ensure_future(start, loop=loop).add_done_callback(started)
+    return future
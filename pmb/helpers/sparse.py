@@ -0,0 +1,249 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import errno
+import os
+import struct
+
+# Android sparse image format (see libsparse/sparse_format.h in AOSP), as
+# created by img2simg and understood by fastboot and heimdall.
+magic = 0xed26ff3a
+header_format = "<I4H4I"  # magic, major, minor, header sizes, block size,
+#                           blocks, chunks, checksum
+chunk_format = "<2H2I"  # type, reserved, size in blocks, size in bytes
+chunk_raw = 0xcac1
+chunk_fill = 0xcac2
+chunk_dont_care = 0xcac3
+chunk_crc32 = 0xcac4
+
+# Maximum size of one raw chunk (in blocks). Raw data gets buffered until
+# the chunk header can be written, so this limits the memory usage.
+raw_chunk_max_blocks = 1024
+
+
+class Writer(object):
+    """
+    Write a sparse image chunk by chunk, merging consecutive blocks of the
+    same kind.
+    """
+
+    def __init__(self, handle, block_size):
+        self.handle = handle
+        self.block_size = block_size
+        self.blocks = 0
+        self.chunks = 0
+        self.stats = {chunk_raw: 0, chunk_fill: 0, chunk_dont_care: 0}
+        self.pending = None  # (type, blocks, data or fill value)
+        handle.write(b"\0" * struct.calcsize(header_format))
+
+    def add(self, kind, blocks, data=b""):
+        """
+        :param kind: chunk_raw, chunk_fill or chunk_dont_care
+        :param data: the raw blocks, or the 4 byte fill value
+        """
+        if self.pending and self.pending[0] == kind:
+            if kind == chunk_dont_care:
+                self.pending[1] += blocks
+                return
+            if kind == chunk_fill and self.pending[2] == data:
+                self.pending[1] += blocks
+                return
+            if (kind == chunk_raw and self.pending[1] + blocks <=
+                    raw_chunk_max_blocks):
+                self.pending[1] += blocks
+                self.pending[2].append(data)
+                return
+        self.flush()
+        self.pending = [kind, blocks, [data] if kind == chunk_raw else data]
+
+    def flush(self):
+        if not self.pending:
+            return
+        kind, blocks, data = self.pending
+        if kind == chunk_raw:
+            data = b"".join(data)
+        header_size = struct.calcsize(chunk_format)
+        self.handle.write(struct.pack(chunk_format, kind, 0, blocks,
+                                      header_size + len(data)))
+        self.handle.write(data)
+        self.blocks += blocks
+        self.chunks += 1
+        self.stats[kind] += blocks
+        self.pending = None
+
+    def close(self):
+        """
+        Write the last chunk, and the file header with the final counts.
+        """
+        self.flush()
+        self.handle.seek(0)
+        self.handle.write(struct.pack(header_format, magic, 1, 0,
+                                      struct.calcsize(header_format),
+                                      struct.calcsize(chunk_format),
+                                      self.block_size, self.blocks,
+                                      self.chunks, 0))
+
+
+def data_ranges(fd, size):
+    """
+    Find the parts of a file, that have been written to (everything else is
+    a hole, that reads as zeros).
+
+    :returns: list of (start, end) in bytes
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        return [(0, size)]
+    ret = []
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                break  # only a hole after pos
+            return [(0, size)]  # not supported by the filesystem
+        pos = os.lseek(fd, start, os.SEEK_HOLE)
+        ret.append((start, min(pos, size)))
+    return ret
+
+
+def add_data(writer, data):
+    """
+    Add blocks, that have been read from the raw image: blocks, that only
+    repeat one 32 bit value (e.g. zeros), become fill chunks.
+    """
+    block_size = writer.block_size
+    zero = bytes(block_size)
+    if data == bytes(len(data)):
+        writer.add(chunk_fill, len(data) // block_size, zero[:4])
+        return
+    for offset in range(0, len(data), block_size):
+        block = data[offset:offset + block_size]
+        if block == zero or block == block[:4] * (block_size // 4):
+            writer.add(chunk_fill, 1, block[:4])
+        else:
+            writer.add(chunk_raw, 1, block)
+
+
+def write(path_raw, path_sparse, block_size=4096):
+    """
+    Convert a raw image to a sparse image in one pass (like img2simg). Holes
+    in the raw image become "don't care" chunks, so they do not get read or
+    flashed at all.
+
+    :param path_raw: input file
+    :param path_sparse: output file
+    :returns: {"blocks": total, "raw": blocks, "fill": blocks,
+               "dont_care": blocks}
+    """
+    buffer_size = 256 * block_size
+    with open(path_raw, "rb") as handle, open(path_sparse, "wb") as out:
+        size = os.fstat(handle.fileno()).st_size
+        blocks = -(-size // block_size)
+        writer = Writer(out, block_size)
+        pos = 0
+        for start, end in data_ranges(handle.fileno(), size):
+            # Block aligned: partial blocks count as data
+            start = start // block_size * block_size
+            end = min(-(-end // block_size) * block_size, blocks * block_size)
+            if start < pos:
+                start = pos
+            if start > pos:
+                writer.add(chunk_dont_care, (start - pos) // block_size)
+            handle.seek(start)
+            pos = start
+            while pos < end:
+                data = handle.read(min(buffer_size, end - pos))
+                # Pad the last block
+                length = -(-len(data) // block_size) * block_size
+                data += bytes(length - len(data))
+                add_data(writer, data)
+                pos += length
+        if pos < blocks * block_size:
+            writer.add(chunk_dont_care, blocks - pos // block_size)
+        writer.close()
+    return {"blocks": blocks,
+            "raw": writer.stats[chunk_raw],
+            "fill": writer.stats[chunk_fill],
+            "dont_care": writer.stats[chunk_dont_care]}
+
+
+def is_sparse(path):
+    """
+    :returns: True, when the file is a sparse image
+    """
+    with open(path, "rb") as handle:
+        header = handle.read(4)
+    return len(header) == 4 and struct.unpack("<I", header)[0] == magic
+
+
+def read_header(handle):
+    """
+    Read the file header of a sparse image, and seek to the first chunk.
+
+    :returns: (block size, total blocks, total chunks, chunk header size)
+    """
+    header = handle.read(struct.calcsize(header_format))
+    if len(header) < struct.calcsize(header_format):
+        raise RuntimeError("Not a sparse image (too short)")
+    (header_magic, major, minor, header_size, chunk_header_size,
+     block_size, blocks, chunks, checksum) = struct.unpack(header_format,
+                                                           header)
+    if header_magic != magic or major != 1:
+        raise RuntimeError("Not a sparse image (invalid header)")
+    handle.seek(header_size)
+    return (block_size, blocks, chunks, chunk_header_size)
+
+
+def chunks(path, data=True):
+    """
+    Iterate over the chunks of a sparse image.
+
+    :param data: read the payload (raw data or fill value)
+    :returns: generator of (type, blocks) or (type, blocks, payload)
+    """
+    with open(path, "rb") as handle:
+        block_size, blocks, count, chunk_header_size = read_header(handle)
+        for i in range(count):
+            header = handle.read(chunk_header_size)
+            kind, reserved, chunk_blocks, size = struct.unpack(
+                chunk_format, header[:struct.calcsize(chunk_format)])
+            payload_size = size - chunk_header_size
+            if data:
+                yield (kind, chunk_blocks, handle.read(payload_size))
+            else:
+                handle.seek(payload_size, os.SEEK_CUR)
+                yield (kind, chunk_blocks)
+
+
+def unsparse(path_sparse, path_raw):
+    """
+    Convert a sparse image back to a raw image (like simg2img), "don't care"
+    chunks become holes.
+    """
+    with open(path_sparse, "rb") as handle:
+        block_size, blocks = read_header(handle)[:2]
+    with open(path_raw, "wb") as out:
+        for kind, chunk_blocks, payload in chunks(path_sparse):
+            if kind == chunk_raw:
+                out.write(payload)
+            elif kind == chunk_fill:
+                out.write(payload * (chunk_blocks * block_size // 4))
+            elif kind == chunk_dont_care:
+                out.seek(chunk_blocks * block_size, os.SEEK_CUR)
+        out.truncate(blocks * block_size)
@@ -0,0 +1,162 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import ctypes
+import logging
+import os
+import pwd
+import shutil
+import subprocess
+
+import pmb.config
+import pmb.helpers.logging
+import pmb.helpers.run
+
+# Flags from <linux/sched.h>
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUSER = 0x10000000
+
+# The namespace belongs to the whole process (and not to one args object), so
+# it can only be entered once per pmbootstrap session.
+entered = False
+
+
+def subid_range(path, user, uid):
+    """
+    Find the subordinate id range of a user.
+
+    :param path: /etc/subuid or /etc/subgid
+    :param user: name of the user
+    :param uid: numeric id of the user, can be used instead of the name
+    :returns: (first, count) or None, when the user has no range assigned
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        for line in handle:
+            words = line.strip().split(":")
+            if len(words) == 3 and words[0] in [user, str(uid)]:
+                return (int(words[1]), int(words[2]))
+    return None
+
+
+def id_maps():
+    """
+    Calculate the uid and gid mappings for the namespace: the current user
+    becomes root, and the subordinate ids are used for everything else (e.g.
+    the "user" account inside the chroots).
+
+    :returns: {"uid": [inside, outside, count, ...], "gid": [...]}
+    """
+    ret = {}
+    user = pwd.getpwuid(os.getuid()).pw_name
+    for kind, current in [("uid", os.getuid()), ("gid", os.getgid())]:
+        path = "/etc/sub" + kind
+        subids = subid_range(path, user, current)
+        required = int(pmb.config.chroot_uid_user) + 1
+        if not subids or subids[1] < required:
+            raise RuntimeError("The 'userns' backend requires at least " +
+                               str(required) + " subordinate " + kind + "s"
+                               " for user '" + user + "' in " + path + "."
+                               " Example line: " + user + ":100000:65536")
+        if not shutil.which("new" + kind + "map"):
+            raise RuntimeError("The 'userns' backend requires the 'new" +
+                               kind + "map' program (usually found in the"
+                               " 'uidmap' or 'shadow' package).")
+        ret[kind] = [0, current, 1, 1, subids[0], subids[1]]
+    return ret
+
+
+def write_id_maps_child(pid, maps, read_fd):
+    """
+    Forked process, that waits until the parent has created the namespace,
+    and then writes the id mappings with the setuid helper programs (which
+    is not possible from inside the namespace).
+    """
+    ret = 1
+    try:
+        if os.read(read_fd, 1) == b"1":
+            ret = 0
+            for kind, mapping in maps.items():
+                cmd = ["new" + kind + "map", str(pid)]
+                cmd += [str(value) for value in mapping]
+                ret |= subprocess.call(cmd)
+    finally:
+        os._exit(ret)
+
+
+def enter(args):
+    """
+    Move pmbootstrap into a new user and mount namespace, in which it has
+    root privileges. Mounts made inside the namespace are not visible on the
+    host, and vanish when pmbootstrap exits. Does nothing, when the
+    namespace has been entered already.
+    """
+    global entered
+    if entered:
+        return
+
+    logging.debug("Enter user and mount namespace ('userns' backend)")
+    maps = id_maps()
+    pid = os.getpid()
+
+    # unshare() fails with CLONE_NEWUSER in multithreaded processes
+    pmb.helpers.logging.suspend(args)
+    try:
+        read_fd, write_fd = os.pipe()
+        child = os.fork()
+        if child == 0:
+            os.close(write_fd)
+            write_id_maps_child(pid, maps, read_fd)
+        os.close(read_fd)
+
+        # Create the namespace and let the child write the mappings
+        libc = ctypes.CDLL(None, use_errno=True)
+        error = None
+        if libc.unshare(CLONE_NEWUSER | CLONE_NEWNS) != 0:
+            error = os.strerror(ctypes.get_errno())
+        os.write(write_fd, b"0" if error else b"1")
+        os.close(write_fd)
+        status = os.waitpid(child, 0)[1]
+    finally:
+        pmb.helpers.logging.resume(args)
+    if error:
+        raise RuntimeError("Failed to create user namespace: " + error +
+                           " (are unprivileged user namespaces enabled in"
+                           " your kernel?)")
+    if status != 0:
+        raise RuntimeError("Failed to write the uid/gid mappings of the user"
+                           " namespace with newuidmap/newgidmap!")
+
+    # Don't propagate any mount events to the host
+    entered = True
+    pmb.helpers.run.user(args, ["mount", "--make-rprivate", "/"])
+
+
+def check_supported(args, action):
+    """
+    Raise an error for actions, that need real root privileges on the host
+    (e.g. loop devices, device mapper, binfmt_misc).
+
+    :param action: description for the error message
+    """
+    if args.backend != "userns":
+        return
+    raise RuntimeError(action + " is not possible with the 'userns' backend."
+                       " Switch to the 'sudo' backend for this step:"
+                       " 'pmbootstrap config backend sudo'")
@@ -16,6 +16,7 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
-from pmb.install.install import install
+from pmb.install.install import install, get_install_packages, \
+    create_device_rootfs, install_device
 from pmb.install.partition import partition
 from pmb.install.format import format
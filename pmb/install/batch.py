@@ -0,0 +1,188 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import concurrent.futures
+import copy
+import glob
+import logging
+import os
+
+import pmb.build
+import pmb.chroot
+import pmb.chroot.apk
+import pmb.config
+import pmb.helpers.profile
+import pmb.helpers.userns
+import pmb.install
+import pmb.parse.depends
+
+# "pmbootstrap install --devices a,b,c" (or --all-devices): install multiple
+# devices in one run. The native chroot gets prepared and the packages of
+# all devices get built once, then the device rootfs chroots get created
+# (one thread per arch) and finally the system images, one after another.
+
+
+def devices(args):
+    """
+    :returns: list of device names from --devices, or all devices in the
+              aports folder for --all-devices (except the ones with an arch,
+              that is not enabled in pmbootstrap)
+    """
+    if not args.all_devices:
+        ret = []
+        for device in args.devices.split(","):
+            if device.strip() and device.strip() not in ret:
+                ret.append(device.strip())
+        return ret
+
+    ret = []
+    for path in sorted(glob.glob(args.aports + "/device/device-*")):
+        if not os.path.exists(path + "/deviceinfo"):
+            continue
+        device = os.path.basename(path)[len("device-"):]
+        try:
+            device_args(args, device).deviceinfo
+        except ValueError as e:
+            logging.info("NOTE: Skipping " + device + ": " + str(e))
+            continue
+        ret.append(device)
+    return ret
+
+
+def device_args(args, device):
+    """
+    :returns: a copy of args for one device (the deviceinfo gets read again
+              on first access, see pmb.parse.arguments.Namespace)
+    """
+    ret = copy.copy(args)
+    ret.device = device
+    ret.__dict__.pop("deviceinfo", None)
+    return ret
+
+
+def packages(args_devices):
+    """
+    :param args_devices: from device_args(), one per device
+    :returns: {device: packages to install}, and the sorted list of all
+              packages to build as [(pkgname, arch), ...]: the packages to
+              install, the ones that are installed in the existing rootfs
+              chroots and all of their dependencies (like
+              pmb.chroot.apk.install() builds them)
+    """
+    ret = {}
+    build = set()
+    for args in args_devices:
+        ret[args.device] = pmb.install.get_install_packages(args)
+        arch = args.deviceinfo["arch"]
+        installed = pmb.chroot.apk.installed(args, "rootfs_" + args.device)
+        pkgnames = ret[args.device] + list(installed.keys())
+        for pkgname in pmb.parse.depends.recurse(args, pkgnames, arch,
+                                                 strict=True):
+            build.add((pkgname, arch))
+    return (ret, sorted(build))
+
+
+def groups(args_devices):
+    """
+    Devices with the same arch share the apk cache and the package indexes,
+    so they get set up one after another.
+
+    :returns: [[args, args, ...], ...] one list per arch
+    """
+    ret = {}
+    for args in args_devices:
+        ret.setdefault(args.deviceinfo["arch"], []).append(args)
+    return [ret[arch] for arch in sorted(ret)]
+
+
+def create_rootfs_group(group, install_packages):
+    """
+    Create the device rootfs chroots of one group (runs in its own thread).
+    """
+    for args in group:
+        with pmb.helpers.profile.span(args, "create device rootfs",
+                                      device=args.device):
+            pmb.install.create_device_rootfs(args,
+                                             install_packages[args.device],
+                                             build=False)
+
+
+def create_rootfs_all(args, args_devices, install_packages):
+    """
+    Create all device rootfs chroots, one thread per arch.
+    """
+    # Initialize the chroots first: this also installs the emulators for
+    # foreign arches into the native chroot, which must not happen in
+    # multiple threads at once
+    for args_device in args_devices:
+        pmb.chroot.init(args_device, "rootfs_" + args_device.device)
+    if args.backend == "userns":
+        pmb.helpers.userns.enter(args)
+
+    errors = []
+    all_groups = groups(args_devices)
+    with concurrent.futures.ThreadPoolExecutor(len(all_groups)) as executor:
+        futures = {}
+        for group in all_groups:
+            future = executor.submit(create_rootfs_group, group,
+                                     install_packages)
+            futures[future] = group
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception():
+                group = futures[future]
+                logging.info("ERROR: Failed to create the device rootfs for " +
+                             group[0].deviceinfo["arch"] + ": " +
+                             str(future.exception()))
+                errors.append(future.exception())
+    if errors:
+        raise errors[0]
+
+
+def install(args):
+    if args.sdcard:
+        raise RuntimeError("Installing multiple devices to one sdcard is not"
+                           " possible.")
+    args_devices = [device_args(args, device) for device in devices(args)]
+    if not args_devices:
+        raise RuntimeError("No devices to install")
+    logging.info("Installing " + str(len(args_devices)) + " devices: " +
+                 ", ".join(args.device for args in args_devices))
+
+    # Install required programs in native chroot
+    logging.info("*** (1/4) PREPARE NATIVE CHROOT ***")
+    pmb.helpers.profile.step(args, "install", "(1/4) prepare native chroot")
+    pmb.chroot.apk.install(args, pmb.config.install_native_packages,
+                           build=False)
+
+    # Build the packages of all devices once
+    logging.info("*** (2/4) BUILD PACKAGES ***")
+    pmb.helpers.profile.step(args, "install", "(2/4) build packages")
+    install_packages, build = packages(args_devices)
+    for pkgname, arch in build:
+        pmb.build.package(args, pkgname, arch)
+
+    logging.info("*** (3/4) CREATE DEVICE ROOTFS ***")
+    pmb.helpers.profile.step(args, "install", "(3/4) create device rootfs")
+    create_rootfs_all(args, args_devices, install_packages)
+
+    logging.info("*** (4/4) INSTALL DEVICES ***")
+    pmb.helpers.profile.step(args, "install", "(4/4) install devices")
+    for i, args_device in enumerate(args_devices):
+        logging.info('*** DEVICE {}/{}: "{}" ***'.format(
+                     i + 1, len(args_devices), args_device.device))
+        pmb.install.install_device(args_device)
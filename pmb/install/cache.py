@@ -0,0 +1,287 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+
+import pmb.chroot
+import pmb.chroot.apk
+import pmb.helpers.run
+
+# Keep the last system images (or recovery zips), that "pmbootstrap install"
+# has created, in $WORK/cache_images/<key>. The key is the checksum of a
+# manifest with the exact packages in the device rootfs, the install options,
+# the os-release file and the keys copied from the host, so the same
+# installation can be served again without creating it from scratch.
+#
+# Disabled by default: a cached installation has the passwords, that were
+# set when it was created, and changes made manually in the device rootfs
+# chroot (without installing packages) are not detected.
+
+
+def packages(args, suffix):
+    """
+    Read the installed packages from the apk database of a chroot.
+
+    :returns: {pkgname: {"version": ..., "checksum": ...}}, the checksum
+              changes when a package gets rebuilt without changing the
+              version
+    """
+    path = args.work + "/chroot_" + suffix + "/lib/apk/db/installed"
+    ret = {}
+    package = {}
+    with open(path, encoding="utf-8") as handle:
+        for line in list(handle) + ["\n"]:
+            line = line.rstrip("\n")
+            if not line:
+                if "P" in package:
+                    ret[package["P"]] = {"version": package.get("V"),
+                                         "checksum": package.get("C")}
+                package = {}
+            elif line[1:2] == ":" and line[0] in "PVC":
+                package[line[0]] = line[2:]
+    return ret
+
+
+def os_release(args, suffix):
+    """
+    :returns: the variables from /etc/os-release (see
+              pmb.install.file.write_os_release()), e.g.
+              {"VERSION": "0.1.0-a1b2c3d4", "PMOS_HASH": ...}
+    """
+    path = args.work + "/chroot_" + suffix + "/etc/os-release"
+    ret = {}
+    if not os.path.exists(path):
+        return ret
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if "=" in line:
+                key, value = line.rstrip("\n").split("=", 1)
+                ret[key] = value.strip('"')
+    return ret
+
+
+def options(args):
+    """
+    :returns: the install options, that change the created files
+    """
+    ret = {"device": args.device,
+           "target": "image",
+           "full_disk_encryption": args.full_disk_encryption,
+           "cipher": args.cipher,
+           "iter_time": args.iter_time,
+           "keymap": args.keymap,
+           "flash_sparse": args.deviceinfo["flash_sparse"],
+           "image_size_margin": args.image_size_margin}
+    if args.sdcard:
+        ret["target"] = "sdcard"
+    if args.android_recovery_zip:
+        ret.update({"target": "recovery zip",
+                    "flavor": args.flavor,
+                    "recovery_flash_bootimg": args.recovery_flash_bootimg,
+                    "recovery_install_partition":
+                        args.recovery_install_partition,
+                    "recovery_compression": args.recovery_compression,
+                    "recovery_compression_level":
+                        args.recovery_compression_level})
+    return ret
+
+
+def files(args):
+    """
+    Checksums of the files from the host, that get copied into the
+    installation: the apk keys (see pmb.install.install.copy_files_other())
+    and the ssh public key (see pmb.install.install.copy_ssh_key()).
+
+    :returns: {path: sha256 (hex)}
+    """
+    paths = sorted(glob.glob(args.work + "/config_apk_keys/*.pub"))
+    paths.append(os.path.expanduser("~/.ssh/id_rsa.pub"))
+    ret = {}
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "rb") as handle:
+                ret[path] = hashlib.sha256(handle.read()).hexdigest()
+    return ret
+
+
+def manifest(args):
+    """
+    Describe the installation, that gets created from the device rootfs
+    chroot with the current options.
+    """
+    suffix = "rootfs_" + args.device
+    return {"packages": packages(args, suffix),
+            "options": options(args),
+            "os_release": os_release(args, suffix),
+            "files": files(args)}
+
+
+def key(manifest):
+    """
+    :returns: sha256 checksum of the manifest (hex)
+    """
+    data = json.dumps(manifest, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def enabled(args):
+    """
+    Sdcards are not cached: the installation is written to the device
+    directly, and there is no file that could be served again.
+    """
+    return int(args.image_cache_count) > 0 and not args.sdcard
+
+
+def artifact(args):
+    """
+    :returns: path to the file, that the installation creates
+    """
+    if args.android_recovery_zip:
+        return (args.work + "/chroot_buildroot_" + args.deviceinfo["arch"] +
+                "/var/lib/postmarketos-android-recovery-installer/pmos-" +
+                args.device + ".zip")
+    return (args.work + "/chroot_native/home/user/rootfs/" + args.device +
+            ".img")
+
+
+def link(args, source, target):
+    """
+    Hardlink a file (both are in $WORK, so usually on the same filesystem),
+    or copy it when that is not possible. The files belong to root.
+    """
+    if (os.stat(source).st_dev ==
+            os.stat(os.path.dirname(target)).st_dev):
+        pmb.helpers.run.root(args, ["ln", "-f", source, target])
+    else:
+        pmb.helpers.run.root(args, ["cp", "--sparse=always", source,
+                                    target + ".tmp"])
+        pmb.helpers.run.root(args, ["mv", "-f", target + ".tmp", target])
+
+
+def lookup(args, key):
+    """
+    :returns: path to the cached file, or None when it is not cached
+    """
+    folder = args.work + "/cache_images/" + key
+    path = folder + "/" + os.path.basename(artifact(args))
+    if (not os.path.exists(folder + "/manifest.json") or
+            not os.path.exists(path)):
+        return None
+    return path
+
+
+def restore(args, key):
+    """
+    Put the cached file in place of the one, that the installation would
+    create.
+
+    :returns: True when it was cached, False otherwise
+    """
+    path = lookup(args, key)
+    if not path:
+        return False
+    logging.info("Using the cached " + ("recovery zip" if
+                                        args.android_recovery_zip else
+                                        "system image") + " (" + key[:12] +
+                 "), the installation did not change")
+    logging.info("WARNING: It has the passwords, that were set when it was"
+                 " created! Run 'pmbootstrap install --image-cache-count 0'"
+                 " to create a new one.")
+
+    # Folder of the file in the chroot
+    if args.android_recovery_zip:
+        pmb.chroot.apk.install(args, ["postmarketos-android-recovery-"
+                                      "installer"],
+                               "buildroot_" + args.deviceinfo["arch"])
+    else:
+        pmb.chroot.user(args, ["mkdir", "-p", "/home/user/rootfs"])
+    link(args, path, artifact(args))
+
+    # Most recently used
+    os.utime(args.work + "/cache_images/" + key + "/manifest.json")
+    return True
+
+
+def release(args):
+    """
+    Detach the existing file from the cache before it gets modified: the
+    cached copy is a hardlink to it. An image, that gets updated in place
+    (install --incremental) needs a real copy, all other files get created
+    from scratch anyway.
+    """
+    path = artifact(args)
+    if not os.path.exists(path) or os.stat(path).st_nlink == 1:
+        return
+    if args.incremental and not args.android_recovery_zip:
+        pmb.helpers.run.root(args, ["cp", "--sparse=always", path,
+                                    path + ".tmp"])
+        pmb.helpers.run.root(args, ["mv", "-f", path + ".tmp", path])
+    else:
+        pmb.helpers.run.root(args, ["rm", "-f", path])
+
+
+def store(args, key, manifest):
+    """
+    Add the file, that the installation has created, to the cache and remove
+    the least recently used ones, so at most image_cache_count are left.
+    """
+    path = artifact(args)
+    if not os.path.exists(path):
+        return
+    folder = args.work + "/cache_images/" + key
+    if os.path.exists(folder):
+        pmb.helpers.run.root(args, ["rm", "-rf", folder])
+    os.makedirs(folder)
+    link(args, path, folder + "/" + os.path.basename(path))
+
+    # The manifest marks the entry as complete
+    with open(folder + "/manifest.json", "w") as handle:
+        json.dump(manifest, handle, indent=4, sort_keys=True)
+    logging.debug("Stored the installation in the image cache: " + key)
+    prune(args)
+
+
+def expired(folders, count):
+    """
+    :param folders: {path: last use timestamp, or None when incomplete}
+    :param count: maximum count of entries
+    :returns: folders to remove: incomplete ones, and the least recently
+              used ones over the count
+    """
+    complete = sorted([path for path, access in folders.items()
+                       if access is not None],
+                      key=lambda path: -folders[path])
+    incomplete = [path for path, access in folders.items() if access is None]
+    return sorted(incomplete + complete[count:])
+
+
+def prune(args):
+    folders = {}
+    for folder in glob.glob(args.work + "/cache_images/*"):
+        manifest = folder + "/manifest.json"
+        folders[folder] = (os.path.getmtime(manifest) if
+                           os.path.exists(manifest) else None)
+    remove = expired(folders, int(args.image_cache_count))
+    if remove:
+        logging.debug("Remove from the image cache: " + ", ".join(
+            os.path.basename(folder) for folder in remove))
+        pmb.helpers.run.root(args, ["rm", "-rf"] + remove)
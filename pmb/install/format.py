@@ -19,14 +19,27 @@ along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import logging
 import pmb.chroot
+import pmb.install.size
 
 
-def format_and_mount_boot(args):
+def mkfs_inodes(inodes, name):
+    """
+    :param inodes: {"boot": count, "root": count} or None
+    :returns: mkfs arguments for the block size and inode count, that the
+              size of the partition was calculated with
+    """
+    if not inodes:
+        return []
+    return ["-b", str(pmb.install.size.block_size), "-N", str(inodes[name])]
+
+
+def format_and_mount_boot(args, inodes=None):
     mountpoint = "/mnt/install/boot"
     device = "/dev/installp1"
     logging.info("(native) format " + device + " (boot, ext2), mount to " +
                  mountpoint)
-    pmb.chroot.root(args, ["mkfs.ext2", "-F", "-q", "-L", "pmOS_boot", device])
+    pmb.chroot.root(args, ["mkfs.ext2", "-F", "-q", "-L", "pmOS_boot"] +
+                    mkfs_inodes(inodes, "boot") + [device])
     pmb.chroot.root(args, ["mkdir", "-p", mountpoint])
     pmb.chroot.root(args, ["mount", device, mountpoint])
 
@@ -48,7 +61,7 @@ def format_and_mount_root(args):
             raise RuntimeError("Failed to open cryptdevice!")
 
 
-def format_and_mount_pm_crypt(args):
+def format_and_mount_pm_crypt(args, inodes=None):
     if args.full_disk_encryption:
         device = "/dev/mapper/pm_crypt"
     else:
@@ -56,12 +69,17 @@ def format_and_mount_pm_crypt(args):
     mountpoint = "/mnt/install"
     logging.info("(native) format " + device + " (ext4), mount to " +
                  mountpoint)
-    pmb.chroot.root(args, ["mkfs.ext4", "-F", "-q", "-L", "pmOS_root", device])
+    pmb.chroot.root(args, ["mkfs.ext4", "-F", "-q", "-L", "pmOS_root"] +
+                    mkfs_inodes(inodes, "root") + [device])
     pmb.chroot.root(args, ["mkdir", "-p", mountpoint])
     pmb.chroot.root(args, ["mount", device, mountpoint])
 
 
-def format(args):
+def format(args, inodes=None):
+    """
+    :param inodes: {"boot": count, "root": count} for mkfs, see
+                   pmb/install/size.py
+    """
     format_and_mount_root(args)
-    format_and_mount_pm_crypt(args)
-    format_and_mount_boot(args)
+    format_and_mount_pm_crypt(args, inodes)
+    format_and_mount_boot(args, inodes)
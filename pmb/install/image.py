@@ -0,0 +1,219 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import glob
+import logging
+import math
+import os
+
+import pmb.chroot
+import pmb.helpers.cli
+import pmb.helpers.run
+import pmb.install.size
+
+# Build the system image without loop devices: the boot and root
+# filesystems get created from folders with "mke2fs -d", then the partition
+# table gets written to the image file and the filesystems are copied to
+# their offsets. Full disk encryption needs the device mapper, and sdcards
+# are block devices already, so these still go through /dev/install (see
+# pmb/install/blockdevice.py).
+
+MiB = 1024 * 1024
+
+# Folders of the root filesystem, that get written to after staging (see
+# pmb.install.install.copy_files_other()). They get copied instead of
+# hardlinked, so writing to them does not modify the device rootfs chroot.
+stage_copy = ["etc/apk/keys"]
+
+
+def supported(args):
+    """
+    :returns: True, when the system image can be created without loop
+              devices
+    """
+    return not args.sdcard and not args.full_disk_encryption
+
+
+def layout(size_image, size_boot, inodes=None):
+    """
+    Calculate the partition layout, the same one that pmb.install.partition()
+    creates with parted: the boot partition starts at 1 MiB and ends at
+    size_boot, the root partition fills the rest of the image.
+
+    :param size_image: size of the whole image in bytes
+    :param size_boot: end of the boot partition in bytes
+    :param inodes: {"boot": count, "root": count} for mke2fs
+    :returns: {"image": size, "boot": (start, size), "root": (start, size),
+               "inodes": inodes} with all sizes in MiB
+    """
+    image = math.ceil(size_image / MiB)
+    boot_end = math.ceil(size_boot / MiB)
+    if boot_end + 1 >= image:
+        raise RuntimeError("The boot partition (" + str(boot_end) + " MiB)"
+                           " does not fit into the image (" + str(image) +
+                           " MiB)")
+    return {"image": image,
+            "boot": (1, boot_end - 1),
+            "root": (boot_end, image - boot_end),
+            "inodes": inodes}
+
+
+def paths(args):
+    """
+    :returns: paths inside the native chroot, that the image gets built in
+    """
+    prefix = "/home/user/rootfs/" + args.device
+    return {"image": prefix + ".img",
+            "boot": prefix + "_boot",
+            "root": prefix + "_root",
+            "boot.img": prefix + "_boot.img",
+            "root.img": prefix + "_root.img"}
+
+
+def clean(args):
+    """
+    Remove the staging folders and filesystem images from a previous run.
+    """
+    native = args.work + "/chroot_native"
+    existing = [path for name, path in sorted(paths(args).items())
+                if name != "image" and os.path.lexists(native + path)]
+    if existing:
+        pmb.chroot.root(args, ["rm", "-rf"] + existing)
+
+
+def stage(args):
+    """
+    Prepare the content of the boot and root filesystems in the native
+    chroot, as hardlinks to the files in the device rootfs chroot (so no
+    file content gets copied), except for stage_copy. /home gets left out,
+    because it contains empty mountpoint folders.
+    """
+    logging.info("(native) prepare the content of the boot and root"
+                 " filesystems")
+    native = args.work + "/chroot_native"
+    rootfs = args.work + "/chroot_rootfs_" + args.device
+    boot = paths(args)["boot"]
+    root = paths(args)["root"]
+    clean(args)
+    pmb.chroot.user(args, ["mkdir", "-p", "/home/user/rootfs"])
+    pmb.chroot.root(args, ["mkdir", "-p", boot, root + "/boot",
+                           root + "/home"])
+
+    # Hardlinks only work within one filesystem
+    cp = ["cp", "-al"]
+    if os.stat(rootfs).st_dev != os.stat(native + "/home/user/rootfs").st_dev:
+        cp = ["cp", "-a"]
+
+    folders = [path for path in glob.glob(rootfs + "/*")
+               if os.path.basename(path) not in ["boot", "home"]]
+    pmb.helpers.run.root(args, cp + folders + [native + root + "/"])
+    pmb.helpers.run.root(args, cp + [rootfs + "/boot/.", native + boot +
+                                     "/"])
+
+    # Real copies of what gets written to afterwards
+    for folder in stage_copy:
+        if not os.path.exists(rootfs + "/" + folder):
+            continue
+        target = native + root + "/" + folder
+        pmb.helpers.run.root(args, ["rm", "-rf", target])
+        pmb.helpers.run.root(args, ["cp", "-a", rootfs + "/" + folder,
+                                    os.path.dirname(target) + "/"])
+
+
+def create_filesystems(args, layout):
+    """
+    Create the boot (ext2) and root (ext4) filesystem images from the
+    staging folders.
+    """
+    path = paths(args)
+    for name, fstype, label in [("boot", "ext2", "pmOS_boot"),
+                                ("root", "ext4", "pmOS_root")]:
+        size = str(layout[name][1]) + "M"
+        logging.info("(native) create " + name + " filesystem (" +
+                     fstype + ", " + size + ")")
+        inodes = []
+        if layout["inodes"]:
+            inodes = ["-b", str(pmb.install.size.block_size), "-N",
+                      str(layout["inodes"][name])]
+        pmb.chroot.root(args, ["mkfs." + fstype, "-F", "-q", "-L", label] +
+                        inodes + ["-d", path[name], path[name + ".img"],
+                                  size])
+
+
+def assemble(args, layout):
+    """
+    Write the partition table to the image file, and copy the filesystem
+    images to the offsets of their partitions.
+    """
+    path = paths(args)
+    image = path["image"]
+    logging.info("(native) write partition table and filesystems to " +
+                 args.device + ".img")
+    pmb.chroot.root(args, ["rm", "-f", image])
+    pmb.chroot.root(args, ["truncate", "-s", str(layout["image"]) + "M",
+                           image])
+
+    # Partition table (regular file, so parted does not need to inform the
+    # kernel about it)
+    sectors = MiB // 512
+    boot_start = layout["boot"][0] * sectors
+    root_start = layout["root"][0] * sectors
+    end = layout["image"] * sectors
+    commands = [
+        ["mktable", "msdos"],
+        ["mkpart", "primary", "ext2", str(boot_start) + "s",
+         str(root_start - 1) + "s"],
+        ["mkpart", "primary", str(root_start) + "s", str(end - 1) + "s"],
+        ["set", "1", "boot", "on"]
+    ]
+    for command in commands:
+        pmb.chroot.root(args, ["parted", "-s", image] + command)
+
+    # Filesystems
+    for name in ["boot", "root"]:
+        pmb.chroot.root(args, ["dd", "if=" + path[name + ".img"],
+                               "of=" + image, "bs=1M",
+                               "seek=" + str(layout[name][0]),
+                               "conv=notrunc"])
+
+    # dd writes the free space of the filesystems as zeros. Turn it into
+    # holes again, so the image stays sparse (and gets flashed as "don't
+    # care", see pmb/helpers/sparse.py)
+    pmb.chroot.root(args, ["fallocate", "--dig-holes", image])
+
+
+def confirm_size(args, layout):
+    """
+    Show the size of the image, and let the user confirm it.
+    """
+    mb = str(layout["image"]) + "M"
+    logging.info("(native) create " + args.device + ".img (" + mb + ")")
+    logging.info("WARNING: Make sure, that your target device's partition"
+                 " table has allocated at least " + mb + " as system"
+                 " partition!")
+    if not pmb.helpers.cli.confirm(args, default=True):
+        raise RuntimeError("Aborted.")
+
+
+def create(args, layout):
+    """
+    Create the system image from the staging folders (see stage()).
+    """
+    create_filesystems(args, layout)
+    assemble(args, layout)
+    clean(args)
@@ -0,0 +1,173 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import struct
+
+import pmb.chroot
+import pmb.chroot.apk
+import pmb.helpers.run
+import pmb.helpers.sparse
+import pmb.install.losetup
+
+# "pmbootstrap install --incremental": mount the existing system image and
+# only copy the files, that changed in the rootfs chroot (with rsync).
+
+
+def image_path(args):
+    """
+    :returns: path to the system image inside the native chroot
+    """
+    return "/home/user/rootfs/" + args.device + ".img"
+
+
+def partitions(path):
+    """
+    Read the msdos partition table of an image.
+
+    :returns: [(start, size), ...] in bytes for the used primary partitions,
+              or None when there is no partition table
+    """
+    with open(path, "rb") as handle:
+        mbr = handle.read(512)
+    if len(mbr) < 512 or mbr[510:512] != b"\x55\xaa":
+        return None
+    ret = []
+    for i in range(4):
+        entry = mbr[446 + i * 16:446 + (i + 1) * 16]
+        start, size = struct.unpack("<II", entry[8:16])
+        if size:
+            ret.append((start * 512, size * 512))
+    return ret
+
+
+def filesystem(path, offset):
+    """
+    Read the superblock of an ext2/3/4 filesystem.
+
+    :param offset: of the filesystem inside the file in bytes
+    :returns: {"size": bytes, "inodes": count}, or None when there is no ext
+              filesystem at the offset
+    """
+    with open(path, "rb") as handle:
+        handle.seek(offset + 1024)
+        superblock = handle.read(1024)
+    if len(superblock) < 1024 or superblock[56:58] != b"\x53\xef":
+        return None
+    inodes, blocks = struct.unpack("<II", superblock[0:8])
+    block_size = 1024 << struct.unpack("<I", superblock[24:28])[0]
+    return {"size": blocks * block_size, "inodes": inodes}
+
+
+def check(args):
+    """
+    Check if there is an existing system image, that can be updated in
+    place.
+
+    :returns: None when it can be updated, otherwise the reason why not
+    """
+    if args.sdcard:
+        return "installing to an sdcard"
+    if args.full_disk_encryption:
+        return "full disk encryption is enabled (use --no-fde)"
+    if args.backend == "userns":
+        return "mounting the image is not possible with the userns backend"
+
+    path = args.work + "/chroot_native" + image_path(args)
+    if not os.path.exists(path):
+        return "no existing image"
+    if pmb.helpers.sparse.is_sparse(path):
+        unsparse(args)
+
+    table = partitions(path)
+    if not table or len(table) != 2:
+        return "unexpected partition table"
+    return None
+
+
+def check_sizes(args, sizes):
+    """
+    Check if the files fit into the filesystems of the existing image.
+
+    :param sizes: what the files need, from pmb.install.size.subpartitions()
+    :returns: None when they fit, otherwise the reason why not
+    """
+    path = args.work + "/chroot_native" + image_path(args)
+    for (start, size), name in zip(partitions(path), ["boot", "root"]):
+        existing = filesystem(path, start)
+        if not existing:
+            return "no ext filesystem in the " + name + " partition"
+        needed = sizes[name]
+        if (existing["size"] < needed["size"] or
+                existing["inodes"] < needed["inodes"]):
+            return ("the " + name + " partition is too small (" +
+                    str(existing["size"] // 1024 // 1024) + " MiB, " +
+                    str(existing["inodes"]) + " inodes; need " +
+                    str(needed["size"] // 1024 // 1024) + " MiB, " +
+                    str(needed["inodes"]) + " inodes)")
+    return None
+
+
+def unsparse(args):
+    """
+    Convert the existing system image back from the Android sparse format
+    (flash_sparse=true in the deviceinfo), so it can be mounted.
+    """
+    logging.info("(native) convert the sparse system image to a raw image")
+    path = args.work + "/chroot_native" + image_path(args)
+    path_raw = args.work + "/" + args.device + "-raw.img"
+    pmb.helpers.sparse.unsparse(path, path_raw)
+    pmb.helpers.run.root(args, ["mv", "-f", path_raw, path])
+
+
+def mount(args):
+    """
+    Mount the partitions of the existing image to /mnt/install and
+    /mnt/install/boot in the native chroot (loop devices with offsets, so no
+    partition scanning is required).
+    """
+    path = image_path(args)
+    table = partitions(args.work + "/chroot_native" + path)
+    pmb.install.losetup.init(args)
+    for (start, size), mountpoint in [(table[1], "/mnt/install"),
+                                      (table[0], "/mnt/install/boot")]:
+        logging.info("(native) mount " + args.device + ".img partition to " +
+                     mountpoint)
+        pmb.chroot.root(args, ["mkdir", "-p", mountpoint])
+        pmb.chroot.root(args, ["mount", "-o", "loop,offset=" + str(start) +
+                               ",sizelimit=" + str(size), path, mountpoint])
+
+
+def update(args, rootfs):
+    """
+    Mount the image and synchronize it with the rootfs chroot: copy new and
+    modified files, delete removed ones and update the metadata. /home is
+    left alone, like in a full install.
+
+    :param rootfs: mountpoint of the device rootfs inside the native chroot
+    """
+    pmb.chroot.apk.install(args, ["rsync"])
+    mount(args)
+    logging.info("(native) update " + args.device + ".img from rootfs_" +
+                 args.device)
+    pmb.chroot.root(args, ["rsync", "-aHAX", "--numeric-ids", "--delete",
+                           "--stats", "--exclude=/home/",
+                           "--exclude=/lost+found/",
+                           "--exclude=/boot/lost+found/",
+                           rootfs + "/", "/mnt/install/"])
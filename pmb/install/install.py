@@ -25,10 +25,17 @@ import pmb.chroot.apk
 import pmb.chroot.other
 import pmb.chroot.initfs
 import pmb.config
+import pmb.helpers.profile
 import pmb.helpers.run
+import pmb.helpers.sparse
+import pmb.helpers.userns
 import pmb.install.blockdevice
+import pmb.install.cache
 import pmb.install.file
+import pmb.install.image
+import pmb.install.incremental
 import pmb.install.recovery
+import pmb.install.size
 import pmb.install
 
 
@@ -44,26 +51,21 @@ def mount_device_rootfs(args, suffix="native"):
 
 def get_subpartitions_size(args):
     """
-    Calculate the size of the whole image and boot subpartition.
+    Calculate the size of the whole image and boot subpartition (see
+    pmb/install/size.py).
 
-    :returns: (full, boot) the size of the full image and boot
-              partition as integer in bytes
+    :returns: (full, boot, inodes) the size of the full image and the end of
+              the boot partition as integer in bytes, and the inode counts
+              for mke2fs as {"boot": count, "root": count}
     """
-    # Calculate required sizes first
-    chroot = args.work + "/chroot_rootfs_" + args.device
-    root = pmb.helpers.other.folder_size(args, chroot)
-    boot = pmb.helpers.other.folder_size(args, chroot + "/boot")
-    home = pmb.helpers.other.folder_size(args, chroot + "/home")
+    sizes = pmb.install.size.subpartitions(args)
 
-    # The home folder gets omitted when copying the rootfs to
-    # /dev/installp2
-    full = root - home
-
-    # Add some free space, see also:
-    # https://github.com/postmarketOS/pmbootstrap/pull/336
-    full *= 1.20
-    boot += 15 * 1024 * 1024
-    return (full, boot)
+    # The boot partition starts at 1 MiB, the home folder gets omitted
+    boot = 1024 * 1024 + sizes["boot"]["size"]
+    full = boot + sizes["root"]["size"]
+    inodes = {"boot": sizes["boot"]["inodes"],
+              "root": sizes["root"]["inodes"]}
+    return (full, boot, inodes)
 
 
 def copy_files_from_chroot(args):
@@ -90,12 +92,14 @@ def copy_files_from_chroot(args):
                     working_dir=mountpoint)
 
 
-def copy_files_other(args):
+def copy_files_other(args, target="/mnt/install"):
     """
     Copy over keys, create /home/user.
+
+    :param target: path to the root filesystem inside the native chroot
     """
     # Copy over keys
-    rootfs = args.work + "/chroot_native/mnt/install"
+    rootfs = args.work + "/chroot_native" + target
     for key in glob.glob(args.work + "/config_apk_keys/*.pub"):
         pmb.helpers.run.root(args, ["cp", key, rootfs + "/etc/apk/keys/"])
 
@@ -121,12 +125,14 @@ def set_user_password(args):
             pass
 
 
-def copy_ssh_key(args):
+def copy_ssh_key(args, target="/mnt/install"):
     """
     Offer to copy user's SSH public key to the device if it exists
+
+    :param target: path to the root filesystem inside the native chroot
     """
     user_ssh_pubkey = os.path.expanduser("~/.ssh/id_rsa.pub")
-    target = args.work + "/chroot_native/mnt/install/home/user/.ssh"
+    target = args.work + "/chroot_native" + target + "/home/user/.ssh"
     if os.path.exists(user_ssh_pubkey):
         if pmb.helpers.cli.confirm(args, "Would you like to copy your SSH public key to the device?"):
             pmb.helpers.run.root(args, ["mkdir", target])
@@ -156,37 +162,94 @@ def setup_keymap(args):
         logging.info("NOTE: No valid keymap specified for device")
 
 
-def install_system_image(args):
-    # Partition and fill image/sdcard
-    logging.info("*** (3/5) PREPARE INSTALL BLOCKDEVICE ***")
-    pmb.chroot.shutdown(args, True)
-    (size_image, size_boot) = get_subpartitions_size(args)
-    pmb.install.blockdevice.create(args, size_image)
-    pmb.install.partition(args, size_boot)
-    pmb.install.format(args)
+def create_system_image(args, size_image, size_boot, inodes):
+    """
+    Partition and format the system image (or sdcard), and copy all files.
+    """
+    image = pmb.install.image.supported(args)
+    if image:
+        # Without loop devices (pmb/install/image.py)
+        layout = pmb.install.image.layout(size_image, size_boot, inodes)
+        pmb.install.image.confirm_size(args, layout)
+        pmb.install.image.stage(args)
+        target = pmb.install.image.paths(args)["root"]
+    else:
+        pmb.helpers.userns.check_supported(args, "Creating the system image"
+                                           " with loop devices (full disk"
+                                           " encryption, --sdcard)")
+        pmb.install.blockdevice.create(args, size_image)
+        pmb.install.partition(args, size_boot)
+        pmb.install.format(args, inodes)
+        target = "/mnt/install"
 
     # Just copy all the files
     logging.info("*** (4/5) FILL INSTALL BLOCKDEVICE ***")
-    copy_files_from_chroot(args)
-    copy_files_other(args)
+    pmb.helpers.profile.step(args, "install", "(4/5) fill install"
+                             " blockdevice")
+    if not image:
+        copy_files_from_chroot(args)
+    copy_files_other(args, target)
 
     # If user has a ssh pubkey, offer to copy it to device
-    copy_ssh_key(args)
+    copy_ssh_key(args, target)
+    if image:
+        pmb.install.image.create(args, layout)
+
+
+def update_system_image(args):
+    """
+    Update the existing system image in place (install --incremental), see
+    pmb/install/incremental.py.
+
+    :returns: True when it was updated, False when it needs to be created
+              from scratch
+    """
+    # The files must fit into the existing filesystems, the margin is only
+    # for new images
+    reason = pmb.install.incremental.check(args)
+    if not reason:
+        sizes = pmb.install.size.subpartitions(args, margin=0)
+        reason = pmb.install.incremental.check_sizes(args, sizes)
+    if reason:
+        logging.info("NOTE: Creating a new system image, the existing one"
+                     " can not be updated: " + reason)
+        return False
+
+    logging.info("*** (4/5) UPDATE INSTALL BLOCKDEVICE ***")
+    pmb.helpers.profile.step(args, "install", "(4/5) update install"
+                             " blockdevice")
+    pmb.install.incremental.update(args, mount_device_rootfs(args))
+    copy_files_other(args)
+    return True
+
+
+def install_system_image(args):
+    # Partition and fill image/sdcard
+    logging.info("*** (3/5) PREPARE INSTALL BLOCKDEVICE ***")
+    pmb.helpers.profile.step(args, "install", "(3/5) prepare install"
+                             " blockdevice")
+    pmb.chroot.shutdown(args, True)
+    if not args.incremental or not update_system_image(args):
+        (size_image, size_boot, inodes) = get_subpartitions_size(args)
+        create_system_image(args, size_image, size_boot, inodes)
     pmb.chroot.shutdown(args, True)
 
-    # Convert system image to sparse using img2simg
+    # Convert system image to the Android sparse format (like img2simg). The
+    # image belongs to root, so write to $WORK and move it afterwards.
     if args.deviceinfo["flash_sparse"] == "true":
         logging.info("(native) make sparse system image")
-        pmb.chroot.apk.install(args, ["libsparse"])
-        sys_image = args.device + ".img"
-        sys_image_sparse = args.device + "-sparse.img"
-        pmb.chroot.user(args, ["img2simg", sys_image, sys_image_sparse],
-                        working_dir="/home/user/rootfs/")
-        pmb.chroot.user(args, ["mv", "-f", sys_image_sparse, sys_image],
-                        working_dir="/home/user/rootfs/")
+        sys_image = (args.work + "/chroot_native/home/user/rootfs/" +
+                     args.device + ".img")
+        sys_image_sparse = args.work + "/" + args.device + "-sparse.img"
+        stats = pmb.helpers.sparse.write(sys_image, sys_image_sparse)
+        logging.debug("Sparse image blocks: " + str(stats))
+        pmb.helpers.run.root(args, ["mv", "-f", sys_image_sparse, sys_image])
 
+
+def print_flash_info(args):
     # Kernel flash information
     logging.info("*** (5/5) FLASHING TO DEVICE ***")
+    pmb.helpers.profile.step(args, "install")
     logging.info("Run the following to flash your installation to the"
                  " target device:")
     logging.info("* pmbootstrap flasher flash_kernel")
@@ -218,12 +281,16 @@ def install_system_image(args):
 
 def install_recovery_zip(args):
     logging.info("*** (3/4) CREATING RECOVERY-FLASHABLE ZIP ***")
+    pmb.helpers.profile.step(args, "install", "(3/4) create recovery zip")
     suffix = "buildroot_" + args.deviceinfo["arch"]
     mount_device_rootfs(args, suffix)
     pmb.install.recovery.create_zip(args, suffix)
 
+
+def print_recovery_flash_info(args):
     # Flash information
     logging.info("*** (4/4) FLASHING TO DEVICE ***")
+    pmb.helpers.profile.step(args, "install")
     logging.info("Run the following to flash your installation to the"
                  " target device:")
     logging.info("* pmbootstrap flasher --method adb sideload")
@@ -235,43 +302,68 @@ def install_recovery_zip(args):
                  " export' and flash outside of pmbootstrap.")
 
 
-def install(args):
-    # Number of steps for the different installation methods.
-    steps = 4 if args.android_recovery_zip else 5
+def get_install_packages(args):
+    """
+    :returns: all packages, that get installed to the device rootfs
+              (including the ones specified by --add)
+    """
+    ret = pmb.config.install_device_packages + ["device-" + args.device]
+    if args.ui.lower() != "none":
+        ret += ["postmarketos-ui-" + args.ui]
+    if args.extra_packages.lower() != "none":
+        ret += args.extra_packages.split(",")
+    if args.add:
+        ret += args.add.split(",")
+    return ret
 
-    # Install required programs in native chroot
-    logging.info("*** (1/{}) PREPARE NATIVE CHROOT ***".format(steps))
-    pmb.chroot.apk.install(args, pmb.config.install_native_packages,
-                           build=False)
 
-    # List all packages to be installed (including the ones specified by --add)
-    # and upgrade the installed packages/apkindexes
-    logging.info('*** (2/{0}) CREATE DEVICE ROOTFS ("{1}") ***'.format(steps,
-                 args.device))
-    install_packages = (pmb.config.install_device_packages +
-                        ["device-" + args.device])
-    if args.ui.lower() != "none":
-        install_packages += ["postmarketos-ui-" + args.ui]
+def create_device_rootfs(args, install_packages, build=True):
+    """
+    Upgrade the installed packages/apkindexes, and install all packages to
+    the device rootfs chroot.
+
+    :param build: build the packages first, in case the version increased.
+                  False when they have been built already.
+    """
     suffix = "rootfs_" + args.device
-    pmb.chroot.apk.upgrade(args, suffix)
+    pmb.chroot.apk.upgrade(args, suffix, build=build)
 
     # Explicitly call build on the install packages, to re-build them or any
     # dependency, in case the version increased
-    if args.extra_packages.lower() != "none":
-        install_packages += args.extra_packages.split(",")
-    if args.add:
-        install_packages += args.add.split(",")
-    for pkgname in install_packages:
-        pmb.build.package(args, pkgname, args.deviceinfo["arch"])
+    if build:
+        for pkgname in install_packages:
+            pmb.build.package(args, pkgname, args.deviceinfo["arch"])
 
     # Install all packages to device rootfs chroot (and rebuild the initramfs,
     # because that doesn't always happen automatically yet, e.g. when the user
     # installed a hook without pmbootstrap - see #69 for more info)
-    pmb.chroot.apk.install(args, install_packages, suffix)
+    pmb.chroot.apk.install(args, install_packages, suffix, build=build)
     pmb.install.file.write_os_release(args, suffix)
     for flavor in pmb.chroot.other.kernel_flavors_installed(args, suffix):
         pmb.chroot.initfs.build(args, flavor, suffix)
 
+
+def install_device(args):
+    """
+    Create the system image (or recovery zip) from the device rootfs
+    chroot, after create_device_rootfs().
+    """
+    # Serve the same installation again, when nothing has changed
+    if pmb.install.cache.enabled(args):
+        manifest = pmb.install.cache.manifest(args)
+        key = pmb.install.cache.key(manifest)
+        if pmb.install.cache.restore(args, key):
+            if args.android_recovery_zip:
+                print_recovery_flash_info(args)
+            else:
+                print_flash_info(args)
+            return
+
+    # Detach the file from the image cache before modifying it (also when
+    # the cache has been disabled since it was stored)
+    if not args.sdcard:
+        pmb.install.cache.release(args)
+
     # Set the user password
     set_user_password(args)
 
@@ -282,3 +374,29 @@ def install(args):
         install_recovery_zip(args)
     else:
         install_system_image(args)
+    if pmb.install.cache.enabled(args):
+        pmb.install.cache.store(args, key, manifest)
+
+    if args.android_recovery_zip:
+        print_recovery_flash_info(args)
+    else:
+        print_flash_info(args)
+
+
+def install(args):
+    # Number of steps for the different installation methods.
+    steps = 4 if args.android_recovery_zip else 5
+
+    # Install required programs in native chroot
+    logging.info("*** (1/{}) PREPARE NATIVE CHROOT ***".format(steps))
+    pmb.helpers.profile.step(args, "install", "(1/{}) prepare native"
+                             " chroot".format(steps))
+    pmb.chroot.apk.install(args, pmb.config.install_native_packages,
+                           build=False)
+
+    logging.info('*** (2/{0}) CREATE DEVICE ROOTFS ("{1}") ***'.format(steps,
+                 args.device))
+    pmb.helpers.profile.step(args, "install", "(2/{}) create device"
+                             " rootfs".format(steps), device=args.device)
+    create_device_rootfs(args, get_install_packages(args))
+    install_device(args)
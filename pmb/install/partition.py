@@ -17,6 +17,7 @@ You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
 import logging
+import math
 import os
 import time
 import pmb.chroot
@@ -63,8 +64,8 @@ def partition(args, size_boot):
 
     size_boot: size of the boot partition in bytes.
     """
-    # Convert to MB and print info
-    mb_boot = str(round(size_boot / 1024 / 1024)) + "M"
+    # Convert to MiB and print info
+    mb_boot = str(math.ceil(size_boot / 1024 / 1024)) + "MiB"
     logging.info("(native) partition /dev/install (boot: " + mb_boot +
                  ", root: the rest)")
 
@@ -16,10 +16,124 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import json
 import logging
+import os
+import sys
+import tarfile
+import time
 
 import pmb.chroot
+import pmb.config
+import pmb.helpers.compress
 import pmb.helpers.frontend
+import pmb.helpers.profile
+import pmb.helpers.run
+import pmb.helpers.userns
+
+
+def exclude_home(tarinfo):
+    """
+    Filter for tarfile: leave out the files in /home/user, and store the
+    owners as numeric ids only (the user names on the host are different
+    from the ones in the rootfs).
+    """
+    if tarinfo.name.startswith("./home/user/"):
+        return None
+    tarinfo.uname = ""
+    tarinfo.gname = ""
+    return tarinfo
+
+
+def device(path):
+    """
+    :returns: id of the filesystem, that the path is on
+    """
+    return os.lstat(path).st_dev
+
+
+def one_file_system(rootfs):
+    """
+    Filter for tarfile, like "tar --one-file-system": mountpoints below the
+    rootfs (e.g. /proc and the apk cache, while the chroot is mounted) get
+    archived as empty folders, their content gets left out.
+
+    :param rootfs: folder, that gets archived as "."
+    """
+    root_device = device(rootfs)
+    parents = {}
+
+    def check(tarinfo):
+        parent = os.path.dirname(tarinfo.name)
+        if tarinfo.name != "." and parent not in parents:
+            parents[parent] = device(rootfs + "/" + parent) == root_device
+        if tarinfo.name != "." and not parents[parent]:
+            return None
+        return exclude_home(tarinfo)
+    return check
+
+
+def create_archive(rootfs, path, codec="gzip", level="6", threads="0"):
+    """
+    Create the rootfs archive (like "tar -czf path -C rootfs
+    --one-file-system ."), compressed with multiple threads (see
+    pmb/helpers/compress.py).
+
+    :param level: compression level (string or int)
+    :param threads: count of threads, 0 for one per CPU
+    :returns: see pmb.helpers.compress.stats()
+    """
+    start = time.time()
+    with open(path, "wb") as handle:
+        writer = pmb.helpers.compress.writer(handle, codec, int(level),
+                                             int(threads) or None)
+        with tarfile.open(fileobj=writer, mode="w|",
+                          format=tarfile.GNU_FORMAT) as tar:
+            tar.add(rootfs, ".", filter=one_file_system(rootfs))
+        writer.close()
+    return pmb.helpers.compress.stats(writer, start)
+
+
+def archive(args, path, suffix):
+    """
+    Run create_archive() for the device rootfs on the host as root, instead
+    of running tar and gzip inside the buildroot chroot (which needs
+    emulation for foreign arches).
+
+    :param path: of the archive on the host
+    :param suffix: of the chroot, that has the device rootfs mounted in
+                   /mnt (see pmb.install.install.mount_device_rootfs()). The
+                   rootfs chroot itself may still have /proc, the apk cache
+                   etc. mounted.
+    """
+    rootfs = (args.work + "/chroot_" + suffix + "/mnt/rootfs_" +
+              args.device)
+    codec = args.recovery_compression
+    level = str(args.recovery_compression_level)
+    logging.info("(native) create rootfs.tar.gz (" + codec + ", level " +
+                 level + ")")
+    start = time.time()
+    if args.backend == "userns":
+        pmb.helpers.userns.enter(args)
+    if args.backend == "userns" or os.geteuid() == 0:
+        stats = create_archive(rootfs, path, codec, level, args.jobs)
+    else:
+        code = ("import json, sys, pmb.install.recovery;"
+                " print(json.dumps(pmb.install.recovery.create_archive("
+                "*sys.argv[1:])))")
+        output = pmb.helpers.run.root(args, [sys.executable, "-c", code,
+                                             rootfs, path, codec, level,
+                                             str(args.jobs)],
+                                      working_dir=pmb.config.pmb_src,
+                                      return_stdout=True)
+        stats = json.loads(output)
+    pmb.helpers.profile.record(args, "compress rootfs.tar.gz", "span", start,
+                               time.time(), dict(stats, codec=codec,
+                                                 level=level))
+    logging.info("Compressed " + str(round(stats["bytes"] / 1024 / 1024)) +
+                 " MiB to " + str(round(stats["compressed"] / 1024 / 1024)) +
+                 " MiB in " + str(stats["seconds"]) + "s (" +
+                 str(stats["mib_per_second"]) + " MiB/s)")
 
 
 def create_zip(args, suffix):
@@ -54,10 +168,12 @@ def create_zip(args, suffix):
         # Move config file from /tmp/ to zip root
         ["mv", "/tmp/install_options", "install_options"],
         # Copy boot.img to zip root
-        ["cp", rootfs + "/boot/boot.img-" + flavor, "boot.img"],
-        # Create tar archive of the rootfs
-        ["tar", "-pczf", "rootfs.tar.gz", "--exclude", "./home/user/*",
-         "-C", rootfs, "."],
-        ["build-recovery-zip"]]
+        ["cp", rootfs + "/boot/boot.img-" + flavor, "boot.img"]]
     for command in commands:
         pmb.chroot.root(args, command, suffix, working_dir=zip_root)
+
+    # Create tar archive of the rootfs
+    archive(args, args.work + "/chroot_" + suffix + zip_root +
+            "rootfs.tar.gz", suffix)
+    pmb.chroot.root(args, ["build-recovery-zip"], suffix,
+                    working_dir=zip_root)
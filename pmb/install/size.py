@@ -0,0 +1,249 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import logging
+import math
+import os
+import stat
+import sys
+
+import pmb.config
+import pmb.helpers.run
+import pmb.helpers.userns
+
+# Calculate the size of the boot and root filesystems of the system image
+# from the files in the rootfs chroot: walk it once, and add what ext2/ext4
+# needs on top (inode tables, bitmaps, superblock backups, journal).
+
+block_size = 4096
+inode_size = 256
+blocks_per_group = 8 * block_size
+reserved_inodes = 11  # inodes 1 to 10 are reserved, 11 is lost+found
+lost_found_blocks = 4
+
+
+def file_blocks(size, fstype):
+    """
+    :param size: of a regular file in bytes
+    :returns: blocks needed for the file content, including indirect blocks
+              for ext2 (ext4 keeps the extents in the inode)
+    """
+    blocks = -(-size // block_size)
+    if fstype != "ext2" or blocks <= 12:
+        return blocks
+    pointers = block_size // 4
+    indirect = -(-(blocks - 12) // pointers)
+    if blocks > 12 + pointers:
+        indirect += 1  # double indirect block
+    return blocks + indirect
+
+
+def walk(path, fstypes=["ext2", "ext4"]):
+    """
+    Walk a folder once and sum up, what every folder needs directly (without
+    its subfolders). Hardlinked files get counted once.
+
+    :param fstypes: filesystems to calculate the blocks for
+    :returns: {relative folder path: {"bytes": apparent size,
+                                      "inodes": count,
+                                      "blocks_ext2": count, ...}}
+    """
+    ret = {}
+    seen = set()
+    stack = [""]
+    while stack:
+        relpath = stack.pop()
+        entry_stats = {"bytes": 0, "inodes": 1}
+        for fstype in fstypes:
+            entry_stats["blocks_" + fstype] = 0
+        # Directory entries: "." and "..", then 8 bytes + the name (padded)
+        dirents = 24
+        for entry in os.scandir(path + "/" + relpath if relpath else path):
+            dirents += 8 + -(-len(entry.name.encode()) // 4) * 4
+            st = entry.stat(follow_symlinks=False)
+            if stat.S_ISDIR(st.st_mode):
+                stack.append(relpath + "/" + entry.name if relpath else
+                             entry.name)
+                continue
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+            entry_stats["inodes"] += 1
+            entry_stats["bytes"] += st.st_size
+            for fstype in fstypes:
+                if stat.S_ISREG(st.st_mode):
+                    blocks = file_blocks(st.st_size, fstype)
+                elif stat.S_ISLNK(st.st_mode) and st.st_size >= 60:
+                    blocks = 1  # fast symlinks fit into the inode
+                else:
+                    blocks = 0
+                entry_stats["blocks_" + fstype] += blocks
+        for fstype in fstypes:
+            entry_stats["blocks_" + fstype] += -(-dirents // block_size)
+        ret[relpath] = entry_stats
+    return ret
+
+
+def total(folders, prefix="", exclude=[]):
+    """
+    :param folders: from walk()
+    :param prefix: only count this folder and its subfolders, e.g. "boot"
+    :param exclude: leave out the content of these folders, e.g. ["home"]
+    :returns: sum of the values in folders, e.g. {"bytes": 123, ...}
+    """
+    ret = {}
+    for relpath, entry_stats in folders.items():
+        if prefix and not (relpath == prefix or
+                           relpath.startswith(prefix + "/")):
+            continue
+        if any(relpath.startswith(folder + "/") for folder in exclude):
+            continue
+        if relpath in exclude:
+            # Only the empty folder itself
+            entry_stats = {key: (0 if key == "bytes" else 1)
+                           for key in entry_stats}
+        for key, value in entry_stats.items():
+            ret[key] = ret.get(key, 0) + value
+    return ret
+
+
+def journal_blocks(blocks):
+    """
+    :returns: default journal size of mke2fs (e2fsprogs 1.43) in blocks
+    """
+    for limit, journal in [(32768, 1024), (256 * 1024, 4096),
+                           (512 * 1024, 8192), (4096 * 1024, 16384),
+                           (8192 * 1024, 32768), (16384 * 1024, 65536),
+                           (32768 * 1024, 131072)]:
+        if blocks < limit:
+            return journal
+    return 262144
+
+
+def backup_groups(groups):
+    """
+    :returns: count of block groups with a superblock backup (sparse_super:
+              0, 1 and powers of 3, 5 and 7)
+    """
+    ret = set([0, 1])
+    for base in [3, 5, 7]:
+        power = base
+        while power < groups:
+            ret.add(power)
+            power *= base
+    return len([group for group in ret if group < groups])
+
+
+def filesystem(entry_stats, fstype, margin=0, reserved=0.05):
+    """
+    Calculate the size of an ext2/ext4 filesystem for files.
+
+    :param entry_stats: from total()
+    :param margin: free space (and inodes) to add, in percent
+    :param reserved: part of the filesystem, that is reserved for root
+                     (mke2fs -m)
+    :returns: {"size": bytes, "inodes": count} for mke2fs -b 4096 -N
+    """
+    factor = 1 + margin / 100
+    inodes = math.ceil((entry_stats["inodes"] + reserved_inodes) * factor)
+    content = math.ceil(entry_stats["blocks_" + fstype] * factor)
+    content += lost_found_blocks
+
+    # The overhead depends on the size, so calculate it until it fits
+    blocks = content
+    while True:
+        groups = -(-blocks // blocks_per_group)
+        inodes_per_group = -(-inodes // groups)
+        inode_table = -(-inodes_per_group * inode_size // block_size)
+        descriptors = -(-groups * 64 // block_size)
+        # Reserved descriptor blocks, so the filesystem can grow 1024 times
+        reserved_descriptors = min(-(-groups * 1024 * 64 // block_size),
+                                   block_size // 4)
+        overhead = groups * (2 + inode_table)
+        overhead += backup_groups(groups) * (1 + descriptors +
+                                             reserved_descriptors)
+        if fstype == "ext4":
+            overhead += journal_blocks(blocks)
+        needed = math.ceil((content + overhead) / (1 - reserved))
+        if needed <= blocks:
+            break
+        blocks = needed
+    return {"size": blocks * block_size, "inodes": groups * inodes_per_group}
+
+
+def top(folders, count=10):
+    """
+    :param folders: from walk()
+    :returns: [(relative folder path, bytes), ...] of the folders with the
+              biggest files in them (without their subfolders)
+    """
+    ret = [(relpath, entry_stats["bytes"]) for relpath, entry_stats in
+           folders.items()]
+    return sorted(ret, key=lambda item: -item[1])[:count]
+
+
+def scan(args, path):
+    """
+    Run walk() as root, because some folders in the chroots are only
+    readable for root (e.g. /root). With the userns backend, pmbootstrap has
+    root privileges in the chroots already.
+
+    :returns: see walk()
+    """
+    if args.backend == "userns":
+        pmb.helpers.userns.enter(args)
+    if args.backend == "userns" or os.geteuid() == 0:
+        return walk(path)
+    code = ("import json, sys, pmb.install.size;"
+            " print(json.dumps(pmb.install.size.walk(sys.argv[1])))")
+    output = pmb.helpers.run.root(args, [sys.executable, "-c", code, path],
+                                  working_dir=pmb.config.pmb_src,
+                                  return_stdout=True)
+    return json.loads(output)
+
+
+def subpartitions(args, margin=None):
+    """
+    Calculate the sizes of the boot and root filesystems of the system
+    image, and log the folders, that need the most space.
+
+    :param margin: free space in percent, default: args.image_size_margin
+    :returns: {"boot": {"size": bytes, "inodes": count},
+               "root": {"size": bytes, "inodes": count}}
+    """
+    chroot = args.work + "/chroot_rootfs_" + args.device
+    folders = scan(args, chroot)
+    if margin is None:
+        margin = float(args.image_size_margin)
+    boot = filesystem(total(folders, "boot"), "ext2", margin)
+    root = filesystem(total(folders, exclude=["boot", "home"]), "ext4", margin)
+
+    # Room for kernel upgrades, the LUKS header (up to 16 MiB with LUKS2) and
+    # whole MiB for the partition table
+    boot["size"] += pmb.config.install_boot_free
+    if args.full_disk_encryption:
+        root["size"] += 16 * 1024 * 1024
+    for fs in [boot, root]:
+        fs["size"] = -(-fs["size"] // (1024 * 1024)) * 1024 * 1024
+
+    logging.info("Biggest folders in the rootfs: " + ", ".join(
+        "/" + relpath + " (" + str(round(size / 1024 / 1024, 1)) + " MiB)"
+        for relpath, size in top(folders, 5)))
+    return {"boot": boot, "root": root}
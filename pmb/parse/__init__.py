@@ -16,9 +16,8 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
-from pmb.parse.arguments import arguments
+from pmb.parse.arguments import arguments, arguments_parser
 from pmb.parse.apkbuild import apkbuild
 from pmb.parse.binfmt_info import binfmt_info
 from pmb.parse.deviceinfo import deviceinfo
-from pmb.parse.kconfig import check
 import pmb.parse.arch
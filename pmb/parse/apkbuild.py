@@ -91,10 +91,12 @@ def apkbuild(args, path):
     :returns: Relevant variables from the APKBUILD. Arrays get returned as
         arrays.
     """
-    # Try to get a cached result first (we assume, that the aports don't change
-    # in one pmbootstrap call)
-    if path in args.cache["apkbuild"]:
-        return args.cache["apkbuild"][path]
+    # Try to get a cached result first (pmbootstrap daemon keeps the cache
+    # between commands, so check if the file has been modified)
+    lastmod = os.path.getmtime(path)
+    ret = args.cache.apkbuild.get(path, lastmod)
+    if ret is not None:
+        return ret
 
     with open(path, encoding="utf-8") as handle:
         lines = handle.readlines()
@@ -154,5 +156,6 @@ def apkbuild(args, path):
                            " the folder, that contains the APKBUILD!")
 
     # Fill cache
-    args.cache["apkbuild"][path] = ret
+    args.cache.apkbuild.set(path, ret, sum(len(line) for line in lines),
+                            lastmod)
     return ret
@@ -38,6 +38,9 @@ def parse_next_block(args, path, lines, start):
                 "version": "0.0.4-r10",
                 "depends": ["busybox-extras", "lddtree", ... ],
                 "provides": ["mkinitfs=0.0.1"],
+                "arch": "noarch", (optional)
+                "checksum": "Q1...", (optional)
+                "size": "12345", (optional)
               }
     :returns: None, when there are no more blocks
     """
@@ -45,7 +48,10 @@ def parse_next_block(args, path, lines, start):
     # Parse until we hit an empty line or end of file
     ret = {}
     mapping = {
+        "A": "arch",
+        "C": "checksum",
         "P": "pkgname",
+        "S": "size",
         "V": "version",
         "D": "depends",
         "p": "provides",
@@ -164,10 +170,9 @@ def parse(args, path, strict=False):
 
     # Try to get a cached result first
     lastmod = os.path.getmtime(path)
-    if path in args.cache["apkindex"]:
-        cache = args.cache["apkindex"][path]
-        if cache["lastmod"] == lastmod:
-            return cache["ret"]
+    ret = args.cache.apkindex.get(path, lastmod)
+    if ret is not None:
+        return ret
 
     # Read all lines
     if tarfile.is_tarfile(path):
@@ -193,18 +198,19 @@ def parse(args, path, strict=False):
                 parse_add_block(path, strict, ret, block, alias)
 
     # Update the cache
-    args.cache["apkindex"][path] = {"lastmod": lastmod, "ret": ret}
+    size = sum(len(line) for line in lines)
+    args.cache.apkindex.set(path, ret, size, lastmod)
 
     return ret
 
 
 def clear_cache(args, path):
     logging.verbose("Clear APKINDEX cache for: " + path)
-    if path in args.cache["apkindex"]:
-        del args.cache["apkindex"][path]
+    if path in args.cache.apkindex:
+        del args.cache.apkindex[path]
     else:
         logging.verbose("Nothing to do, path was not in cache:" +
-                        str(args.cache["apkindex"].keys()))
+                        str(args.cache.apkindex.keys()))
 
 
 def read(args, package, path, must_exist=True):
@@ -19,6 +19,7 @@ along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 import argparse
 import pmb.config
 import pmb.parse.arch
+import pmb.session
 
 
 def arguments_export(subparser):
@@ -54,6 +55,15 @@ def arguments_flasher(subparser):
     flash_system = sub.add_parser("flash_system", help="flash the system partition")
     flash_system.add_argument("--partition", default=None, help="partition to flash"
                               " the system image")
+    flash_system.add_argument("--delta", action="store_true",
+                              help="only flash the parts of the system image,"
+                                   " that changed since it was flashed to"
+                                   " this device the last time (fastboot)."
+                                   " Only valid, when the device has not"
+                                   " booted since then!")
+    flash_system.add_argument("--serial", default=None,
+                              help="serial number of the device, for the"
+                                   " delta (default: detect it)")
 
     # Actions without extra arguments
     sub.add_parser("sideload", help="sideload recovery zip")
@@ -99,7 +109,33 @@ def arguments_initfs(subparser):
     return ret
 
 
-def arguments():
+class Namespace(argparse.Namespace):
+    """
+    Parsed arguments, that read the deviceinfo on first access of
+    args.deviceinfo. Most actions never use it, and parsing it for every
+    command would slow down the startup.
+    """
+
+    def __getattr__(self, name):
+        if name != "deviceinfo" or self.__dict__.get("action") == "init":
+            raise AttributeError(name)
+
+        # Add and verify the deviceinfo (only after initialization)
+        deviceinfo = pmb.parse.deviceinfo(self)
+        arch = deviceinfo["arch"]
+        if (arch != self.arch_native and
+                arch not in pmb.config.build_device_architectures):
+            raise ValueError("Arch '" + arch + "' is not officially enabled"
+                             " in postmarketOS yet. However, this should be straight"
+                             " forward. Simply enable it in pmb/config/__init__.py"
+                             " in build_device_architectures, zap your package cache"
+                             " (otherwise you will have issues with noarch packages)"
+                             " and try again.")
+        setattr(self, "deviceinfo", deviceinfo)
+        return deviceinfo
+
+
+def arguments_parser():
     parser = argparse.ArgumentParser(prog="pmbootstrap")
 
     # Other
@@ -110,6 +146,11 @@ def arguments():
 
     parser.add_argument("-a", "--alpine-version", dest="alpine_version",
                         help="examples: edge, latest-stable, v3.5")
+    parser.add_argument("--backend", choices=pmb.config.backends,
+                        help="how to get root privileges: 'sudo' for each"
+                             " command, or 'userns' to enter an unprivileged"
+                             " user namespace once (zap all chroots when"
+                             " switching)")
     parser.add_argument("-c", "--config", dest="config",
                         default=pmb.config.defaults["config"])
     parser.add_argument("-d", "--port-distccd", dest="port_distccd")
@@ -123,6 +164,12 @@ def arguments():
                         action="store_true")
     parser.add_argument("-w", "--work", help="folder where all data"
                         " gets stored (chroots, caches, built packages)")
+    parser.add_argument("--no-daemon", action="store_false", dest="daemon",
+                        help="run the command in this process, even when"
+                             " 'pmbootstrap daemon' is running")
+    parser.add_argument("--offline", action="store_true",
+                        help="do not refresh the APKINDEX files and do not"
+                             " download anything, only use the caches")
     parser.add_argument("-y", "--assume-yes", help="Assume 'yes' to all"
                         " question prompts. WARNING: this option will"
                         " cause normal 'are you sure?' prompts to be"
@@ -139,6 +186,11 @@ def arguments():
     parser.add_argument("-v", "--verbose", dest="verbose",
                         action="store_true", help="write even more to the"
                         " logfiles (this may reduce performance)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="record the duration of all commands and steps,"
+                             " and write them as Chrome trace-event JSON to"
+                             " FILE (open with ui.perfetto.dev or"
+                             " chrome://tracing)")
     parser.add_argument("-q", "--quiet", dest="quiet",
                         action="store_true", help="do not output any log messages")
 
@@ -152,6 +204,14 @@ def arguments():
     arguments_flasher(sub)
     arguments_initfs(sub)
 
+    # Action: daemon
+    daemon = sub.add_parser("daemon", help="keep caches and chroots ready"
+                            " in the background, other pmbootstrap commands"
+                            " get executed by the daemon while it is"
+                            " running")
+    daemon.add_argument("--stop", action="store_true",
+                        help="stop the running daemon")
+
     # Action: log
     log = sub.add_parser("log", help="follow the pmbootstrap logfile")
     log_distccd = sub.add_parser(
@@ -175,9 +235,30 @@ def arguments():
     zap.add_argument("-d", "--distfiles", action="store_true", help="also delete"
                      " downloaded files cache")
 
+    # Action: cache
+    cache = sub.add_parser("cache", help="show the size of the caches in the"
+                           " work folder, shrink them to the configured"
+                           " size limits ('cache_budget*' config options)"
+                           " or deduplicate them")
+    cache_sub = cache.add_subparsers(dest="action_cache")
+    cache_sub.add_parser("status", help="show size, count of entries and last"
+                         " access time of each cache")
+    prune = cache_sub.add_parser("prune", help="remove the least recently"
+                                 " used entries, until all caches fit into"
+                                 " their size limits")
+    prune.add_argument("--dry-run", action="store_true",
+                       help="only show what would be removed")
+    cache_sub.add_parser("dedupe", help="store identical packages (noarch)"
+                         " of all apk caches only once, in the blob store")
+
     # Action: stats
     stats = sub.add_parser("stats", help="show ccache stats")
     stats.add_argument("--arch")
+    stats.add_argument("--caches", action="store_true",
+                       help="show the in-memory caches of parsed files"
+                            " instead (hits, misses, evictions), which are"
+                            " kept between commands by 'pmbootstrap"
+                            " daemon'")
 
     # Action: build_init / chroot
     build_init = sub.add_parser("build_init", help="initialize build"
@@ -206,6 +287,28 @@ def arguments():
     install.add_argument("--iter-time", help="cryptsetup iteration time (in"
                          " miliseconds) to use when encrypting the system"
                          " partiton")
+    install.add_argument("--image-size-margin", dest="image_size_margin",
+                         help="free space to add to the filesystems of the"
+                              " system image, in percent of what the files"
+                              " need (default: from the config file)")
+    install.add_argument("--image-cache-count", dest="image_cache_count",
+                         help="count of created system images, that get"
+                              " kept to serve the same installation again."
+                              " A cached installation has the passwords, that"
+                              " were set when it was created! (0 to disable,"
+                              " default: from the config file)")
+    install.add_argument("--incremental", action="store_true",
+                         help="update the existing system image in place"
+                              " (only copy the files, that changed), instead"
+                              " of creating a new one. Falls back to a new"
+                              " image, when the files do not fit anymore.")
+    devices = install.add_mutually_exclusive_group()
+    devices.add_argument("--devices", help="comma separated list of devices"
+                         " to install in one run (instead of the device from"
+                         " the config file), the packages get built only"
+                         " once")
+    devices.add_argument("--all-devices", action="store_true",
+                         help="install all devices in the aports folder")
     install.add_argument("--add", help="comma separated list of packages to be"
                          " added to the rootfs (e.g. 'vim,gcc')")
     install.add_argument("--no-fde", help="do not use full disk encryption",
@@ -223,6 +326,15 @@ def arguments():
                          help="partition to flash from recovery,"
                               " eg. external_sd",
                          dest="recovery_install_partition")
+    install.add_argument("--recovery-compression",
+                         dest="recovery_compression",
+                         choices=["gzip", "none"],
+                         help="compression of the rootfs archive in the"
+                              " recovery zip (default: from the config file)")
+    install.add_argument("--recovery-compression-level",
+                         dest="recovery_compression_level",
+                         help="compression level from 1 (fast) to 9 (small)"
+                              " (default: from the config file)")
 
     # Action: menuconfig / parse_apkbuild
     menuconfig = sub.add_parser("menuconfig", help="run menuconfig on"
@@ -240,8 +352,10 @@ def arguments():
     build.add_argument("--arch")
     build.add_argument("--force", action="store_true")
     build.add_argument("--buildinfo", action="store_true")
-    build.add_argument("--strict", action="store_true", help="(slower) zap and install only"
-                       " required depends when building, to detect dependency errors")
+    build.add_argument("--strict", action="store_true", help="(slower) install only"
+                       " required depends when building, to detect dependency errors."
+                       " The build runs in a temporary overlay on top of clean"
+                       " chroots, which gets discarded afterwards")
     build.add_argument("--noarch-arch", dest="noarch_arch", default=None,
                        help="which architecture to use to build 'noarch'"
                             " packages. Defaults to the native arch normally,"
@@ -294,9 +408,24 @@ def arguments():
                       help="guest RAM (default: 1024)")
     qemu.add_argument("-p", "--port", type=int, default=2222,
                       help="ssh port (default: 2222)")
+    return parser
+
+
+def arguments(argv=None, options={}):
+    """
+    Parse the command line arguments, and fill in the values from the config
+    file.
+
+    :param argv: list of arguments, default: sys.argv[1:]
+    :param options: override the defaults of the arguments (pmb.Session)
+    """
+    args = arguments_parser().parse_args(argv, namespace=Namespace())
+    for key, value in options.items():
+        if key not in args:
+            raise ValueError("Invalid option: " + key)
+        setattr(args, key, value)
 
     # Use defaults from the user's config file
-    args = parser.parse_args()
     cfg = pmb.config.load(args)
     for varname in cfg["pmbootstrap"]:
         if varname not in args or not getattr(args, varname):
@@ -313,28 +442,15 @@ def arguments():
         if isinstance(old, str):
             setattr(args, varname, old.replace("$WORK", args.work))
 
+    # Verify the backend (may come from the config file)
+    if args.backend not in pmb.config.backends:
+        raise ValueError("Invalid backend '" + args.backend + "', expected"
+                         " one of: " + ", ".join(pmb.config.backends))
+
     # Add convenience shortcuts
     setattr(args, "arch_native", pmb.parse.arch.alpine_native())
 
-    # Add a caching dict (caches parsing of files etc. for the current session)
-    setattr(args, "cache", {"apkindex": {},
-                            "apkbuild": {},
-                            "apk_min_version_checked": [],
-                            "apk_repository_list_updated": [],
-                            "aports_files_out_of_sync_with_git": None,
-                            "find_aport": {}})
-
-    # Add and verify the deviceinfo (only after initialization)
-    if args.action != "init":
-        setattr(args, "deviceinfo", pmb.parse.deviceinfo(args))
-        arch = args.deviceinfo["arch"]
-        if (arch != args.arch_native and
-                arch not in pmb.config.build_device_architectures):
-            raise ValueError("Arch '" + arch + "' is not officially enabled"
-                             " in postmarketOS yet. However, this should be straight"
-                             " forward. Simply enable it in pmb/config/__init__.py"
-                             " in build_device_architectures, zap your package cache"
-                             " (otherwise you will have issues with noarch packages)"
-                             " and try again.")
+    # Add the caches of the session (parsed files etc.)
+    setattr(args, "cache", pmb.session.Caches())
 
     return args
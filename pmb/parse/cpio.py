@@ -0,0 +1,231 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import gzip
+import os
+import stat
+
+# Reader for cpio archives in the "newc" format (as created by
+# "cpio -H newc", which mkinitfs uses for the initramfs), see
+# <https://www.kernel.org/doc/Documentation/early-userspace/buffer-format.txt>
+magic = [b"070701", b"070702"]  # without and with checksums
+header_size = 110
+header_fields = ["ino", "mode", "uid", "gid", "nlink", "mtime", "size",
+                 "devmajor", "devminor", "rdevmajor", "rdevminor",
+                 "namesize", "check"]
+trailer = "TRAILER!!!"
+
+
+def open_archive(path):
+    """
+    :returns: file object with the uncompressed archive (gzip compressed
+              archives get decompressed while reading)
+    """
+    with open(path, "rb") as handle:
+        compressed = handle.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def read_exact(handle, size):
+    data = handle.read(size)
+    if len(data) != size:
+        raise RuntimeError("Unexpected end of the cpio archive")
+    return data
+
+
+def skip(handle, size):
+    """
+    Skip data without keeping it in memory (also works for gzip streams).
+    """
+    while size:
+        size -= len(read_exact(handle, min(size, 1024 * 1024)))
+
+
+def parse_header(header):
+    """
+    :returns: {"ino": ..., "mode": ..., "size": ..., ...} (see
+              header_fields)
+    """
+    if header[:6] not in magic:
+        raise RuntimeError("Invalid cpio header (only the newc format is"
+                           " supported)")
+    ret = {}
+    for i, field in enumerate(header_fields):
+        ret[field] = int(header[6 + i * 8:14 + i * 8], 16)
+    return ret
+
+
+def next_header(handle):
+    """
+    Read the next header. Archives can be concatenated, with zeros in
+    between (padding after the trailer).
+
+    :returns: the header bytes, or None at the end of the file
+    """
+    data = handle.read(4)
+    while data == b"\0\0\0\0":
+        data = handle.read(4)
+    if not data:
+        return None
+    return data + read_exact(handle, header_size - len(data))
+
+
+def entries(handle, data=True):
+    """
+    Read the entries of a cpio archive one after another.
+
+    :param handle: from open_archive()
+    :param data: read the content of the entries (otherwise it gets
+                 skipped)
+    :returns: generator of (entry, content): entry is the parsed header with
+              the "name" added, content is the file content (or symlink
+              target) as bytes, or None when data is False
+    """
+    while True:
+        header = next_header(handle)
+        if header is None:
+            return
+        entry = parse_header(header)
+        name = read_exact(handle, entry["namesize"])
+        entry["name"] = name.rstrip(b"\0").decode("utf-8", "replace")
+        skip(handle, -(header_size + entry["namesize"]) % 4)
+        if entry["name"] == trailer:
+            continue
+
+        # Symlink targets get read, so they can be listed
+        content = None
+        if data or stat.S_ISLNK(entry["mode"]):
+            content = read_exact(handle, entry["size"])
+        else:
+            skip(handle, entry["size"])
+        skip(handle, -entry["size"] % 4)
+        yield (entry, content)
+
+
+def safe_path(folder, name):
+    """
+    :param folder: extraction folder (absolute, without symlinks)
+    :param name: of the entry, e.g. "./bin/busybox"
+    :returns: path inside folder, or None when it would end up outside of
+              it (".." or symlinks in the path)
+    """
+    parts = [part for part in name.split("/") if part not in ["", "."]]
+    if ".." in parts:
+        return None
+    if not parts:
+        return folder
+    path = folder + "/" + "/".join(parts)
+    parent = os.path.realpath(os.path.dirname(path))
+    if parent != folder and not parent.startswith(folder + "/"):
+        return None
+    return path
+
+
+def extract_entry(folder, entry, content, links):
+    """
+    Create one entry in the extraction folder.
+
+    :param links: {(devmajor, devminor, ino): path} of hardlinked files,
+                  that have been extracted already
+    :returns: True when it was extracted, False when it was skipped
+    """
+    path = safe_path(folder, entry["name"])
+    if not path:
+        return False
+    mode = entry["mode"]
+    if path != folder and (os.path.islink(path) or (
+            os.path.exists(path) and not
+            (stat.S_ISDIR(mode) and os.path.isdir(path)))):
+        os.unlink(path)
+
+    if stat.S_ISDIR(mode):
+        # The mode gets set after extracting the content (see extract())
+        os.makedirs(path, exist_ok=True)
+        return True
+    elif stat.S_ISLNK(mode):
+        os.symlink(content.decode("utf-8", "replace"), path)
+        return True
+    elif stat.S_ISREG(mode):
+        key = (entry["devmajor"], entry["devminor"], entry["ino"])
+        if entry["nlink"] > 1 and key in links:
+            # Hardlink: the content is only stored with one of the names
+            if content:
+                os.chmod(links[key], stat.S_IMODE(mode) | stat.S_IWUSR)
+                with open(links[key], "wb") as handle:
+                    handle.write(content)
+                os.chmod(links[key], stat.S_IMODE(mode))
+            os.link(links[key], path)
+            return True
+        with open(path, "wb") as handle:
+            handle.write(content)
+        if entry["nlink"] > 1:
+            links[key] = path
+    else:
+        # Device nodes, fifos and sockets need root privileges
+        return False
+    os.chmod(path, stat.S_IMODE(mode))
+    return True
+
+
+def extract(path, folder):
+    """
+    Extract a (gzip compressed) cpio archive in one pass. Owners, device
+    nodes, fifos and sockets do not get extracted, so this works without
+    root privileges.
+
+    :returns: list of the names, that were skipped
+    """
+    folder = os.path.realpath(folder)
+    os.makedirs(folder, exist_ok=True)
+    skipped = []
+    links = {}
+    directories = []
+    with open_archive(path) as handle:
+        for entry, content in entries(handle):
+            if not extract_entry(folder, entry, content, links):
+                skipped.append(entry["name"])
+            elif stat.S_ISDIR(entry["mode"]):
+                directories.append(entry)
+
+    # Modes and modification times of folders, after extracting their files
+    # (they may not be writable, and extracting the files changed the time).
+    # Subfolders first, so the parents are still accessible.
+    for entry in reversed(directories):
+        dir_path = safe_path(folder, entry["name"])
+        os.chmod(dir_path, stat.S_IMODE(entry["mode"]))
+        os.utime(dir_path, (entry["mtime"], entry["mtime"]))
+    return skipped
+
+
+def ls(path):
+    """
+    List the content of a (gzip compressed) cpio archive without extracting
+    it.
+
+    :returns: list of lines like "ls -l" prints them
+    """
+    ret = []
+    with open_archive(path) as handle:
+        for entry, content in entries(handle, False):
+            line = (stat.filemode(entry["mode"]) + " " +
+                    (str(entry["uid"]) + "/" + str(entry["gid"])).ljust(9) +
+                    str(entry["size"]).rjust(10) + " " + entry["name"])
+            if content is not None:
+                line += " -> " + content.decode("utf-8", "replace")
+            ret.append(line)
+    return ret
@@ -0,0 +1,401 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import collections
+import copy
+import logging
+import os
+import sys
+import threading
+import time
+
+import pmb.config
+import pmb.helpers.logging
+
+
+def chroot_id(work, suffix):
+    """
+    :returns: inode and ctime of the chroot folder, which change when the
+              chroot gets zapped and created again (None if it does not
+              exist)
+    """
+    try:
+        stat = os.stat(work + "/chroot_" + suffix)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_ctime_ns)
+
+
+def format_stats(stats):
+    """
+    :param stats: from LRUCache.stats()
+    :returns: e.g. "3/32 entries, 1.2/64.0 MiB, 10 hits, 3 misses,
+              0 evictions"
+    """
+    def mib(size):
+        return str(round(size / 1024 / 1024, 1))
+
+    return (str(stats["entries"]) + "/" + str(stats["max_entries"] or "-") +
+            " entries, " + mib(stats["bytes"]) + "/" +
+            (mib(stats["max_bytes"]) if stats["max_bytes"] else "-") +
+            " MiB, " + str(stats["hits"]) + " hits, " +
+            str(stats["misses"]) + " misses, " + str(stats["evictions"]) +
+            " evictions")
+
+
+class LRUCache(object):
+    """
+    Keep up to max_entries values with a total size of max_bytes in memory,
+    drop the least recently used ones when the limits are exceeded. Can be
+    used from multiple threads (see pmb/install/batch.py).
+    """
+
+    def __init__(self, max_entries=0, max_bytes=0):
+        """
+        :param max_entries: maximum count of entries, 0 means no limit
+        :param max_bytes: maximum total size of the entries, 0 means no limit
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get(self, key, lastmod=None):
+        """
+        :param lastmod: modification time of the file, that the value was
+                        parsed from: entries with a different time are
+                        outdated, they get dropped
+        :returns: the cached value, or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["lastmod"] != lastmod:
+                del self[key]
+                entry = None
+            if not entry:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry["value"]
+
+    def set(self, key, value, size=0, lastmod=None):
+        """
+        :param size: of the value in bytes (approximately), e.g. the size of
+                     the file, that was parsed
+        """
+        with self.lock:
+            if key in self.entries:
+                del self[key]
+            self.entries[key] = {"value": value, "size": size,
+                                 "lastmod": lastmod}
+            self.bytes += size
+            while len(self.entries) > 1 and (
+                    (self.max_entries and
+                     len(self.entries) > self.max_entries) or
+                    (self.max_bytes and self.bytes > self.max_bytes)):
+                del self[next(iter(self.entries))]
+                self.evictions += 1
+
+    def __getitem__(self, key):
+        return self.entries[key]["value"]
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.bytes -= self.entries.pop(key)["size"]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries),
+                    "max_entries": self.max_entries,
+                    "bytes": self.bytes,
+                    "max_bytes": self.max_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+class Caches(object):
+    """
+    Everything, that pmbootstrap caches in memory for a session (args.cache).
+    """
+
+    def __init__(self):
+        # Parsed files: path => parsed content
+        self.apkindex = LRUCache(*pmb.config.session_cache_limits["apkindex"])
+        self.apkbuild = LRUCache(*pmb.config.session_cache_limits["apkbuild"])
+
+        # Results of searching the aports folder
+        self.find_aport = {}
+        self.aports_files_out_of_sync_with_git = None
+
+        # Checks done for chroots: {suffix: {"id": chroot_id(),
+        #                                    "checks": set of names}}
+        self.chroots = {}
+
+        # Session state: files in the disk caches, that have been used (see
+        # pmb/helpers/cache.py) and events for --profile
+        self.session_start = time.time()
+        self.cache_in_use = set()
+        self.profile_events = []
+        self.profile_steps = {}
+
+        # For the state above, that gets modified from multiple threads (see
+        # pmb/install/batch.py), the LRUCaches have their own locks
+        self.lock = threading.RLock()
+
+    def invalidate_apkindex(self, path=None):
+        """
+        :param path: of the APKINDEX to forget, None for all of them
+        """
+        if path is None:
+            self.apkindex.clear()
+        elif path in self.apkindex:
+            del self.apkindex[path]
+
+    def invalidate_aports(self):
+        """
+        Forget everything, that has been read from the aports folder. Call
+        this after modifying it (APKBUILDs, that have been modified, get
+        parsed again anyway).
+        """
+        self.apkbuild.clear()
+        self.find_aport.clear()
+        self.aports_files_out_of_sync_with_git = None
+
+    def invalidate_chroot(self, suffix=None):
+        """
+        Forget the checks, that have been done for a chroot (e.g. after its
+        content has been replaced).
+
+        :param suffix: of the chroot, None for all chroots
+        """
+        with self.lock:
+            if suffix is None:
+                self.chroots.clear()
+            elif suffix in self.chroots:
+                del self.chroots[suffix]
+
+    def invalidate(self):
+        """
+        Forget everything, except for the session state.
+        """
+        self.invalidate_apkindex()
+        self.invalidate_aports()
+        self.invalidate_chroot()
+
+    def chroot_checked(self, work, suffix, check):
+        """
+        :param check: name of the check, e.g. "apk_min_version"
+        :returns: True, when chroot_check_done() has been called for the
+                  same chroot before, and it has not been zapped since
+        """
+        with self.lock:
+            state = self.chroots.get(suffix)
+            if not state or state["id"] != chroot_id(work, suffix):
+                return False
+            return check in state["checks"]
+
+    def chroot_check_done(self, work, suffix, check):
+        id = chroot_id(work, suffix)
+        with self.lock:
+            state = self.chroots.get(suffix)
+            if not state or state["id"] != id:
+                state = {"id": id, "checks": set()}
+                self.chroots[suffix] = state
+            state["checks"].add(check)
+
+    def stats(self):
+        """
+        :returns: {name: LRUCache.stats()} for the caches of parsed files
+        """
+        return {"apkindex": self.apkindex.stats(),
+                "apkbuild": self.apkbuild.stats()}
+
+    def log_stats(self):
+        for name, stats in sorted(self.stats().items()):
+            logging.debug("Cache " + name + ": " + format_stats(stats))
+
+    def new_command(self):
+        """
+        Start the next command in a long running session (see
+        Session.command()): reset the session state and the results of
+        searching the aports folder, because it may have been changed in the
+        meantime. Parsed files get checked for modifications anyway, and the
+        chroot checks are bound to the chroot folders.
+        """
+        self.find_aport.clear()
+        self.aports_files_out_of_sync_with_git = None
+        self.session_start = time.time()
+        self.cache_in_use = set()
+        self.profile_events = []
+        self.profile_steps = {}
+
+
+class Session(object):
+    """
+    Use pmbootstrap from Python. A session keeps the configuration,
+    deviceinfo and caches between operations:
+
+    session = pmb.Session(device="qemu-amd64", work="/tmp/pmbootstrap")
+    session.build("hello-world")
+    session.install(android_recovery_zip=True)
+
+    The pmbootstrap program creates one session for the command line
+    arguments, pmbootstrap daemon runs all forwarded commands in one.
+    """
+
+    def __init__(self, args=None, **options):
+        """
+        :param args: parsed command line arguments (pmb.parse.arguments()),
+                     with logging set up already (pmb.helpers.logging.init())
+        :param options: when args is None: override the values of the config
+                        file and the defaults of the command line options,
+                        e.g. config="/path/to/pmbootstrap.cfg",
+                        work="/tmp/pmbootstrap", verbose=True. The log gets
+                        written to args.log as usual. The options apply to
+                        the commands of the session as well.
+        """
+        self.options = options
+        if args is None:
+            import pmb.parse
+            args = pmb.parse.arguments([], options)
+            pmb.helpers.logging.init(args)
+        self.args = args
+
+    @property
+    def caches(self):
+        return self.args.cache
+
+    @property
+    def config(self):
+        """
+        :returns: the configuration {name: value}, as loaded from the config
+                  file and overridden by the command line or options
+        """
+        return {name: getattr(self.args, name)
+                for name in pmb.config.defaults}
+
+    @property
+    def deviceinfo(self):
+        return self.args.deviceinfo
+
+    def command_args(self, argv, **options):
+        """
+        Prepare the arguments for an action.
+
+        :param argv: action and its command line arguments, e.g. ["install"]
+        :param options: override the command line arguments of the action,
+                        e.g. sdcard="/dev/mmcblk0"
+        :returns: copy of the session's args, with the caches shared
+        """
+        import pmb.parse
+        args = copy.copy(self.args)
+        pmb.parse.arguments_parser().parse_args(argv, namespace=args)
+        for key, value in options.items():
+            if key not in args:
+                raise ValueError("Invalid option for " + argv[0] + ": " + key)
+            setattr(args, key, value)
+        return args
+
+    def build(self, pkgname, arch=None, force=False, strict=False,
+              buildinfo=False):
+        """
+        Build a package, see "pmbootstrap build -h".
+
+        :param arch: defaults to the native arch
+        :returns: output path relative to the packages folder, or None when
+                  it did not need to be built
+        """
+        import pmb.build
+        args = self.command_args(["build", pkgname], arch=arch,
+                                 force=force, strict=strict,
+                                 buildinfo=buildinfo)
+        if strict:
+            return pmb.build.package_strict(args, pkgname, arch, force,
+                                            buildinfo)
+        return pmb.build.package(args, pkgname, arch, force, buildinfo)
+
+    def install(self, **options):
+        """
+        Create the system image for the device, see "pmbootstrap install -h".
+
+        :param options: the command line arguments of install, e.g.
+                        sdcard="/dev/mmcblk0" or android_recovery_zip=True
+        """
+        import pmb.install
+        pmb.install.install(self.command_args(["install"], **options))
+
+    def resolve(self, pkgnames, arch=None):
+        """
+        :param pkgnames: list of packages
+        :param arch: defaults to the native arch
+        :returns: the packages with all their dependencies
+        """
+        import pmb.parse.depends
+        return pmb.parse.depends.recurse(self.args, pkgnames,
+                                         arch or self.args.arch_native,
+                                         strict=True)
+
+    def command(self, argv):
+        """
+        Run a pmbootstrap command with the caches of this session, like on
+        the command line (pmbootstrap daemon does this for each forwarded
+        command).
+
+        :param argv: e.g. ["build", "hello-world"]
+        :returns: exit code
+        """
+        import pmb
+        import pmb.parse
+
+        args = pmb.parse.arguments(argv, self.options)
+        self.caches.new_command()
+        args.cache = self.caches
+
+        # Use the session's log file, unless a different one was specified
+        if args.details_to_stdout or args.log != self.args.log:
+            pmb.helpers.logging.init(args)
+        else:
+            setattr(args, "logfd", self.args.logfd)
+            pmb.helpers.logging.init_handler(args)
+
+        try:
+            return pmb.run(args) or 0
+        finally:
+            if args.logfd not in [self.args.logfd, sys.stdout]:
+                args.logfd.close()
+            pmb.helpers.logging.init_handler(self.args)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Measure the startup time of short pmbootstrap commands with
+# "python3 -X importtime" (Python 3.7+), and make sure that they do not
+# import the modules of other actions.
+# Usage: test/benchmark_startup.py [--json FILE] [--max-ms MS]
+
+# Commands to measure, these should start fast
+commands = [["--version"], ["config", "work"]]
+
+# Modules, that none of the commands above may import
+forbidden = ["asyncio", "http.client", "pmb.aportgen", "pmb.build",
+             "pmb.challenge", "pmb.chroot", "pmb.export", "pmb.flasher",
+             "pmb.install", "pmb.qemu"]
+
+# Number of runs per command, the fastest one counts
+runs = 5
+
+
+def pmbootstrap_path():
+    return os.path.realpath(os.path.dirname(__file__) + "/../pmbootstrap.py")
+
+
+def parse_importtime(stderr):
+    """
+    :param stderr: output of a command started with "python3 -X importtime"
+    :returns: dict of module names and their cumulative import time in
+              microseconds
+    """
+    ret = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        split = line[len("import time:"):].split("|")
+        if not split[1].strip().isdigit():
+            continue  # header line
+        ret[split[2].strip()] = int(split[1])
+    return ret
+
+
+def run(command):
+    """
+    Run pmbootstrap with the given arguments once.
+
+    :returns: (wall clock time in ms, dict from parse_importtime())
+    """
+    cmd = [sys.executable]
+    if sys.version_info >= (3, 7):
+        cmd += ["-X", "importtime"]
+    cmd += [pmbootstrap_path()] + command
+    start = time.time()
+    process = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE)
+    wall = (time.time() - start) * 1000
+    return (wall, parse_importtime(process.stderr.decode("utf-8", "replace")))
+
+
+def benchmark(command):
+    """
+    :returns: dict with the results of the fastest run
+    """
+    wall, modules = min((run(command) for i in range(runs)),
+                        key=lambda result: result[0])
+    imported = [name for name in forbidden if name in modules]
+    pmb_modules = sorted(name for name in modules
+                         if name == "pmb" or name.startswith("pmb."))
+    return {"command": " ".join(command),
+            "wall_ms": round(wall, 1),
+            "import_ms": round(modules.get("pmb", 0) / 1000, 1),
+            "forbidden": imported,
+            "pmb_modules": pmb_modules,
+            "slowest": sorted(modules.items(), key=lambda item: -item[1])[:10]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--max-ms", type=float,
+                        help="fail, when a command takes longer than this")
+    args = parser.parse_args()
+
+    if sys.version_info < (3, 7):
+        print("NOTE: Python 3.7+ is required for -X importtime, only"
+              " measuring the wall clock time")
+
+    failed = False
+    results = []
+    for command in commands:
+        result = benchmark(command)
+        results.append(result)
+        print("pmbootstrap " + result["command"] + ": " +
+              str(result["wall_ms"]) + " ms (importing pmb: " +
+              str(result["import_ms"]) + " ms, " +
+              str(len(result["pmb_modules"])) + " pmb modules)")
+        for name, usec in result["slowest"]:
+            print("  " + str(round(usec / 1000, 1)).rjust(7) + " ms  " + name)
+        if result["forbidden"]:
+            print("ERROR: imports modules of other actions: " +
+                  ", ".join(result["forbidden"]))
+            failed = True
+        if args.max_ms and result["wall_ms"] > args.max_ms:
+            print("ERROR: slower than " + str(args.max_ms) + " ms")
+            failed = True
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=4)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import base64
+import gzip
+import hashlib
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot.apk_blobs
+import pmb.helpers.logging
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir)
+    return args
+
+
+def write_apk(path):
+    """
+    Write a fake apk (three concatenated gzip streams: signature, control,
+    data), with streams bigger than the chunk size of checksum().
+
+    :returns: the expected checksum
+    """
+    signature = gzip.compress(os.urandom(100000))
+    control = gzip.compress(os.urandom(150000))
+    data = gzip.compress(os.urandom(10000))
+    with open(path, "wb") as handle:
+        handle.write(signature + control + data)
+    return "Q1" + base64.b64encode(hashlib.sha1(control).digest()).decode()
+
+
+def test_checksum(tmpdir):
+    path = str(tmpdir) + "/test.apk"
+    expected = write_apk(path)
+    assert pmb.chroot.apk_blobs.checksum(path) == expected
+
+    # Not an apk
+    with open(path, "wb") as handle:
+        handle.write(b"no gzip data")
+    assert pmb.chroot.apk_blobs.checksum(path) is None
+
+
+def test_blob_path(args):
+    checksum = "Q1" + base64.b64encode(b"\x01\x23" * 10).decode()
+    assert (pmb.chroot.apk_blobs.blob_path(args, checksum) == args.work +
+            "/cache_blobs/" + "0123" * 10 + ".apk")
+    assert pmb.chroot.apk_blobs.blob_path(args, "invalid") is None
+    assert pmb.chroot.apk_blobs.blob_path(args, None) is None
+
+
+def test_link_from_store_missing(args):
+    todo = [{"filename": "hello-1-r0.01234567.apk", "checksum": None},
+            {"filename": "font-1-r0.89abcdef.apk",
+             "checksum": "Q1" + base64.b64encode(b"\0" * 20).decode()}]
+    cache = args.work + "/cache_apk_armhf"
+    assert pmb.chroot.apk_blobs.link_from_store(args, todo, cache) == todo
@@ -0,0 +1,145 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import base64
+import hashlib
+import http.server
+import io
+import os
+import sys
+import tarfile
+import threading
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot.apk_prefetch
+import pmb.helpers.logging
+import pmb.helpers.repo
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    return args
+
+
+@pytest.fixture
+def mirror(request, tmpdir):
+    """
+    Local HTTP server, that serves the "mirror" folder inside tmpdir.
+    :returns: (mirror URL, mirror folder)
+    """
+    folder = str(tmpdir) + "/mirror"
+    os.makedirs(folder)
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            return folder + path.split("?")[0]
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    request.addfinalizer(stop)
+    return ("http://127.0.0.1:" + str(server.server_port) + "/", folder)
+
+
+def write_apkindex(path, blocks):
+    """
+    Write an APKINDEX.tar.gz with the given package blocks.
+    :param blocks: list of dicts like {"P": "hello", "V": "1-r0", ...}
+    """
+    content = ""
+    for block in blocks:
+        for key, value in block.items():
+            content += key + ":" + value + "\n"
+        content += "\n"
+    data = content.encode("utf-8")
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo("APKINDEX")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def test_cache_filename():
+    checksum = "Q1" + base64.b64encode(bytes([0x01, 0x23, 0xab, 0xcd] +
+                                             [0] * 16)).decode()
+    index_data = {"pkgname": "hello-world", "version": "1-r2",
+                  "checksum": checksum}
+    func = pmb.chroot.apk_prefetch.cache_filename
+    assert func(index_data) == "hello-world-1-r2.0123abcd.apk"
+    assert func({"pkgname": "hello-world", "version": "1-r2"}) is None
+
+
+def test_prefetch_download(args, tmpdir, mirror):
+    url, folder = mirror
+    args.work = str(tmpdir) + "/work"
+    args.mirror_alpine = url
+    args.mirror_postmarketos = ""
+    args.alpine_version = "edge"
+    arch = "armhf"
+
+    # Two packages on the mirror, one of them is in the apk cache already
+    os.makedirs(folder + "/edge/main/" + arch)
+    os.makedirs(args.work + "/cache_apk_" + arch)
+    blocks = []
+    for pkgname in ["first", "second"]:
+        content = (pkgname + " package content").encode("utf-8")
+        with open(folder + "/edge/main/" + arch + "/" + pkgname + "-1-r0.apk",
+                  "wb") as handle:
+            handle.write(content)
+        checksum = hashlib.sha1(content).digest()
+        blocks.append({"C": "Q1" + base64.b64encode(checksum).decode(),
+                       "P": pkgname, "V": "1-r0", "S": str(len(content)),
+                       "t": "1"})
+    for path, repo_url in pmb.helpers.repo.apkindex_files_remote(args, arch):
+        write_apkindex(path, blocks if repo_url.endswith("/main") else [])
+    cached = pmb.chroot.apk_prefetch.cache_filename({
+        "pkgname": "second", "version": "1-r0", "checksum": blocks[1]["C"]})
+    open(args.work + "/cache_apk_" + arch + "/" + cached, "w").close()
+
+    # Only the first package needs to be downloaded
+    todo = pmb.chroot.apk_prefetch.download_list(args, ["first", "second",
+                                                        "unknown"], arch)
+    assert len(todo) == 1
+    assert todo[0]["url"] == url + "edge/main/" + arch + "/first-1-r0.apk"
+
+    # Download it, and a package that does not exist
+    target = str(tmpdir) + "/target"
+    os.makedirs(target)
+    todo.append({"url": url + "missing.apk", "filename": "missing.apk",
+                 "size": None})
+    paths = pmb.chroot.apk_prefetch.download(args, todo, target)
+    assert paths == [target + "/" + todo[0]["filename"]]
+    with open(paths[0], "rb") as handle:
+        assert handle.read() == b"first package content"
+    assert sorted(os.listdir(target)) == [todo[0]["filename"]]
@@ -0,0 +1,79 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot.apk
+import pmb.helpers.logging
+import pmb.helpers.repo
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    return args
+
+
+def test_index_is_outdated(args, tmpdir):
+    args.work = str(tmpdir)
+    args.apkindex_ttl = "3600"
+    arch = "armhf"
+
+    # Never updated
+    assert pmb.chroot.apk.index_is_outdated(args, arch)
+
+    # Updated, but the index files are missing
+    pmb.chroot.apk.index_mark_updated(args, arch)
+    assert pmb.chroot.apk.index_is_outdated(args, arch)
+
+    # Updated and index files exist
+    os.makedirs(args.work + "/cache_apk_" + arch)
+    for index in pmb.helpers.repo.apkindex_files(args, arch):
+        if "/cache_apk_" in index:
+            open(index, "w").close()
+    assert not pmb.chroot.apk.index_is_outdated(args, arch)
+
+    # Other arch is not affected
+    assert pmb.chroot.apk.index_is_outdated(args, "aarch64")
+
+    # Expired
+    args.apkindex_ttl = "0"
+    assert pmb.chroot.apk.index_is_outdated(args, arch)
+    args.apkindex_ttl = "3600"
+
+    # Repository list changed
+    args.mirror_alpine = "http://example.org/alpine/"
+    assert pmb.chroot.apk.index_is_outdated(args, arch)
+
+
+def test_update_index_offline(args, tmpdir):
+    args.work = str(tmpdir)
+    args.offline = True
+
+    # Would fail without --offline, because the chroot does not exist
+    pmb.chroot.apk.update_index(args, "buildroot_armhf")
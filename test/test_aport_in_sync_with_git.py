@@ -76,7 +76,7 @@ def out_of_sync_files(args):
     that the contents of the aports folder does not change during one run) and
     return the files out of sync for the hello-world package.
     """
-    args.cache["aports_files_out_of_sync_with_git"] = None
+    args.cache.aports_files_out_of_sync_with_git = None
     return pmb.build.other.aports_files_out_of_sync_with_git(args,
                                                              "alpine-base")
 
@@ -16,6 +16,7 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
 """
+import importlib
 import os
 import sys
 import pytest
@@ -24,8 +25,12 @@ import pytest
 sys.path.append(os.path.realpath(
     os.path.join(os.path.dirname(__file__) + "/..")))
 import pmb.aportgen
+import pmb.build
+import pmb.build.autodetect
+import pmb.chroot.overlay
 import pmb.config
 import pmb.helpers.logging
+import pmb.parse
 
 
 @pytest.fixture
@@ -49,3 +54,45 @@ def test_build_cross(args):
     """
     for arch in pmb.config.build_device_architectures:
         pmb.build.package(args, "hello-world", arch, True)
+
+
+def test_build_strict(args):
+    """
+    Build twice in strict mode: the second build must reuse the clean base
+    chroot, and the makedepends must not end up in it.
+    """
+    for i in range(2):
+        pmb.build.package_strict(args, "hello-world", args.arch_native, True)
+        assert pmb.chroot.overlay.is_clean(args, "native")
+
+
+def test_strict_suffixes(args, monkeypatch):
+    """
+    The chroots of makedepends, that get built in strict mode first, need
+    overlays as well.
+    """
+    aports = {"app": {"pkgname": "app", "arch": "armhf",
+                      "makedepends": ["tool", "lib", "upstream"]},
+              "tool": {"pkgname": "tool", "arch": args.arch_native,
+                       "makedepends": ["app"]},
+              "lib": {"pkgname": "lib", "arch": "aarch64",
+                      "makedepends": []},
+              "built": {"pkgname": "built", "arch": "x86",
+                        "makedepends": []}}
+    aports["lib"]["makedepends"] = ["built"]
+    monkeypatch.setattr(pmb.build, "find_aport", lambda args, pkgname,
+                        must_exist: pkgname if pkgname in aports else None)
+    monkeypatch.setattr(pmb.parse, "apkbuild", lambda args, path:
+                        aports[path.split("/")[0]])
+    monkeypatch.setattr(pmb.build.autodetect, "carch", lambda args, apkbuild,
+                        carch, strict: apkbuild["arch"])
+    monkeypatch.setattr(pmb.build, "is_necessary", lambda args, carch,
+                        apkbuild: apkbuild["pkgname"] != "built")
+    args.cross = False
+    package = importlib.import_module("pmb.build.package")
+    assert package.strict_suffixes(args, "app", "armhf") == [
+        "native", "buildroot_armhf", "buildroot_aarch64"]
+
+    # Forcing the build only applies to the package itself
+    assert package.strict_suffixes(args, "built", "x86", True) == [
+        "native", "buildroot_x86"]
@@ -42,7 +42,7 @@ def args(request, tmpdir):
     apkindex_path = str(tmpdir) + "/APKINDEX.tar.gz"
     open(apkindex_path, "a").close()
     lastmod = os.path.getmtime(apkindex_path)
-    args.cache["apkindex"][apkindex_path] = {"lastmod": lastmod, "ret": {}}
+    args.cache.apkindex.set(apkindex_path, {}, lastmod=lastmod)
     return args
 
 
@@ -54,14 +54,14 @@ def cache_apkindex(args, version=None, timestamp=None):
     The parameters version and timestamp are optional. If specified, they
     change the string in the cache to the new value.
     """
-    apkindex_path = list(args.cache["apkindex"].keys())[0]
+    apkindex_path = list(args.cache.apkindex.keys())[0]
 
     if version is not None:
-        args.cache["apkindex"][apkindex_path][
-            "ret"]["hello-world"]["version"] = version
+        args.cache.apkindex[apkindex_path]["hello-world"][
+            "version"] = version
     if timestamp is not None:
-        args.cache["apkindex"][apkindex_path][
-            "ret"]["hello-world"]["timestamp"] = timestamp
+        args.cache.apkindex[apkindex_path]["hello-world"][
+            "timestamp"] = timestamp
 
 
 def cache_files_out_of_sync(args, is_out_of_sync):
@@ -74,7 +74,7 @@ def cache_files_out_of_sync(args, is_out_of_sync):
     if is_out_of_sync:
         aport = pmb.build.other.find_aport(args, "hello-world")
         new = [os.path.realpath(aport + "/APKBUILD")]
-    args.cache["aports_files_out_of_sync_with_git"] = new
+    args.cache.aports_files_out_of_sync_with_git = new
 
 
 def test_build_is_necessary(args):
@@ -83,10 +83,10 @@ def test_build_is_necessary(args):
     apkbuild = pmb.parse.apkbuild(args, aport + "/APKBUILD")
     apkbuild["pkgver"] = "1"
     apkbuild["pkgrel"] = "2"
-    apkindex_path = list(args.cache["apkindex"].keys())[0]
-    args.cache["apkindex"][apkindex_path]["ret"] = {
+    apkindex_path = list(args.cache.apkindex.keys())[0]
+    args.cache.apkindex[apkindex_path].update({
         "hello-world": {"pkgname": "hello-world", "version": "1-r2"}
-    }
+    })
 
     # a) Binary repo has a newer version
     cache_apkindex(args, version="999-r1")
@@ -130,7 +130,7 @@ def test_build_is_necessary_no_binary_available(args):
     APKINDEX cache is set up to fake an empty APKINDEX, which means, that the
     hello-world package has not been built yet.
     """
-    apkindex_path = list(args.cache["apkindex"].keys())[0]
+    apkindex_path = list(args.cache.apkindex.keys())[0]
     aport = pmb.build.other.find_aport(args, "hello-world")
     apkbuild = pmb.parse.apkbuild(args, aport + "/APKBUILD")
     assert pmb.build.is_necessary(args, None, apkbuild, apkindex_path) is True
@@ -0,0 +1,110 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import time
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.cache
+import pmb.helpers.logging
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+
+    # Fake work folder, all budgets disabled
+    args.work = str(tmpdir)
+    for key in ["cache_budget", "cache_budget_apk", "cache_budget_ccache",
+                "cache_budget_distfiles", "cache_budget_git",
+                "cache_budget_http", "cache_budget_images"]:
+        setattr(args, key, "0")
+    return args
+
+
+def create(args, path, size_mib, age_days):
+    """
+    Create a file in the work folder, that was last accessed age_days ago.
+    """
+    path = args.work + "/" + path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as handle:
+        handle.write(os.urandom(size_mib * 1024 * 1024))
+    timestamp = time.time() - age_days * 24 * 3600
+    os.utime(path, (timestamp, timestamp))
+
+
+def removed_paths(args, removed):
+    ret = []
+    for entry in removed:
+        ret += [os.path.relpath(path, args.work) for path in entry["paths"]]
+    return sorted(ret)
+
+
+def test_prune_no_budget(args):
+    create(args, "cache_http/a", 1, 10)
+    assert pmb.helpers.cache.prune(args, True) == []
+
+
+def test_prune_per_cache_budget(args):
+    create(args, "cache_apk_x86_64/old.apk", 1, 30)
+    create(args, "cache_apk_armhf/middle.apk", 1, 20)
+    create(args, "cache_apk_x86_64/new.apk", 1, 10)
+    create(args, "cache_distfiles/old.tar.gz", 1, 40)
+    args.cache_budget_apk = "2"
+    removed = pmb.helpers.cache.prune(args, True)
+    assert removed_paths(args, removed) == ["cache_apk_x86_64/old.apk"]
+
+
+def test_prune_global_budget(args):
+    create(args, "cache_http/index", 1, 5)
+    create(args, "cache_http/index.meta", 0, 5)
+    create(args, "cache_distfiles/old.tar.gz", 1, 40)
+    create(args, "cache_git/repo/.git/HEAD", 1, 30)
+    create(args, "cache_git/repo/file", 1, 1)
+    args.cache_budget = "4"
+    removed = pmb.helpers.cache.prune(args, True)
+    assert removed_paths(args, removed) == ["cache_distfiles/old.tar.gz"]
+
+    # Metadata gets removed together with the file, git repos as whole (the
+    # repo's access time is the newest one of its files)
+    args.cache_budget = "3"
+    removed = pmb.helpers.cache.prune(args, True)
+    assert removed_paths(args, removed) == ["cache_distfiles/old.tar.gz",
+                                            "cache_http/index",
+                                            "cache_http/index.meta"]
+
+
+def test_prune_keeps_entries_in_use(args):
+    create(args, "cache_http/used", 1, 30)
+    create(args, "cache_http/unused", 1, 20)
+    create(args, "cache_http/new", 1, 0)
+    args.cache_budget_http = "1"
+    args.cache.session_start = time.time() - 3600
+    pmb.helpers.cache.keep(args, args.work + "/cache_http/used")
+    removed = pmb.helpers.cache.prune(args, True)
+    assert removed_paths(args, removed) == ["cache_http/unused"]
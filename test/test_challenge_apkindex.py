@@ -42,7 +42,7 @@ def args(request, tmpdir):
     path_apkindex = str(tmpdir) + "/APKINDEX.tar.gz"
     open(path_apkindex, "a").close()
     lastmod = os.path.getmtime(path_apkindex)
-    args.cache["apkindex"][path_apkindex] = {"lastmod": lastmod, "ret": {}}
+    args.cache.apkindex.set(path_apkindex, {}, lastmod=lastmod)
 
     return args
 
@@ -51,7 +51,7 @@ def test_challenge_apkindex_extra_file(args):
     """
     Create an extra file, that is not mentioned in the APKINDEX cache.
     """
-    path_apkindex = list(args.cache["apkindex"].keys())[0]
+    path_apkindex = list(args.cache.apkindex.keys())[0]
     tmpdir = os.path.dirname(path_apkindex)
     open(tmpdir + "/invalid-extra-file.apk", "a").close()
 
@@ -64,10 +64,10 @@ def test_challenge_apkindex_file_does_not_exist(args):
     """
     Add an entry to the APKINDEX cache, that does not exist on disk.
     """
-    path_apkindex = list(args.cache["apkindex"].keys())[0]
-    args.cache["apkindex"][path_apkindex]["ret"] = {
+    path_apkindex = list(args.cache.apkindex.keys())[0]
+    args.cache.apkindex[path_apkindex].update({
         "hello-world": {"pkgname": "hello-world", "version": "1-r2"}
-    }
+    })
 
     with pytest.raises(RuntimeError) as e:
         pmb.challenge.apkindex(args, path_apkindex)
@@ -79,10 +79,10 @@ def test_challenge_apkindex_ok(args):
     Metion one file in the APKINDEX cache, and create it on disk. The challenge
     should go through without an exception.
     """
-    path_apkindex = list(args.cache["apkindex"].keys())[0]
-    args.cache["apkindex"][path_apkindex]["ret"] = {
+    path_apkindex = list(args.cache.apkindex.keys())[0]
+    args.cache.apkindex[path_apkindex].update({
         "hello-world": {"pkgname": "hello-world", "version": "1-r2"}
-    }
+    })
     tmpdir = os.path.dirname(path_apkindex)
     open(tmpdir + "/hello-world-1-r2.apk", "a").close()
 
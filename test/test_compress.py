@@ -0,0 +1,143 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.compress
+import pmb.install.recovery
+
+
+def compress(data, threads, chunk=70000):
+    handle = io.BytesIO()
+    writer = pmb.helpers.compress.GzipWriter(handle, 6, threads)
+    for i in range(0, len(data), chunk):
+        writer.write(data[i:i + chunk])
+    writer.close()
+    assert writer.size == len(data)
+    assert writer.written == len(handle.getvalue())
+    return handle.getvalue()
+
+
+def test_gzip_writer(tmpdir):
+    # Multiple blocks: compressible and random data, last block not full
+    block = pmb.helpers.compress.block_size
+    data = b"postmarketOS " * (block // 4) + os.urandom(block) + b"end"
+    for threads in [1, 3]:
+        compressed = compress(data, threads)
+        assert gzip.decompress(compressed) == data
+        assert len(compressed) < len(data)
+
+    # Empty input
+    assert gzip.decompress(compress(b"", 2)) == b""
+
+    # One gzip stream, that gzip accepts as well
+    if not shutil.which("gzip"):
+        return
+    path = str(tmpdir) + "/test.gz"
+    with open(path, "wb") as handle:
+        handle.write(compress(data, 2))
+    assert subprocess.check_output(["gzip", "-dc", path]) == data
+
+
+def test_writer_codecs():
+    handle = io.BytesIO()
+    writer = pmb.helpers.compress.writer(handle, "none")
+    writer.write(b"test")
+    writer.close()
+    assert handle.getvalue() == b"test"
+
+    with pytest.raises(RuntimeError) as e:
+        pmb.helpers.compress.writer(handle, "invalid")
+    assert "Unknown compression: invalid" in str(e.value)
+
+
+def test_recovery_create_archive(tmpdir):
+    rootfs = str(tmpdir) + "/rootfs"
+    os.makedirs(rootfs + "/etc")
+    os.makedirs(rootfs + "/home/user/.cache")
+    with open(rootfs + "/etc/hostname", "w") as handle:
+        handle.write("test-device\n")
+    os.link(rootfs + "/etc/hostname", rootfs + "/etc/hostname.link")
+
+    for codec in ["gzip", "none"]:
+        path = str(tmpdir) + "/rootfs.tar.gz"
+        stats = pmb.install.recovery.create_archive(rootfs, path, codec, 1, 2)
+        assert stats["compressed"] == os.path.getsize(path)
+        with tarfile.open(path) as tar:
+            names = tar.getnames()
+            assert tar.getmember("./etc/hostname.link").islnk()
+            assert tar.getmember("./etc/hostname").uname == ""
+        assert names == [".", "./etc", "./etc/hostname",
+                         "./etc/hostname.link", "./home", "./home/user"]
+
+
+def test_recovery_one_file_system(tmpdir, monkeypatch):
+    """
+    Mountpoints in the rootfs (/proc, apk cache, ...) get archived as empty
+    folders.
+    """
+    rootfs = str(tmpdir) + "/rootfs"
+    os.makedirs(rootfs + "/proc/1")
+    os.makedirs(rootfs + "/var/cache/apk")
+    for file in ["/proc/1/status", "/var/cache/apk/test.apk", "/etc"]:
+        with open(rootfs + file, "w") as handle:
+            handle.write("test\n")
+
+    # Pretend, that /proc and /var/cache/apk are on other filesystems
+    device = pmb.install.recovery.device
+
+    def device_fake(path):
+        path = os.path.normpath(path)
+        for mountpoint in ["/proc", "/var/cache/apk"]:
+            if path.startswith(os.path.normpath(rootfs + mountpoint)):
+                return -1
+        return device(path)
+    monkeypatch.setattr(pmb.install.recovery, "device", device_fake)
+
+    path = str(tmpdir) + "/rootfs.tar.gz"
+    pmb.install.recovery.create_archive(rootfs, path, "none", 1, 1)
+    with tarfile.open(path) as tar:
+        assert tar.getnames() == [".", "./etc", "./proc", "./var",
+                                  "./var/cache", "./var/cache/apk"]
+
+
+def test_recovery_one_file_system_mount(tmpdir):
+    rootfs = str(tmpdir) + "/rootfs"
+    os.makedirs(rootfs + "/proc")
+    if os.geteuid() != 0 or subprocess.call(["mount", "-t", "tmpfs", "none",
+                                             rootfs + "/proc"]):
+        pytest.skip("mounting a tmpfs needs root")
+    try:
+        with open(rootfs + "/proc/kcore", "w") as handle:
+            handle.write("test\n")
+        path = str(tmpdir) + "/rootfs.tar.gz"
+        pmb.install.recovery.create_archive(rootfs, path, "none", 1, 1)
+        with tarfile.open(path) as tar:
+            assert tar.getnames() == [".", "./proc"]
+    finally:
+        subprocess.call(["umount", rootfs + "/proc"])
@@ -0,0 +1,147 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.config
+import pmb.helpers.daemon
+import pmb.helpers.logging
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = str(tmpdir) + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    return args
+
+
+def test_send_receive_fds(tmpdir):
+    a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with a, b, open(str(tmpdir) + "/file", "w") as handle:
+        # Bigger than the socket buffer: send from another thread
+        thread = threading.Thread(target=pmb.helpers.daemon.send,
+                                  args=(a, {"key": "value" * 100000},
+                                        [handle.fileno()]))
+        thread.start()
+        message, fds = pmb.helpers.daemon.receive(b)
+        thread.join()
+        assert message == {"key": "value" * 100000}
+        assert len(fds) == 1
+
+        # The received file descriptor refers to the same file
+        os.write(fds[0], b"written through the passed fd")
+        os.close(fds[0])
+        a.close()
+        assert pmb.helpers.daemon.receive(b) == (None, [])
+    with open(str(tmpdir) + "/file") as handle:
+        assert handle.read() == "written through the passed fd"
+
+
+def test_forward_not_running(args, tmpdir):
+    args.work = str(tmpdir)
+    assert not pmb.helpers.daemon.forwardable(args)
+    assert pmb.helpers.daemon.forward(args) is None
+
+    # Socket left over from a crashed daemon
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(pmb.helpers.daemon.socket_path(args))
+    sock.close()
+    assert pmb.helpers.daemon.forwardable(args)
+    assert pmb.helpers.daemon.forward(args) is None
+
+    args.daemon = False
+    assert not pmb.helpers.daemon.forwardable(args)
+
+
+def pmbootstrap(tmpdir, parameters):
+    """
+    Run pmbootstrap.py with a config and work folder in tmpdir.
+
+    :returns: (exit code, stdout, stderr)
+    """
+    cmd = [sys.executable, pmb.config.pmb_src + "/pmbootstrap.py",
+           "-c", str(tmpdir) + "/pmbootstrap.cfg",
+           "-w", str(tmpdir) + "/work"] + parameters
+    process = subprocess.run(cmd, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                             timeout=60)
+    return (process.returncode, process.stdout.decode("utf-8"),
+            process.stderr.decode("utf-8"))
+
+
+def test_daemon(tmpdir):
+    with open(str(tmpdir) + "/pmbootstrap.cfg", "w") as handle:
+        handle.write("[pmbootstrap]\n")
+    path = str(tmpdir) + "/work/" + pmb.config.daemon_socket
+    expected = pmbootstrap(tmpdir, ["--no-daemon", "parse_apkbuild",
+                                    "hello-world"])
+    assert expected[0] == 0
+
+    # Start the daemon and wait until it listens
+    daemon = subprocess.Popen([sys.executable, pmb.config.pmb_src +
+                               "/pmbootstrap.py", "-c", str(tmpdir) +
+                               "/pmbootstrap.cfg", "-w", str(tmpdir) +
+                               "/work", "daemon"],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        for i in range(300):
+            if os.path.exists(path):
+                break
+            assert daemon.poll() is None
+            time.sleep(0.1)
+        assert os.path.exists(path)
+
+        # Same output as running it in-process
+        ret, stdout, stderr = pmbootstrap(tmpdir, ["parse_apkbuild",
+                                                   "hello-world"])
+        assert ret == 0
+        assert stdout == expected[1]
+
+        # Failing command, the daemon keeps running
+        ret, stdout, stderr = pmbootstrap(tmpdir, ["parse_apkbuild",
+                                                   "invalid-pkg"])
+        assert ret == 1
+        assert "ERROR: Could not find aport for package: invalid-pkg" in stderr
+        assert daemon.poll() is None
+
+        # Stop it
+        assert pmbootstrap(tmpdir, ["daemon", "--stop"])[0] == 0
+        assert daemon.wait(10) == 0
+        assert not os.path.exists(path)
+        with open(str(tmpdir) + "/work/log.txt") as handle:
+            assert ("Forwarded command: pmbootstrap -c " + str(tmpdir) +
+                    "/pmbootstrap.cfg -w " + str(tmpdir) + "/work"
+                    " parse_apkbuild hello-world") in handle.read()
+    finally:
+        if daemon.poll() is None:
+            daemon.kill()
+            daemon.wait()
@@ -0,0 +1,75 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import importlib
+import io
+import os
+import sys
+import tarfile
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+
+# The module (pmb.export.odin is the function)
+odin = importlib.import_module("pmb.export.odin")
+
+
+def test_md5_reader():
+    data = os.urandom(1000)
+    reader = odin.Md5Reader(io.BytesIO(data), "KERNEL.bin.md5")
+    result = b""
+    while True:
+        chunk = reader.read(300)
+        if not chunk:
+            break
+        result += chunk
+    line = (hashlib.md5(data).hexdigest() + "  KERNEL.bin.md5\n").encode()
+    assert result == data + line
+
+
+def test_write_tar(tmpdir):
+    tmpdir = str(tmpdir)
+    files = {"vmlinuz": os.urandom(5000), "initfs.lzo": os.urandom(123)}
+    for name, data in files.items():
+        with open(tmpdir + "/" + name, "wb") as handle:
+            handle.write(data)
+    path = tmpdir + "/samsung-i9100.tar.md5"
+    odin.write_tar([(tmpdir + "/vmlinuz", "KERNEL.bin.md5"),
+                    (tmpdir + "/initfs.lzo", "RECOVERY.bin.md5")], path)
+
+    # md5 line of the tar at the end
+    with open(path, "rb") as handle:
+        content = handle.read()
+    length = len(odin.md5_line("0" * 32, "samsung-i9100.tar"))
+    tar = content[:-length]
+    line = content[-length:]
+    assert line == (hashlib.md5(tar).hexdigest() +
+                    "  samsung-i9100.tar\n").encode()
+    assert len(tar) % tarfile.RECORDSIZE == 0
+
+    # Files with their md5 lines
+    with tarfile.open(fileobj=io.BytesIO(tar)) as handle:
+        assert handle.getnames() == ["KERNEL.bin.md5", "RECOVERY.bin.md5"]
+        for name, member in [("vmlinuz", "KERNEL.bin.md5"),
+                             ("initfs.lzo", "RECOVERY.bin.md5")]:
+            data = files[name]
+            assert handle.extractfile(member).read() == data + (
+                hashlib.md5(data).hexdigest() + "  " + member +
+                "\n").encode()
@@ -0,0 +1,183 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.config
+import pmb.helpers.cli
+import pmb.helpers.logging
+import pmb.helpers.sparse
+import pmb.flasher.delta
+
+MiB = 1024 * 1024
+chunk_size = MiB
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = str(tmpdir) + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir)
+    args.device = "test-device"
+    return args
+
+
+def write_image(path, data):
+    with open(path, "wb") as handle:
+        handle.write(data)
+
+
+def apply_delta(device, path_delta):
+    """
+    Flash a sparse image to a "device" (bytearray) like fastboot: "don't
+    care" chunks leave the content alone.
+    """
+    with open(path_delta, "rb") as handle:
+        block_size = pmb.helpers.sparse.read_header(handle)[0]
+    pos = 0
+    for kind, blocks, payload in pmb.helpers.sparse.chunks(path_delta):
+        length = blocks * block_size
+        if kind == pmb.helpers.sparse.chunk_raw:
+            device[pos:pos + length] = payload
+        elif kind == pmb.helpers.sparse.chunk_fill:
+            device[pos:pos + length] = payload * (length // 4)
+        pos += length
+    return device
+
+
+def test_delta_raw_image(tmpdir):
+    tmpdir = str(tmpdir)
+    old = os.urandom(5 * MiB + 1000)
+    write_image(tmpdir + "/old.img", old)
+    scanned_old = pmb.flasher.delta.scan(tmpdir + "/old.img", chunk_size)
+    assert len(scanned_old) == 6
+    manifest = pmb.flasher.delta.flashed(scanned_old)
+    assert None not in manifest
+
+    # Change a few bytes in the third chunk, zero the fifth one
+    new = bytearray(old)
+    new[2 * MiB + 100:2 * MiB + 110] = b"x" * 10
+    new[4 * MiB:5 * MiB] = bytes(MiB)
+    write_image(tmpdir + "/new.img", new)
+    scanned = pmb.flasher.delta.scan(tmpdir + "/new.img", chunk_size)
+    indexes = pmb.flasher.delta.changed(manifest, scanned)
+    assert indexes == [2, 4]
+    assert pmb.flasher.delta.ranges(indexes, chunk_size) == [
+        (2 * MiB, 3 * MiB), (4 * MiB, 5 * MiB)]
+    assert pmb.flasher.delta.ranges([1, 2, 3], chunk_size) == [
+        (MiB, 4 * MiB)]
+
+    # Only the changed chunks are in the delta, the zeros as fill chunk
+    stats = pmb.flasher.delta.write(tmpdir + "/new.img",
+                                    tmpdir + "/delta.img", chunk_size,
+                                    indexes)
+    assert stats == {"blocks": 1281, "raw": 256, "fill": 256,
+                     "dont_care": 769}
+    assert os.path.getsize(tmpdir + "/delta.img") < 2 * MiB
+
+    # Flashing it to the device with the old image gives the new one
+    device = apply_delta(bytearray(old) + bytes(3096),
+                         tmpdir + "/delta.img")
+    assert device[:len(new)] == new
+
+    # Manifest after flashing the delta is the one of the new image
+    assert pmb.flasher.delta.flashed(scanned, manifest, set(indexes)) == \
+        pmb.flasher.delta.flashed(scanned)
+
+
+def test_delta_sparse_image(tmpdir):
+    """
+    "Don't care" parts of a sparse image are unknown on the device after
+    flashing it, so they get flashed with the next delta.
+    """
+    tmpdir = str(tmpdir)
+    with open(tmpdir + "/raw.img", "wb") as handle:
+        handle.write(os.urandom(MiB))
+        handle.seek(MiB + MiB // 2)
+        handle.write(os.urandom(4096))
+        handle.truncate(4 * MiB)
+    pmb.helpers.sparse.write(tmpdir + "/raw.img", tmpdir + "/sparse.img")
+    scanned = pmb.flasher.delta.scan(tmpdir + "/sparse.img", chunk_size)
+    assert [state for digest, state in scanned] == ["data", "partial",
+                                                    "empty", "empty"]
+    manifest = pmb.flasher.delta.flashed(scanned)
+    assert manifest[0] is not None
+    assert manifest[1:] == [None, None, None]
+
+    # Same image: the partial chunk gets flashed completely, then it is known
+    indexes = pmb.flasher.delta.changed(manifest, scanned)
+    assert indexes == [1]
+    manifest = pmb.flasher.delta.flashed(scanned, manifest, set(indexes))
+    assert manifest[:2] == [scanned[0][0], scanned[1][0]]
+    assert pmb.flasher.delta.changed(manifest, scanned) == []
+
+    # The delta has the zeros of the partial chunk, the rest is "don't care"
+    pmb.flasher.delta.write(tmpdir + "/sparse.img", tmpdir + "/delta.img",
+                            chunk_size, [1])
+    device = apply_delta(bytearray(b"\xff" * 4 * MiB), tmpdir + "/delta.img")
+    with open(tmpdir + "/raw.img", "rb") as handle:
+        raw = handle.read()
+    assert device[MiB:2 * MiB] == raw[MiB:2 * MiB]
+    assert device[:MiB] == b"\xff" * MiB
+
+
+def test_prepare(args, tmpdir, monkeypatch):
+    tmpdir = str(tmpdir)
+    os.makedirs(args.work + "/chroot_native/tmp")
+    write_image(tmpdir + "/system.img", os.urandom(2 * MiB))
+    scanned = pmb.flasher.delta.scan(tmpdir + "/system.img", chunk_size)
+    path = pmb.flasher.delta.manifest_path(args, "0123456789", "system")
+    assert path == (args.work + "/flash_manifests/test-device/"
+                    "0123456789_system.json")
+
+    # No manifest, or a flash method that can not flash sparse images
+    assert pmb.flasher.delta.prepare(args, "fastboot", tmpdir + "/system.img",
+                                     scanned, path) is None
+    pmb.flasher.delta.manifest_save(path, chunk_size,
+                                    pmb.flasher.delta.flashed(scanned))
+    assert pmb.flasher.delta.prepare(args, "heimdall-isorec",
+                                     tmpdir + "/system.img", scanned,
+                                     path) is None
+
+    # Second chunk changed, but the device has been booted since the flash
+    manifest = pmb.flasher.delta.manifest_load(path)
+    manifest["chunks"][1] = "0" * 64
+    pmb.flasher.delta.manifest_save(path, chunk_size, manifest["chunks"])
+    monkeypatch.setattr(pmb.helpers.cli, "confirm", lambda args, question:
+                        False)
+    assert pmb.flasher.delta.prepare(args, "fastboot", tmpdir + "/system.img",
+                                     scanned, path) is None
+    monkeypatch.undo()
+
+    # Confirmed
+    args.assume_yes = True
+    delta, indexes, chunks = pmb.flasher.delta.prepare(
+        args, "fastboot", tmpdir + "/system.img", scanned, path)
+    assert delta == "/tmp/test-device-delta.img"
+    assert indexes == [1]
+    assert chunks == manifest["chunks"]
+    assert os.path.exists(args.work + "/chroot_native" + delta)
@@ -0,0 +1,255 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import json
+import http.server
+import os
+import socketserver
+import sys
+import threading
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.http
+import pmb.helpers.logging
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir)
+    return args
+
+
+@pytest.fixture
+def server(request):
+    """
+    Local keep-alive HTTP server with support for Range requests (and
+    If-Range) and ETags.
+    Files are served from the "files" dict, "/redirect/<name>" redirects to
+    "/<name>".
+    :returns: dict with "url", "files", "requests" (list of (path, range
+              header)) and "connections" (count of accepted connections)
+    """
+    ret = {"files": {}, "requests": [], "connections": 0}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            ret["connections"] += 1
+            super().setup()
+
+        def do_GET(self):
+            ret["requests"].append((self.path, self.headers.get("Range")))
+            if self.path.startswith("/redirect/"):
+                self.send_response(302)
+                self.send_header("Location", self.path[len("/redirect"):])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            data = ret["files"].get(self.path[1:])
+            if data is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            etag = '"' + hashlib.sha256(data).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            start = 0
+            if_range = self.headers.get("If-Range")
+            if self.headers.get("Range") and if_range in [None, etag]:
+                start = int(self.headers["Range"][6:-1])
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes " + str(start) +
+                                 "-" + str(len(data) - 1) + "/" +
+                                 str(len(data)))
+            else:
+                self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(data) - start))
+            self.end_headers()
+            self.wfile.write(data[start:])
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+    httpd = Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+
+    def stop():
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+        pmb.helpers.http.pool.clear()
+    request.addfinalizer(stop)
+    ret["url"] = "http://127.0.0.1:" + str(httpd.server_port) + "/"
+    return ret
+
+
+def test_download_cache(args, server):
+    server["files"]["hello"] = b"hello world"
+    url = server["url"] + "hello"
+    path = pmb.helpers.http.download(args, url, "prefix")
+    with open(path, "rb") as handle:
+        assert handle.read() == b"hello world"
+    assert not os.path.exists(path + ".part")
+
+    # Second call gets served from the cache
+    assert pmb.helpers.http.download(args, url, "prefix") == path
+    assert len(server["requests"]) == 1
+
+
+def write_part(path, data, etag):
+    with open(path + ".part", "wb") as handle:
+        handle.write(data)
+    with open(path + ".part.meta", "w") as handle:
+        json.dump({"url": "", "etag": etag, "last_modified": None}, handle)
+
+
+def test_fetch_resume(server, tmpdir):
+    data = os.urandom(100000)
+    server["files"]["big"] = data
+    path = str(tmpdir) + "/big"
+    write_part(path, data[:30000],
+               '"' + hashlib.sha256(data).hexdigest() + '"')
+
+    pmb.helpers.http.fetch(server["url"] + "big", path,
+                           hashlib.sha256(data).hexdigest(), len(data))
+    assert server["requests"] == [("/big", "bytes=30000-")]
+    with open(path, "rb") as handle:
+        assert handle.read() == data
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.meta")
+
+
+def test_fetch_resume_changed(server, tmpdir):
+    """
+    A partial download of a file, that has changed on the server since, must
+    not be continued (no sha256 or size to detect the mix of both).
+    """
+    data = os.urandom(100000)
+    server["files"]["big"] = data
+    path = str(tmpdir) + "/big"
+    write_part(path, os.urandom(30000), '"old"')
+    pmb.helpers.http.fetch(server["url"] + "big", path)
+    with open(path, "rb") as handle:
+        assert handle.read() == data
+
+    # Without validators, the download starts from scratch
+    with open(path + ".part", "wb") as handle:
+        handle.write(os.urandom(30000))
+    pmb.helpers.http.fetch(server["url"] + "big", path)
+    assert server["requests"][-1] == ("/big", None)
+    with open(path, "rb") as handle:
+        assert handle.read() == data
+
+    # Weak ETags can not be used for If-Range
+    write_part(path, data[:30000], 'W/"weak"')
+    assert pmb.helpers.http.part_validator(path + ".part") is None
+
+
+def test_fetch_verify_mismatch(server, tmpdir):
+    server["files"]["file"] = b"content"
+    path = str(tmpdir) + "/file"
+    with pytest.raises(RuntimeError) as e:
+        pmb.helpers.http.fetch(server["url"] + "file", path, "0" * 64)
+    assert "sha256 mismatch" in str(e.value)
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".part")
+
+
+def test_fetch_redirect_and_404(server, tmpdir):
+    server["files"]["target"] = b"target"
+    path = str(tmpdir) + "/target"
+    pmb.helpers.http.fetch(server["url"] + "redirect/target", path)
+    with open(path, "rb") as handle:
+        assert handle.read() == b"target"
+
+    with pytest.raises(RuntimeError) as e:
+        pmb.helpers.http.fetch(server["url"] + "missing", path + "2")
+    assert "HTTP status 404" in str(e.value)
+    assert not os.path.exists(path + "2")
+
+
+def test_fetch_many(server, tmpdir):
+    jobs = []
+    for i in range(20):
+        name = "file" + str(i)
+        server["files"][name] = name.encode() * 1000
+        jobs.append({"url": server["url"] + name,
+                     "path": str(tmpdir) + "/" + name})
+    jobs.append({"url": server["url"] + "missing",
+                 "path": str(tmpdir) + "/missing"})
+
+    errors = pmb.helpers.http.fetch_many(jobs, 4)
+    assert errors[:20] == [None] * 20
+    assert isinstance(errors[20], RuntimeError)
+    for job in jobs[:20]:
+        with open(job["path"], "rb") as handle:
+            assert handle.read() == server["files"][os.path.basename(
+                job["path"])]
+
+    # Connections get reused instead of opening one per file
+    assert server["connections"] <= 4
+
+
+def test_download_revalidate(args, server):
+    server["files"]["index"] = b"version 1"
+    url = server["url"] + "index"
+    path = pmb.helpers.http.download(args, url, "index", max_age=3600)
+    meta = pmb.helpers.http.meta_read(path)
+    assert meta["etag"] == '"' + hashlib.sha256(b"version 1").hexdigest() + '"'
+
+    # Checked recently: no request
+    pmb.helpers.http.download(args, url, "index", max_age=3600)
+    assert len(server["requests"]) == 1
+
+    # Expired and not modified: 304, file and content stay the same
+    pmb.helpers.http.download(args, url, "index", max_age=0)
+    assert len(server["requests"]) == 2
+    assert pmb.helpers.http.meta_read(path)["checked"] > meta["checked"]
+    with open(path, "rb") as handle:
+        assert handle.read() == b"version 1"
+
+    # Expired and modified: download the new version
+    server["files"]["index"] = b"version 2"
+    pmb.helpers.http.download(args, url, "index", max_age=0)
+    with open(path, "rb") as handle:
+        assert handle.read() == b"version 2"
+
+    # Offline: use the cached file without asking the server
+    args.offline = True
+    pmb.helpers.http.download(args, url, "index", max_age=0)
+    assert len(server["requests"]) == 3
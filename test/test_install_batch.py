@@ -0,0 +1,103 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.logging
+import pmb.install.batch
+import pmb.parse.depends
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "install", "--devices",
+                "samsung-i9100,huawei-angler, samsung-i9100,lg-mako"]
+    args = pmb.parse.arguments()
+    args.log = str(tmpdir) + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir)
+    args.ui = "weston"
+    args.extra_packages = "none"
+    args.add = "vim"
+    return args
+
+
+def test_devices(args):
+    assert pmb.install.batch.devices(args) == ["samsung-i9100",
+                                               "huawei-angler", "lg-mako"]
+
+    # All devices, except for the ones with an arch that is not enabled
+    args.all_devices = True
+    devices = pmb.install.batch.devices(args)
+    assert "samsung-i9100" in devices
+    assert "huawei-angler" in devices
+
+
+def test_device_args(args):
+    args_i9100 = pmb.install.batch.device_args(args, "samsung-i9100")
+    assert args_i9100.deviceinfo["arch"] == "armhf"
+    args_angler = pmb.install.batch.device_args(args_i9100, "huawei-angler")
+    assert args_angler.deviceinfo["arch"] == "aarch64"
+    assert args_i9100.device == "samsung-i9100"
+    assert args_i9100.deviceinfo["arch"] == "armhf"
+
+
+def test_packages_and_groups(args, monkeypatch):
+    args_devices = [pmb.install.batch.device_args(args, device) for device in
+                    pmb.install.batch.devices(args)]
+
+    # Dependencies of the device packages (without parsing APKINDEX files)
+    def recurse(args, pkgnames, arch, strict=False):
+        assert strict
+        ret = list(pkgnames)
+        for pkgname in pkgnames:
+            if pkgname.startswith("device-"):
+                ret.append("linux-" + pkgname[len("device-"):])
+        return ret
+    monkeypatch.setattr(pmb.parse.depends, "recurse", recurse)
+
+    # Packages of each device, and the union to build once per arch
+    install_packages, build = pmb.install.batch.packages(args_devices)
+    assert install_packages["lg-mako"] == ["postmarketos-base", "ttf-droid",
+                                           "device-lg-mako",
+                                           "postmarketos-ui-weston", "vim"]
+    assert build.count(("postmarketos-base", "armhf")) == 1
+    assert ("postmarketos-base", "aarch64") in build
+    assert ("device-lg-mako", "armhf") in build
+    assert ("device-lg-mako", "aarch64") not in build
+    assert ("linux-lg-mako", "armhf") in build
+    assert ("linux-huawei-angler", "aarch64") in build
+
+    # One group per arch, the order of the devices is kept
+    groups = pmb.install.batch.groups(args_devices)
+    assert [[args.device for args in group] for group in groups] == [
+        ["huawei-angler"], ["samsung-i9100", "lg-mako"]]
+
+
+def test_install_sdcard(args):
+    args.sdcard = "/dev/mmcblk0"
+    with pytest.raises(RuntimeError) as e:
+        pmb.install.batch.install(args)
+    assert "sdcard" in str(e.value)
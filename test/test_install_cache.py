@@ -0,0 +1,201 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import importlib
+import os
+import subprocess
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.config
+import pmb.helpers.logging
+import pmb.helpers.run
+import pmb.install.cache
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "install"]
+    args = pmb.parse.arguments()
+    args.log = str(tmpdir) + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir)
+    args.device = "test-device"
+    args.deviceinfo = {"arch": "armhf", "flash_sparse": "false"}
+    args.image_cache_count = "3"
+
+    # Device rootfs with two packages
+    rootfs = args.work + "/chroot_rootfs_test-device"
+    os.makedirs(rootfs + "/lib/apk/db")
+    os.makedirs(rootfs + "/etc")
+    write_installed(args, "1.0-r0")
+    with open(rootfs + "/etc/os-release", "w") as handle:
+        handle.write('NAME="postmarketOS"\n'
+                     'VERSION="0.1.0-12345678"\n'
+                     'PMOS_HASH="1234567890abcdef"\n')
+    return args
+
+
+def write_installed(args, version, checksum="Q1abc="):
+    path = args.work + "/chroot_rootfs_test-device/lib/apk/db/installed"
+    with open(path, "w") as handle:
+        handle.write("C:Q1xyz=\nP:busybox\nV:1.27.2-r0\nA:armhf\n"
+                     "F:bin\nR:busybox\n\n"
+                     "C:" + checksum + "\nP:device-test-device\nV:" +
+                     version + "\nA:noarch\n\n")
+
+
+def test_manifest(args):
+    manifest = pmb.install.cache.manifest(args)
+    assert manifest["packages"] == {
+        "busybox": {"version": "1.27.2-r0", "checksum": "Q1xyz="},
+        "device-test-device": {"version": "1.0-r0", "checksum": "Q1abc="}}
+    assert manifest["os_release"]["PMOS_HASH"] == "1234567890abcdef"
+    assert manifest["options"]["target"] == "image"
+    assert manifest["options"]["device"] == "test-device"
+
+
+def test_key(args):
+    key = pmb.install.cache.key(pmb.install.cache.manifest(args))
+    assert len(key) == 64
+    assert key == pmb.install.cache.key(pmb.install.cache.manifest(args))
+
+    # Different options
+    args.cipher = "serpent-xts-plain64"
+    key_cipher = pmb.install.cache.key(pmb.install.cache.manifest(args))
+    assert key_cipher != key
+    args.android_recovery_zip = True
+    key_zip = pmb.install.cache.key(pmb.install.cache.manifest(args))
+    assert key_zip not in [key, key_cipher]
+
+    # Rebuilt package with the same version
+    args.android_recovery_zip = False
+    write_installed(args, "1.0-r0", "Q1def=")
+    assert pmb.install.cache.key(pmb.install.cache.manifest(args)) not in [
+        key, key_cipher]
+
+
+def test_files(args, monkeypatch):
+    monkeypatch.setenv("HOME", args.work + "/home")
+    key = pmb.install.cache.key(pmb.install.cache.manifest(args))
+
+    # New apk signing key
+    os.makedirs(args.work + "/config_apk_keys")
+    path_key = args.work + "/config_apk_keys/test.rsa.pub"
+    with open(path_key, "w") as handle:
+        handle.write("key")
+    manifest = pmb.install.cache.manifest(args)
+    assert list(manifest["files"]) == [path_key]
+    key_apk = pmb.install.cache.key(manifest)
+    assert key_apk != key
+
+    # New ssh public key
+    os.makedirs(args.work + "/home/.ssh")
+    with open(args.work + "/home/.ssh/id_rsa.pub", "w") as handle:
+        handle.write("ssh-rsa AAAA test")
+    assert pmb.install.cache.key(pmb.install.cache.manifest(args)) not in [
+        key, key_apk]
+
+
+def test_enabled(args):
+    assert pmb.install.cache.enabled(args)
+    args.sdcard = "/dev/mmcblk0"
+    assert not pmb.install.cache.enabled(args)
+    args.sdcard = None
+    args.image_cache_count = "0"
+    assert not pmb.install.cache.enabled(args)
+
+    # Opt-in
+    assert pmb.config.defaults["image_cache_count"] == "0"
+
+
+def test_lookup(args):
+    key = "a" * 64
+    folder = args.work + "/cache_images/" + key
+    os.makedirs(folder)
+    open(folder + "/test-device.img", "w").close()
+    assert pmb.install.cache.lookup(args, key) is None
+
+    # Complete with the manifest
+    open(folder + "/manifest.json", "w").close()
+    assert pmb.install.cache.lookup(args, key) == (folder +
+                                                   "/test-device.img")
+
+    # Recovery zip is not cached
+    args.android_recovery_zip = True
+    assert pmb.install.cache.lookup(args, key) is None
+
+
+def test_expired():
+    folders = {"a": 100, "b": 300, "c": 200, "d": None, "e": 50}
+    assert pmb.install.cache.expired(folders, 2) == ["a", "d", "e"]
+    assert pmb.install.cache.expired(folders, 0) == ["a", "b", "c", "d", "e"]
+    assert pmb.install.cache.expired({"a": 100}, 3) == []
+
+
+def test_release(args, monkeypatch):
+    """
+    An image, that is hardlinked into the cache, gets detached before it is
+    modified, even with the cache disabled.
+    """
+    monkeypatch.setattr(pmb.helpers.run, "root", lambda args, cmd:
+                        subprocess.check_call(cmd))
+    path = pmb.install.cache.artifact(args)
+    os.makedirs(os.path.dirname(path))
+    os.makedirs(args.work + "/cache_images/key")
+    with open(path, "w") as handle:
+        handle.write("image")
+    os.link(path, args.work + "/cache_images/key/test-device.img")
+
+    # install_device() calls release() before changing anything
+    released = []
+    install = importlib.import_module("pmb.install.install")
+    monkeypatch.setattr(pmb.install.cache, "release", lambda args:
+                        released.append(args.device))
+
+    def set_user_password(args):
+        raise RuntimeError("stop")
+    monkeypatch.setattr(install, "set_user_password", set_user_password)
+    args.image_cache_count = "0"
+    with pytest.raises(RuntimeError):
+        install.install_device(args)
+    assert released == ["test-device"]
+    monkeypatch.undo()
+    monkeypatch.setattr(pmb.helpers.run, "root", lambda args, cmd:
+                        subprocess.check_call(cmd))
+
+    # --incremental: real copy, the cached file stays the same
+    args.incremental = True
+    pmb.install.cache.release(args)
+    assert os.stat(path).st_nlink == 1
+    with open(path, "w") as handle:
+        handle.write("modified")
+    with open(args.work + "/cache_images/key/test-device.img") as handle:
+        assert handle.read() == "image"
+
+    # Otherwise the hardlink just gets removed
+    os.unlink(path)
+    os.link(args.work + "/cache_images/key/test-device.img", path)
+    args.incremental = False
+    pmb.install.cache.release(args)
+    assert not os.path.exists(path)
@@ -0,0 +1,90 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot
+import pmb.helpers.run
+import pmb.install.image
+
+MiB = 1024 * 1024
+
+
+def test_layout():
+    layout = pmb.install.image.layout(300 * MiB, 40.5 * MiB)
+    assert layout == {"image": 300, "boot": (1, 40), "root": (41, 259),
+                      "inodes": None}
+
+    # Partitions are next to each other and fill the image
+    start, size = layout["root"]
+    assert start + size == layout["image"]
+    assert sum(layout["boot"]) == start
+
+
+def test_layout_boot_too_big():
+    with pytest.raises(RuntimeError) as e:
+        pmb.install.image.layout(40 * MiB, 40 * MiB)
+    assert "does not fit into the image" in str(e.value)
+
+
+def test_stage(tmpdir, monkeypatch):
+    """
+    Writing to the apk keys of the staged root filesystem must not modify
+    the device rootfs chroot (the other files are hardlinks).
+    """
+    args = argparse.Namespace(work=str(tmpdir), device="test-device")
+    native = args.work + "/chroot_native"
+    rootfs = args.work + "/chroot_rootfs_test-device"
+    os.makedirs(native + "/home/user")
+    for folder in ["/boot", "/etc/apk/keys", "/home/user"]:
+        os.makedirs(rootfs + folder)
+    for file in ["/boot/vmlinuz", "/etc/hostname", "/etc/apk/keys/a.pub"]:
+        with open(rootfs + file, "w") as handle:
+            handle.write("old\n")
+
+    # Run the commands on the host, with the paths inside the native chroot
+    def run(args, command, *rest, **kwargs):
+        subprocess.check_call(command)
+
+    def chroot(args, command, *rest, **kwargs):
+        subprocess.check_call([native + arg if arg.startswith("/") else arg
+                               for arg in command])
+    monkeypatch.setattr(pmb.helpers.run, "root", run)
+    monkeypatch.setattr(pmb.chroot, "root", chroot)
+    monkeypatch.setattr(pmb.chroot, "user", chroot)
+    pmb.install.image.stage(args)
+
+    root = native + pmb.install.image.paths(args)["root"]
+    boot = native + pmb.install.image.paths(args)["boot"]
+    assert os.path.exists(boot + "/vmlinuz")
+    assert os.listdir(root + "/home") == []
+    assert os.stat(root + "/etc/hostname").st_ino == \
+        os.stat(rootfs + "/etc/hostname").st_ino
+
+    # Like pmb.install.install.copy_files_other()
+    with open(root + "/etc/apk/keys/a.pub", "w") as handle:
+        handle.write("new\n")
+    with open(rootfs + "/etc/apk/keys/a.pub") as handle:
+        assert handle.read() == "old\n"
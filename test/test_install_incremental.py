@@ -0,0 +1,125 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.logging
+import pmb.helpers.run
+import pmb.helpers.sparse
+import pmb.install.incremental
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = str(tmpdir) + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    args.work = str(tmpdir)
+    args.device = "test-device"
+    args.sdcard = None
+    args.full_disk_encryption = False
+    args.backend = "sudo"
+    return args
+
+
+def create_image(args):
+    """
+    Image with a msdos partition table, a 4 MiB ext2 boot partition and an
+    8 MiB ext4 root partition (like pmb/install/image.py creates it).
+    """
+    folder = args.work + "/chroot_native/home/user/rootfs"
+    os.makedirs(folder)
+    path = folder + "/" + args.device + ".img"
+    with open(path, "wb") as handle:
+        handle.truncate(13 * MiB)
+        mbr = bytearray(512)
+        for i, (start, size) in enumerate([(1, 4), (5, 8)]):
+            entry = struct.pack("<8xII", start * 2048, size * 2048)
+            mbr[446 + i * 16:446 + (i + 1) * 16] = entry
+        mbr[510:512] = b"\x55\xaa"
+        handle.write(mbr)
+
+    for name, fstype, start, size in [("boot", "ext2", 1, 4),
+                                      ("root", "ext4", 5, 8)]:
+        fs = str(args.work) + "/" + name + ".img"
+        subprocess.check_call(["mke2fs", "-q", "-F", "-t", fstype, "-b",
+                               "4096", "-N", "128", fs, str(size) + "M"])
+        with open(fs, "rb") as source, open(path, "r+b") as target:
+            target.seek(start * MiB)
+            target.write(source.read())
+    return path
+
+
+def test_partitions(args):
+    assert pmb.install.incremental.check(args) == "no existing image"
+    folder = args.work + "/chroot_native/home/user/rootfs"
+    os.makedirs(folder)
+    with open(folder + "/" + args.device + ".img", "wb") as handle:
+        handle.write(bytes(1024))
+    assert pmb.install.incremental.check(args) == \
+        "unexpected partition table"
+
+    args.full_disk_encryption = True
+    assert "full disk encryption" in pmb.install.incremental.check(args)
+
+
+@pytest.mark.skipif(not shutil.which("mke2fs"),
+                    reason="mke2fs is not installed")
+def test_check_sizes(args):
+    path = create_image(args)
+    assert pmb.install.incremental.partitions(path) == [(MiB, 4 * MiB),
+                                                        (5 * MiB, 8 * MiB)]
+    assert pmb.install.incremental.filesystem(path, 5 * MiB) == \
+        {"size": 8 * MiB, "inodes": 128}
+    assert pmb.install.incremental.filesystem(path, 0) is None
+    assert pmb.install.incremental.check(args) is None
+
+    sizes = {"boot": {"size": 4 * MiB, "inodes": 100},
+             "root": {"size": 6 * MiB, "inodes": 128}}
+    assert pmb.install.incremental.check_sizes(args, sizes) is None
+    sizes["root"]["inodes"] = 200
+    assert "the root partition is too small" in \
+        pmb.install.incremental.check_sizes(args, sizes)
+
+
+@pytest.mark.skipif(not shutil.which("mke2fs"),
+                    reason="mke2fs is not installed")
+def test_check_sparse(args, monkeypatch):
+    # The sparse image gets converted back, "mv" runs as root usually
+    path = create_image(args)
+    with open(path, "rb") as handle:
+        raw = handle.read()
+    pmb.helpers.sparse.write(path, path + ".sparse")
+    os.rename(path + ".sparse", path)
+    monkeypatch.setattr(pmb.helpers.run, "root", pmb.helpers.run.user)
+    assert pmb.install.incremental.check(args) is None
+    with open(path, "rb") as handle:
+        assert handle.read() == raw
@@ -0,0 +1,98 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.install.size
+
+
+def create_rootfs(path):
+    os.makedirs(path + "/boot")
+    os.makedirs(path + "/home/user")
+    os.makedirs(path + "/usr/lib")
+    with open(path + "/boot/vmlinuz", "wb") as handle:
+        handle.write(b"k" * 100000)
+    with open(path + "/home/user/big", "wb") as handle:
+        handle.write(b"h" * 1000000)
+    for i in range(20):
+        with open(path + "/usr/lib/file" + str(i), "wb") as handle:
+            handle.write(b"x" * 5000)
+    os.link(path + "/usr/lib/file0", path + "/usr/lib/hardlink")
+    os.symlink("file1", path + "/usr/lib/short")
+    os.symlink("x" * 100, path + "/usr/lib/long")
+
+
+def test_walk(tmpdir):
+    path = str(tmpdir) + "/rootfs"
+    create_rootfs(path)
+    folders = pmb.install.size.walk(path)
+    assert sorted(folders.keys()) == ["", "boot", "home", "home/user", "usr",
+                                      "usr/lib"]
+
+    # Hardlink counted once, long symlink needs a block
+    lib = folders["usr/lib"]
+    assert lib["inodes"] == 1 + 20 + 2
+    assert lib["blocks_ext4"] == 20 * 2 + 1 + 1
+    assert lib["bytes"] == 20 * 5000 + 5 + 100
+
+    # ext2 needs an indirect block for files with more than 12 blocks
+    assert folders["boot"]["blocks_ext4"] == 25 + 1
+    assert folders["boot"]["blocks_ext2"] == 25 + 1 + 1
+
+    # Content of excluded folders is left out
+    root = pmb.install.size.total(folders, exclude=["boot", "home"])
+    assert root["bytes"] == lib["bytes"]
+    assert root["inodes"] == 1 + 1 + 1 + 1 + lib["inodes"]
+    assert pmb.install.size.total(folders, "boot") == folders["boot"]
+
+    assert pmb.install.size.top(folders, 2) == [("home/user", 1000000),
+                                                ("usr/lib", 100105)]
+
+
+def test_filesystem_margin():
+    entry_stats = {"inodes": 20000, "blocks_ext4": 50000, "bytes": 0}
+    fs = pmb.install.size.filesystem(entry_stats, "ext4")
+    fs_margin = pmb.install.size.filesystem(entry_stats, "ext4", 20)
+    assert fs["size"] > 50000 * 4096
+    assert fs["inodes"] >= 20000 + 11
+    assert fs_margin["size"] > fs["size"] * 1.15
+    assert fs_margin["inodes"] >= 24000
+
+
+@pytest.mark.skipif(not shutil.which("mke2fs"),
+                    reason="mke2fs is not installed")
+@pytest.mark.parametrize("fstype", ["ext2", "ext4"])
+def test_filesystem_fits(tmpdir, fstype):
+    path = str(tmpdir) + "/rootfs"
+    create_rootfs(path)
+    for i in range(2000):
+        with open(path + "/usr/lib/small" + str(i), "w") as handle:
+            handle.write("small")
+    fs = pmb.install.size.filesystem(
+        pmb.install.size.total(pmb.install.size.walk(path)), fstype)
+    subprocess.check_call(["mke2fs", "-t", fstype, "-F", "-q", "-b", "4096",
+                           "-N", str(fs["inodes"]), "-d", path,
+                           str(tmpdir) + "/fs.img",
+                           str(fs["size"] // 1024) + "k"])
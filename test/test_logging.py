@@ -0,0 +1,90 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import gzip
+import logging
+import os
+import sys
+import time
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.config
+import pmb.helpers.logging
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = str(tmpdir) + "/log.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    return args
+
+
+def read(path):
+    with open(path) as handle:
+        return handle.read()
+
+
+def test_buffered_log(args, monkeypatch):
+    monkeypatch.setattr(pmb.config, "log_flush_interval", 0.2)
+    args.logfd.stop()
+    args.logfd.start()
+
+    # Gets written by the background thread
+    logging.debug("first message")
+    assert "first message" not in read(args.log)
+    time.sleep(0.5)
+    assert "first message" in read(args.log)
+
+    # Explicit flush
+    logging.debug("second message")
+    args.logfd.flush()
+    assert "second message" in read(args.log)
+
+
+def test_buffered_log_suspend(args):
+    pmb.helpers.logging.suspend(args)
+    assert args.logfd.thread is None
+    logging.debug("while suspended")
+    pmb.helpers.logging.resume(args)
+    assert args.logfd.thread.is_alive()
+
+    # Closing writes everything
+    args.logfd.close()
+    assert "while suspended" in read(args.log)
+
+
+def test_buffered_log_rotate(args, monkeypatch):
+    monkeypatch.setattr(pmb.config, "log_rotate_size", 1000)
+    monkeypatch.setattr(pmb.config, "log_rotate_count", 2)
+    for i in range(4):
+        args.logfd.write(str(i) * 1000 + "\n")
+        args.logfd.flush()
+
+    assert read(args.log) == ""
+    with gzip.open(args.log + ".1.gz", "rt") as handle:
+        assert handle.read() == "3" * 1000 + "\n"
+    with gzip.open(args.log + ".2.gz", "rt") as handle:
+        assert handle.read() == "2" * 1000 + "\n"
+    assert not os.path.exists(args.log + ".3.gz")
@@ -0,0 +1,153 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import gzip
+import os
+import stat
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.parse.cpio
+
+
+def entry(name, mode, data=b"", ino=1, nlink=1, mtime=1500000000):
+    """
+    :returns: one entry of a newc cpio archive, like "cpio -H newc" writes it
+    """
+    name = name.encode("utf-8") + b"\0"
+    fields = [ino, mode, 0, 0, nlink, mtime, len(data), 0, 0, 0, 0,
+              len(name), 0]
+    ret = b"070701" + b"".join(b"%08X" % field for field in fields) + name
+    ret += bytes(-len(ret) % 4) + data
+    return ret + bytes(-len(ret) % 4)
+
+
+def archive(entries):
+    ret = b"".join(entries) + entry("TRAILER!!!", 0, ino=0)
+    return ret + bytes(-len(ret) % 512)
+
+
+@pytest.fixture
+def initfs(tmpdir):
+    """
+    Two concatenated archives (like an early microcode archive in front of
+    the initramfs), gzip compressed.
+    """
+    first = archive([entry(".", stat.S_IFDIR | 0o755, ino=1),
+                     entry("kernel", stat.S_IFDIR | 0o700, ino=2)])
+    second = archive([
+        entry("bin", stat.S_IFDIR | 0o755, ino=3),
+        entry("bin/busybox", stat.S_IFREG | 0o755, b"busybox" * 1000, ino=4),
+        entry("bin/sh", stat.S_IFLNK | 0o777, b"busybox", ino=5),
+        # Hardlinks: only the last one has the content
+        entry("init", stat.S_IFREG | 0o755, ino=6, nlink=2),
+        entry("init_link", stat.S_IFREG | 0o755, b"#!/bin/sh\n", ino=6,
+              nlink=2),
+        entry("dev/console", stat.S_IFCHR | 0o600, ino=7),
+        entry("../evil", stat.S_IFREG | 0o644, b"evil", ino=8),
+        entry("evil_link", stat.S_IFLNK | 0o777, b"/tmp", ino=9),
+        entry("evil_link/file", stat.S_IFREG | 0o644, b"evil", ino=10),
+    ])
+    path = str(tmpdir) + "/initramfs"
+    with gzip.open(path, "wb") as handle:
+        handle.write(first + second)
+    return path
+
+
+def test_ls(initfs):
+    lines = pmb.parse.cpio.ls(initfs)
+    assert len(lines) == 11
+    assert lines[0] == "drwxr-xr-x 0/0               0 ."
+    assert lines[3] == "-rwxr-xr-x 0/0            7000 bin/busybox"
+    assert lines[4] == "lrwxrwxrwx 0/0               7 bin/sh -> busybox"
+    assert lines[7] == "crw------- 0/0               0 dev/console"
+
+
+def test_extract(initfs, tmpdir):
+    folder = str(tmpdir) + "/extracted"
+    skipped = pmb.parse.cpio.extract(initfs, folder)
+    assert skipped == ["dev/console", "../evil", "evil_link/file"]
+    assert sorted(os.listdir(folder)) == ["bin", "evil_link", "init",
+                                          "init_link", "kernel"]
+    with open(folder + "/bin/busybox", "rb") as handle:
+        assert handle.read() == b"busybox" * 1000
+    assert stat.S_IMODE(os.stat(folder + "/bin/busybox").st_mode) == 0o755
+    assert stat.S_IMODE(os.stat(folder + "/kernel").st_mode) == 0o700
+    assert os.stat(folder + "/kernel").st_mtime == 1500000000
+    assert os.readlink(folder + "/bin/sh") == "busybox"
+    assert not os.path.exists(str(tmpdir) + "/evil")
+
+    # Hardlinks
+    with open(folder + "/init", "rb") as handle:
+        assert handle.read() == b"#!/bin/sh\n"
+    assert os.stat(folder + "/init").st_ino == \
+        os.stat(folder + "/init_link").st_ino
+
+    # Extracting again replaces the files
+    assert pmb.parse.cpio.extract(initfs, folder) == skipped
+
+
+def test_uncompressed_and_invalid(tmpdir):
+    path = str(tmpdir) + "/archive.cpio"
+    with open(path, "wb") as handle:
+        handle.write(archive([entry("file", stat.S_IFREG | 0o644, b"abc")]))
+    assert pmb.parse.cpio.ls(path) == ["-rw-r--r-- 0/0               3 file"]
+
+    with open(path, "wb") as handle:
+        handle.write(b"070707" + bytes(200))
+    with pytest.raises(RuntimeError) as e:
+        pmb.parse.cpio.ls(path)
+    assert "newc" in str(e.value)
+
+    with open(path, "wb") as handle:
+        handle.write(entry("file", stat.S_IFREG | 0o644, b"abc" * 10)[:-10])
+    with pytest.raises(RuntimeError) as e:
+        pmb.parse.cpio.ls(path)
+    assert "end of the cpio archive" in str(e.value)
+
+
+def test_extract_readonly_folder(tmpdir):
+    """
+    Folders without write permission get their mode after their content
+    has been extracted (works without root privileges).
+    """
+    path = str(tmpdir) + "/archive.cpio"
+    with open(path, "wb") as handle:
+        handle.write(archive([
+            entry("lib", stat.S_IFDIR | 0o555, ino=1),
+            entry("lib/modules", stat.S_IFDIR | 0o555, ino=2),
+            entry("lib/modules/test.ko", stat.S_IFREG | 0o444, b"ko", ino=3,
+                  nlink=2),
+            entry("lib/modules/link.ko", stat.S_IFREG | 0o444, b"ko", ino=3,
+                  nlink=2)]))
+    folder = str(tmpdir) + "/extracted"
+    try:
+        assert pmb.parse.cpio.extract(path, folder) == []
+        with open(folder + "/lib/modules/link.ko", "rb") as handle:
+            assert handle.read() == b"ko"
+        for dir in ["/lib", "/lib/modules"]:
+            assert stat.S_IMODE(os.stat(folder + dir).st_mode) == 0o555
+        assert stat.S_IMODE(os.stat(folder + "/lib/modules/test.ko")
+                            .st_mode) == 0o444
+    finally:
+        for dir in ["/lib", "/lib/modules"]:
+            if os.path.exists(folder + dir):
+                os.chmod(folder + dir, 0o755)
@@ -0,0 +1,82 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.logging
+import pmb.helpers.profile
+import pmb.helpers.run
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "--profile", str(tmpdir) + "/trace.json",
+                "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    return args
+
+
+def test_profile_disabled(args):
+    args.profile = None
+    pmb.helpers.run.user(args, ["true"])
+    pmb.helpers.profile.step(args, "install", "(1/5) test")
+    pmb.helpers.profile.write(args)
+    assert args.cache.profile_events == []
+
+
+def test_profile_trace(args):
+    pmb.helpers.profile.step(args, "install", "(1/5) first")
+    with pmb.helpers.profile.span(args, "span", key="value"):
+        pmb.helpers.run.user(args, ["sh", "-c", "exit 3"], check=False)
+    pmb.helpers.profile.step(args, "install", "(2/5) second")
+    pmb.helpers.run.user(args, ["true"])
+    pmb.helpers.profile.write(args)
+
+    with open(args.profile) as handle:
+        events = json.load(handle)["traceEvents"]
+    assert events[0]["ph"] == "M"
+    events = {event["name"]: event for event in events[1:]}
+    assert sorted(events.keys()) == ["% sh -c exit 3", "% true",
+                                     "(1/5) first", "(2/5) second",
+                                     "pmbootstrap chroot", "span"]
+    for event in events.values():
+        assert event["ph"] == "X"
+        assert event["ts"] >= 0 and event["dur"] >= 0
+
+    command = events["% sh -c exit 3"]
+    assert command["cat"] == "command"
+    assert command["args"] == {"command": "sh -c exit 3", "suffix": "host",
+                               "exit": 3}
+    assert events["span"]["args"] == {"key": "value"}
+
+    # Steps follow each other, the command is inside the first step
+    first = events["(1/5) first"]
+    second = events["(2/5) second"]
+    assert first["ts"] + first["dur"] == second["ts"]
+    assert first["ts"] <= command["ts"]
+    assert command["ts"] + command["dur"] <= second["ts"]
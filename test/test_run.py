@@ -0,0 +1,104 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import concurrent.futures
+import os
+import sys
+import time
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.logging
+import pmb.helpers.run
+import pmb.helpers.run_async
+
+
+@pytest.fixture
+def args(request, tmpdir):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = str(tmpdir) + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    return args
+
+
+def read_log(args):
+    args.logfd.flush()
+    with open(args.log) as handle:
+        return handle.read()
+
+
+def test_working_dir(args, tmpdir):
+    cwd = os.getcwd()
+    ret = pmb.helpers.run.user(args, ["pwd"], working_dir=str(tmpdir),
+                               return_stdout=True)
+    assert ret == str(tmpdir) + "\n"
+    assert os.getcwd() == cwd
+
+    # Failing command: working directory of pmbootstrap stays the same too
+    with pytest.raises(RuntimeError):
+        pmb.helpers.run.user(args, ["false"], working_dir=str(tmpdir))
+    assert os.getcwd() == cwd
+    assert pmb.helpers.run.user(args, ["false"], check=False) is None
+
+
+def test_threads_complete_lines(args):
+    script = "for i in $(seq 1 200); do echo {0}-$i-{0}; done"
+    cmds = [["sh", "-c", script.format(i)] for i in range(8)]
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        for future in [executor.submit(pmb.helpers.run.user, args, cmd)
+                       for cmd in cmds]:
+            future.result()
+
+    lines = [line for line in read_log(args).splitlines()
+             if not line.startswith("(")]
+    assert len(lines) == 8 * 200
+    for line in lines:
+        words = line.split("-")
+        assert len(words) == 3 and words[0] == words[2]
+
+
+def test_run_async(args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        before = time.time()
+        run_async = pmb.helpers.run_async.run_async
+        futures = [run_async(args, ["sh", "-c", "sleep 0.5; echo " + str(i)],
+                             return_stdout=True, loop=loop)
+                   for i in range(5)]
+        results = loop.run_until_complete(asyncio.gather(*futures))
+        assert results == [str(i) + "\n" for i in range(5)]
+        assert time.time() - before < 2
+
+        # Failing commands
+        future = run_async(args, ["sh", "-c", "echo err >&2; exit 3"],
+                           check=False, loop=loop)
+        assert loop.run_until_complete(future) == 3
+        assert "err\n" in read_log(args)
+        future = run_async(args, ["false"], loop=loop)
+        with pytest.raises(RuntimeError):
+            loop.run_until_complete(future)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,154 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import sys
+import threading
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb
+import pmb.config
+import pmb.session
+
+
+@pytest.fixture
+def session(request, tmpdir):
+    with open(str(tmpdir) + "/pmbootstrap.cfg", "w") as handle:
+        handle.write("[pmbootstrap]\n")
+    session = pmb.Session(config=str(tmpdir) + "/pmbootstrap.cfg",
+                          work=str(tmpdir) + "/work")
+    request.addfinalizer(session.args.logfd.close)
+    return session
+
+
+def test_session_options(session, tmpdir):
+    assert session.config["work"] == str(tmpdir) + "/work"
+    assert session.args.log == str(tmpdir) + "/work/log.txt"
+
+    args = session.command_args(["build", "hello-world"], force=True)
+    assert args.action == "build"
+    assert args.force is True
+    assert args.cache is session.caches
+    assert session.args.action is None
+
+    with pytest.raises(ValueError) as e:
+        session.command_args(["build", "hello-world"], invalid_option=True)
+    assert "Invalid option for build: invalid_option" in str(e.value)
+
+
+def test_session_invalid_option(tmpdir):
+    with pytest.raises(ValueError) as e:
+        pmb.Session(work=str(tmpdir), invalid_option=True)
+    assert "invalid_option" in str(e.value)
+
+
+def test_session_command(session, capsys):
+    assert session.command(["parse_apkbuild", "hello-world"]) == 0
+    assert '"pkgname": "hello-world"' in capsys.readouterr()[0]
+    path = pmb.config.pmb_src + "/aports/main/hello-world/APKBUILD"
+    assert path in session.caches.apkbuild
+
+    # The parsed APKBUILD is kept for the next command
+    session.caches.apkbuild[path]["pkgdesc"] = "from the cache"
+    assert session.command(["parse_apkbuild", "hello-world"]) == 0
+    assert "from the cache" in capsys.readouterr()[0]
+
+
+def test_caches_chroot_checks(tmpdir):
+    work = str(tmpdir)
+    caches = pmb.session.Caches()
+    os.mkdir(work + "/chroot_native")
+    assert not caches.chroot_checked(work, "native", "check")
+    caches.chroot_check_done(work, "native", "check")
+    assert caches.chroot_checked(work, "native", "check")
+    assert not caches.chroot_checked(work, "native", "other_check")
+
+    # Zapped and created again
+    shutil.rmtree(work + "/chroot_native")
+    assert not caches.chroot_checked(work, "native", "check")
+    os.mkdir(work + "/chroot_native")
+    assert not caches.chroot_checked(work, "native", "check")
+
+    caches.chroot_check_done(work, "native", "check")
+    caches.invalidate_chroot("native")
+    assert not caches.chroot_checked(work, "native", "check")
+
+
+def test_lru_cache():
+    cache = pmb.session.LRUCache(max_entries=3, max_bytes=100)
+    assert cache.get("a", 1) is None
+    for key in ["a", "b", "c"]:
+        cache.set(key, key.upper(), 10, lastmod=1)
+    assert cache.get("a", 1) == "A"
+
+    # Too many entries: "b" is the least recently used one
+    cache.set("d", "D", 10, lastmod=1)
+    assert list(cache.keys()) == ["c", "a", "d"]
+
+    # Too big: only "d" and "e" fit
+    cache.set("e", "E", 85, lastmod=1)
+    assert list(cache.keys()) == ["d", "e"]
+    assert cache.bytes == 95
+
+    # Modified file
+    assert cache.get("e", 2) is None
+    assert "e" not in cache
+
+    # A single entry bigger than the limit gets cached anyway
+    cache.set("f", "F", 1000, lastmod=1)
+    assert list(cache.keys()) == ["f"]
+    assert cache.stats() == {"entries": 1, "max_entries": 3,
+                             "bytes": 1000, "max_bytes": 100,
+                             "hits": 1, "misses": 2, "evictions": 4}
+
+
+def test_lru_cache_threads():
+    """
+    The device rootfs chroots of "install --devices" get created in multiple
+    threads, which share the caches.
+    """
+    cache = pmb.session.LRUCache(max_entries=8, max_bytes=100)
+
+    def work(thread):
+        for i in range(2000):
+            key = (thread + i) % 20
+            if cache.get(key, 1) is None:
+                cache.set(key, i, 10, lastmod=1)
+
+    threads = [threading.Thread(target=work, args=(thread,))
+               for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) <= 8
+    assert cache.bytes == 10 * len(cache)
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 8000
+
+
+def test_stats_caches(session, capsys):
+    session.command(["parse_apkbuild", "hello-world"])
+    session.command(["parse_apkbuild", "hello-world"])
+    assert session.command(["stats", "--caches"]) == 0
+    assert "apkbuild: 1/4096 entries, 0.0/16.0 MiB, 1 hits, 1 misses," \
+        " 0 evictions" in capsys.readouterr()[1]
@@ -0,0 +1,96 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.helpers.sparse
+
+block = 4096
+
+
+def create_raw(path):
+    """
+    Image with random data, zeros, a fill pattern, a hole and a partial
+    block at the end.
+    """
+    with open(path, "wb") as handle:
+        handle.write(os.urandom(3 * block))
+        handle.write(bytes(2 * block))
+        handle.write(b"\x01\x02\x03\x04" * block)
+        handle.seek(256 * block, os.SEEK_CUR)
+        handle.write(os.urandom(block + 100))
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+def read(path):
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+def test_sparse_roundtrip(tmpdir):
+    raw = str(tmpdir) + "/raw.img"
+    content = create_raw(raw)
+    padded = content + bytes(block - 100)
+    stats = pmb.helpers.sparse.write(raw, str(tmpdir) + "/sparse.img")
+    assert stats["blocks"] == len(padded) // block
+    assert stats["raw"] == 5
+    assert stats["raw"] + stats["fill"] + stats["dont_care"] == \
+        stats["blocks"]
+
+    kinds = [chunk[0] for chunk in pmb.helpers.sparse.chunks(
+        str(tmpdir) + "/sparse.img", data=False)]
+    assert kinds[:3] == [pmb.helpers.sparse.chunk_raw,
+                         pmb.helpers.sparse.chunk_fill,
+                         pmb.helpers.sparse.chunk_fill]
+    assert kinds[-1] == pmb.helpers.sparse.chunk_raw
+
+    pmb.helpers.sparse.unsparse(str(tmpdir) + "/sparse.img",
+                                str(tmpdir) + "/unsparse.img")
+    assert read(str(tmpdir) + "/unsparse.img") == padded
+
+
+@pytest.mark.skipif(not shutil.which("simg2img"),
+                    reason="simg2img is not installed")
+def test_sparse_simg2img(tmpdir):
+    raw = str(tmpdir) + "/raw.img"
+    content = create_raw(raw) + bytes(block - 100)
+    pmb.helpers.sparse.write(raw, str(tmpdir) + "/sparse.img")
+    subprocess.check_call(["simg2img", str(tmpdir) + "/sparse.img",
+                           str(tmpdir) + "/simg2img.img"])
+    assert read(str(tmpdir) + "/simg2img.img") == content
+
+
+def test_sparse_empty_and_invalid(tmpdir):
+    path = str(tmpdir) + "/hole.img"
+    with open(path, "wb") as handle:
+        handle.truncate(16 * block)
+    stats = pmb.helpers.sparse.write(path, str(tmpdir) + "/sparse.img")
+    assert stats["raw"] == 0
+    assert stats["blocks"] == 16
+
+    with pytest.raises(RuntimeError) as e:
+        list(pmb.helpers.sparse.chunks(path))
+    assert "Not a sparse image" in str(e.value)
@@ -0,0 +1,101 @@
+"""
+Copyright 2017 Oliver Smith
+
+This file is part of pmbootstrap.
+
+pmbootstrap is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+pmbootstrap is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with pmbootstrap.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sys
+import pytest
+
+# Import from parent directory
+sys.path.append(os.path.realpath(
+    os.path.join(os.path.dirname(__file__) + "/..")))
+import pmb.chroot
+import pmb.helpers.logging
+import pmb.helpers.mount
+import pmb.helpers.run
+import pmb.helpers.userns
+
+
+@pytest.fixture
+def args(request):
+    import pmb.parse
+    sys.argv = ["pmbootstrap.py", "chroot"]
+    args = pmb.parse.arguments()
+    args.log = args.work + "/log_testsuite.txt"
+    pmb.helpers.logging.init(args)
+    request.addfinalizer(args.logfd.close)
+    return args
+
+
+def test_subid_range(tmpdir):
+    path = str(tmpdir) + "/subuid"
+    with open(path, "w") as handle:
+        handle.write("root:10000:100\n"
+                     "1000:100000:65536\n"
+                     "broken line\n")
+
+    assert pmb.helpers.userns.subid_range(path, "root", 0) == (10000, 100)
+    assert pmb.helpers.userns.subid_range(path, "user", 1000) == (100000,
+                                                                  65536)
+    assert pmb.helpers.userns.subid_range(path, "other", 1001) is None
+    assert pmb.helpers.userns.subid_range(path + "_missing", "root",
+                                          0) is None
+
+
+def test_check_supported(args):
+    args.backend = "sudo"
+    pmb.helpers.userns.check_supported(args, "Something")
+
+    args.backend = "userns"
+    with pytest.raises(RuntimeError) as e:
+        pmb.helpers.userns.check_supported(args, "Something")
+    assert "Something is not possible" in str(e.value)
+
+
+def test_sudo_prefix(args):
+    args.backend = "sudo"
+    assert pmb.helpers.run.sudo(args, ["true"]) == ["sudo", "true"]
+
+
+def test_mount_device_nodes(args, tmpdir, monkeypatch):
+    """
+    The bind mounts of the device nodes are private to the namespace of the
+    session, so they get done on every mount (the placeholder files from the
+    last session exist already).
+    """
+    mounted = []
+    monkeypatch.setattr(pmb.helpers.mount, "bind_blockdevice",
+                        lambda args, source, target: mounted.append(
+                            (source, target)))
+    args.work = str(tmpdir)
+    dev = args.work + "/chroot_native/dev"
+
+    # No /dev yet (before apk created the chroot), or sudo backend
+    args.backend = "userns"
+    pmb.chroot.mount_device_nodes(args)
+    os.makedirs(dev)
+    args.backend = "sudo"
+    pmb.chroot.mount_device_nodes(args)
+    assert mounted == []
+
+    args.backend = "userns"
+    for node in ["zero", "full", "random", "urandom"]:
+        open(dev + "/" + node, "w").close()
+    pmb.chroot.mount_device_nodes(args)
+    pmb.chroot.mount_device_nodes(args)
+    assert len(mounted) == 8
+    assert mounted[3] == ("/dev/urandom", dev + "/urandom")